@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+"""
+Batch processing of DailyMed SPL labels.
+
+Reads every label of a directory or a DailyMed zip archive (including the
+release archives that nest one zip per label), runs DrugLabel.process across a
+process pool and streams the results to a JSONL or SQLite sink. A label that
+fails to parse is recorded with its error instead of stopping the batch.
+"""
+import os
+import io
+import sys
+import json
+import zlib
+import logging
+import sqlite3
+import zipfile
+import traceback
+from functools import partial
+from multiprocessing import Pool
+
+from drug_label import DrugLabel, process_streaming, check_field
+from label_cache import LabelCache, content_hash, read_source
+import utils
+import instrumentation
+from instrumentation import METRICS, stage
+
+logger = logging.getLogger(__name__)
+
+## labels handed to a worker per dispatch
+CHUNK_SIZE = 16
+## results per transaction in a SqliteSink
+WRITE_BATCH_SIZE = 500
+
+## per worker process: read side of the label cache, set by init_worker
+CACHE = None
+
+
+def iter_zip_labels(zfile, prefix=""):
+    """
+    Yield (name, xml bytes) for every xml member, descending into nested zips
+    """
+    for zipinfo in zfile.infolist():
+        name = zipinfo.filename
+        lower = name.lower()
+        if lower.endswith(".xml"):
+            yield prefix + name, zfile.read(zipinfo)
+        elif lower.endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(zfile.read(zipinfo))) as inner:
+                yield from iter_zip_labels(inner, prefix + name + "/")
+
+
+def iter_label_sources(source):
+    """
+    Yield (name, source) tasks: file paths for a directory, xml bytes for a zip archive
+
+    Args:
+        source (str): directory of SPL xml files (searched recursively) or a zip archive
+    """
+    if os.path.isdir(source):
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(".xml"):
+                    path = os.path.join(dirpath, filename)
+                    yield path, path
+    else:
+        with zipfile.ZipFile(source) as zfile:
+            yield from iter_zip_labels(zfile)
+
+
+def iter_chunks(iterable, size):
+    """
+    Yield lists of at most size items
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_chunk(worker, tasks):
+    """
+    Worker: run worker on a chunk of tasks.
+
+    Returns:
+        tuple: (results, metrics) - the stage metrics of this chunk only
+    """
+    ## worker processes are reused across chunks - report this chunk only
+    METRICS.reset()
+    return [worker(task) for task in tasks], METRICS.snapshot()
+
+
+def imap_chunks(pool, worker, tasks, chunksize=CHUNK_SIZE):
+    """
+    Yield worker results over tasks as the pool completes them, chunksize
+    tasks per dispatch. The stage metrics of every chunk - DrugLabel parsing
+    runs in the workers - are merged into this process's METRICS.
+    """
+    for results, snapshot in pool.imap_unordered(partial(run_chunk, worker), iter_chunks(tasks, chunksize)):
+        METRICS.merge(snapshot)
+        yield from results
+
+
+def init_worker(cache_path):
+    global CACHE
+    CACHE = LabelCache(cache_path) if cache_path else None
+
+
+def process_document(source, fields=None):
+    return DrugLabel(source).process(fields)
+
+
+def run_label(task, process):
+    """
+    Process one label. Never raises - failures come back as an error result.
+
+    With a cache, the document is hashed first and a cached response returned
+    without parsing; the parent process stores new responses and refreshes
+    recency, so workers only read the cache.
+
+    Returns:
+        dict: {"file", "response"} on success, {"file", "error"} on failure.
+        With a cache also "contentHash" and "cached".
+    """
+    name, source = task
+    try:
+        if CACHE is None:
+            return {"file": name, "response": process(source)}
+
+        data = read_source(source)
+        key = content_hash(data)
+        response = CACHE.get(key, touch=False)
+        if response is not None:
+            return {"file": name, "response": response, "contentHash": key, "cached": True}
+        return {"file": name, "response": process(data), "contentHash": key, "cached": False}
+
+    except Exception as ex:
+        return {"file": name, "error": repr(ex), "traceback": traceback.format_exc()}
+
+
+def process_label(task, fields=None):
+    """
+    Worker: process one label with DrugLabel.process, optionally only fields
+    """
+    return run_label(task, partial(process_document, fields=fields) if fields else process_document)
+
+
+def process_label_streaming(task):
+    """
+    Worker: process one label using the iterparse mode, for very large documents
+    """
+    return run_label(task, process_streaming)
+
+
+class JsonlSink(object):
+    """
+    One JSON result per line
+    """
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, result):
+        self.file.write(json.dumps(result, separators=(",", ":")) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class SqliteSink(object):
+    """
+    Results in a SQLite file: processed labels keyed by file with setId and
+    version, failures in label_errors. Commits every batch_size results, so an
+    interrupted run keeps what it wrote.
+    """
+    DDL = [
+        """CREATE TABLE IF NOT EXISTS processed_labels (
+            file TEXT PRIMARY KEY,
+            set_id TEXT,
+            version TEXT,
+            response BLOB)""",
+        "CREATE INDEX IF NOT EXISTS ix_processed_labels_set_id ON processed_labels (set_id, version)",
+        """CREATE TABLE IF NOT EXISTS label_errors (
+            file TEXT PRIMARY KEY,
+            error TEXT,
+            traceback TEXT)""",
+    ]
+
+    def __init__(self, path, batch_size=WRITE_BATCH_SIZE):
+        self.conn = sqlite3.connect(path)
+        self.batch_size = batch_size
+        self.pending = 0
+        for ddl in self.DDL:
+            self.conn.execute(ddl)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, result):
+        if "error" in result:
+            self.conn.execute("INSERT or REPLACE INTO label_errors VALUES (?,?,?)",
+                              (result["file"], result["error"], result.get("traceback")))
+        else:
+            response = result["response"]
+            body = zlib.compress(json.dumps(response, separators=(",", ":")).encode("utf-8"))
+            self.conn.execute("INSERT or REPLACE INTO processed_labels VALUES (?,?,?,?)",
+                              (result["file"], response.get("setId"), response.get("versionNumber"), body))
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def open_sink(path):
+    """
+    SqliteSink for .db/.sqlite paths, JsonlSink otherwise
+    """
+    if path.endswith((".db", ".sqlite")):
+        return SqliteSink(path)
+    return JsonlSink(path)
+
+
+def process_labels(source, sink, workers=None, chunksize=CHUNK_SIZE, tasks=None, streaming=False,
+                   cache_path=None, fields=None, invalidate_cache=False):
+    """
+    Process every label under source in a process pool, writing results to sink as
+    they complete.
+
+    Args:
+        source (str): directory or zip archive of SPL xml files
+        sink: object with write(result)
+        workers (int, optional): worker processes. Defaults to the cpu count.
+        chunksize (int, optional): labels per dispatch. Defaults to CHUNK_SIZE.
+        tasks (iterable, optional): (name, source) tasks overriding source
+        streaming (bool, optional): use the iterparse mode. Defaults to False.
+        cache_path (str, optional): LabelCache file; labels whose content is cached
+            are not parsed again. Defaults to no cache.
+        fields (list, optional): compute only these DrugLabel fields, e.g.
+            ["setId", "versionNumber"]. Defaults to the full response. The cache
+            holds full responses, so it cannot be combined with fields, and
+            neither can the iterparse mode.
+        invalidate_cache (bool, optional): empty the cache first, e.g. after a
+            change to DrugLabel.process that EXTRACTOR_VERSION does not record.
+            Entries of other extractor versions are always dropped. Defaults to False.
+
+    Returns:
+        dict: counts of processed, cached and failed labels
+
+    Raises:
+        ValueError: fields with streaming or cache_path, or an unknown field
+    """
+    if fields:
+        if streaming or cache_path:
+            raise ValueError("fields cannot be combined with the streaming mode or the label cache")
+        for name in fields:
+            check_field(name)
+
+    summary = {"processed": 0, "cached": 0, "failed": 0}
+    tasks = tasks if tasks is not None else iter_label_sources(source)
+    if streaming:
+        worker = process_label_streaming
+    else:
+        worker = partial(process_label, fields=tuple(fields)) if fields else process_label
+    cache = LabelCache(cache_path) if cache_path else None
+    if cache is not None:
+        dropped = cache.invalidate(everything=invalidate_cache)
+        if dropped:
+            logger.info("dropped %d cached labels", dropped)
+
+    try:
+        with Pool(processes=workers or os.cpu_count(), initializer=init_worker, initargs=(cache_path,)) as pool:
+            for result in imap_chunks(pool, worker, tasks, chunksize):
+                if "error" in result:
+                    summary["failed"] += 1
+                    logger.error("failed to process %s: %s", result["file"], result["error"])
+                    with stage("sink_write"):
+                        sink.write(result)
+                    continue
+
+                key = result.pop("contentHash", None)
+                if result.pop("cached", False):
+                    cache.touch(key)
+                    summary["cached"] += 1
+                else:
+                    if cache is not None:
+                        cache.put(key, result["response"])
+                    summary["processed"] += 1
+                with stage("sink_write") as timer:
+                    sink.write(result)
+                    timer.add(labels=1)
+    finally:
+        if cache is not None:
+            cache.close()
+    return summary
+
+
+if __name__ == "__main__":
+    ## batch_labels.py <xml directory | zip archive> <output .jsonl | .db> [workers] [--stream] [--cache=<path>]
+    ##                 [--invalidate-cache] [--fields=setId,versionNumber,...]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].partition("=")[::2] for arg in sys.argv[1:] if arg.startswith("--"))
+    source, output = args[0], args[1]
+    workers = int(args[2]) if len(args) > 2 else None
+    instrumentation.configure_logging()
+    config = utils.read_configuration() if os.path.exists("config.yaml") else {}
+    with instrumentation.session(config), open_sink(output) as sink:
+        fields = options["fields"].split(",") if options.get("fields") else None
+        print(process_labels(source, sink, workers, streaming="stream" in options,
+                             cache_path=options.get("cache"), fields=fields,
+                             invalidate_cache="invalidate-cache" in options))
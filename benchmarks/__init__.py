@@ -0,0 +1,10 @@
+"""
+Benchmarks for the Drugs@FDA load and the label pipelines.
+
+    generate  - synthetic Drugs@FDA text files, SPL labels and openFDA label shards
+    scenarios - timed, repeatable runs of the load, label extraction and shard parsing
+    run       - runs scenarios and appends the timings to a results history
+
+Run from the repository root:
+    python -m benchmarks.run --scale 1 --repeat 3
+"""
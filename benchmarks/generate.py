@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""
+Synthetic corpora for the benchmarks.
+
+The Drugs@FDA files follow the real layout - same file names, headers, column
+order, zero padded numbers, CRLF line ends and the odd Windows-1252 character -
+with keys that join the way the real tables do. Row counts are the real files'
+sizes times a scale factor. SPL labels carry the header, product data elements
+and LOINC coded sections DrugLabel reads, with nested subsections of
+configurable depth.
+"""
+import io
+import os
+import sys
+import json
+import random
+import zipfile
+
+from schema import FDA_Files
+
+## approximate row counts of the real Drugs@FDA files, scale 1
+BASE_ROWS = {
+    "Applications": 25000,
+    "Products": 48000,
+    "MarketingStatus": 48000,
+    "TE": 22000,
+    "Submissions": 180000,
+    "SubmissionPropertyType": 190000,
+    "ApplicationDocs": 75000,
+}
+## lookup tables keep their real, fixed size
+LOOKUP_ROWS = {
+    "ActionTypes_Lookup": 30,
+    "ApplicationsDocsType_Lookup": 30,
+    "MarketingStatus_Lookup": 4,
+    "SubmissionClass_Lookup": 30,
+}
+
+HEADERS = {
+    "ActionTypes_Lookup": ["ActionTypes_LookupID", "ActionTypes_LookupDescription",
+                           "SupplCategoryLevel1Code", "SupplCategoryLevel2Code"],
+    "ApplicationDocs": ["ApplicationDocsID", "ApplicationDocsTypeID", "ApplNo", "SubmissionType",
+                        "SubmissionNo", "ApplicationDocsTitle", "ApplicationDocsURL", "ApplicationDocsDate"],
+    "Applications": ["ApplNo", "ApplType", "ApplPublicNotes", "SponsorName"],
+    "ApplicationsDocsType_Lookup": ["ApplicationDocsType_Lookup_ID", "ApplicationDocsType_Lookup_Description"],
+    "MarketingStatus": ["MarketingStatusID", "ApplNo", "ProductNo"],
+    "MarketingStatus_Lookup": ["MarketingStatusID", "MarketingStatusDescription"],
+    "Products": ["ApplNo", "ProductNo", "Form", "Strength", "ReferenceDrug", "DrugName",
+                 "ActiveIngredient", "ReferenceStandard"],
+    "SubmissionClass_Lookup": ["SubmissionClassCodeID", "SubmissionClassCode", "SubmissionClassCodeDescription"],
+    "SubmissionPropertyType": ["ApplNo", "SubmissionType", "SubmissionNo", "SubmissionPropertyTypeCode",
+                               "SubmissionPropertyTypeID"],
+    "Submissions": ["ApplNo", "SubmissionClassCodeID", "SubmissionType", "SubmissionNo", "SubmissionStatus",
+                    "SubmissionStatusDate", "SubmissionsPublicNotes", "ReviewPriority"],
+    "TE": ["ApplNo", "ProductNo", "MarketingStatusID", "TECode"],
+}
+
+FORMS = ["TABLET;ORAL", "CAPSULE;ORAL", "INJECTABLE;INJECTION", "SOLUTION/DROPS;OPHTHALMIC", "CREAM;TOPICAL"]
+STRENGTHS = ["10MG", "25MG", "50MG", "100MG", "1%", "EQ 5MG BASE", "500MG/5ML"]
+WORDS = ["hydro", "chlor", "amine", "oxy", "cillin", "statin", "pril", "sartan", "olol", "azole", "mab", "vir"]
+## a few Windows-1252 characters, as in the real files
+CP1252_NAMES = ["Laboratoires Th\xe9a", "Pharma Gmb\xdf", "Soci\xe9t\xe9 Chimique"]
+
+LOINC_SECTIONS = [
+    ("34066-1", "BOXED WARNING SECTION"),
+    ("34067-9", "INDICATIONS &amp; USAGE SECTION"),
+    ("34068-7", "DOSAGE &amp; ADMINISTRATION SECTION"),
+    ("43678-2", "DOSAGE FORMS &amp; STRENGTHS SECTION"),
+    ("34070-3", "CONTRAINDICATIONS SECTION"),
+    ("43685-7", "WARNINGS AND PRECAUTIONS SECTION"),
+    ("34084-4", "ADVERSE REACTIONS SECTION"),
+    ("34073-7", "DRUG INTERACTIONS SECTION"),
+    ("43684-0", "USE IN SPECIFIC POPULATIONS SECTION"),
+    ("34088-5", "OVERDOSAGE SECTION"),
+    ("34089-3", "DESCRIPTION SECTION"),
+    ("34090-1", "CLINICAL PHARMACOLOGY SECTION"),
+    ("43680-8", "NONCLINICAL TOXICOLOGY SECTION"),
+    ("34092-7", "CLINICAL STUDIES SECTION"),
+    ("34069-5", "HOW SUPPLIED SECTION"),
+    ("34076-0", "PATIENT COUNSELING INFORMATION SECTION"),
+]
+
+
+def drug_name(rng):
+    return "".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).upper()
+
+
+def table_rows(source, scale, rng):
+    """
+    Rows of one Drugs@FDA file as lists of strings, keys consistent across files
+    """
+    if source in LOOKUP_ROWS:
+        count = LOOKUP_ROWS[source]
+        for i in range(1, count + 1):
+            if source == "ActionTypes_Lookup":
+                yield [str(i), f"Action type {i}", rng.choice(["Efficacy", "Labeling", "Manufacturing"]), ""]
+            elif source == "SubmissionClass_Lookup":
+                yield [str(i), f"CLASS{i}", f"Submission class {i}"]
+            else:
+                yield [str(i), f"Description {i}"]
+        return
+
+    applications = max(1, int(BASE_ROWS["Applications"] * scale))
+    ## real files: ~2 products and ~7 submissions per application
+    products = max(1, round(BASE_ROWS["Products"] / BASE_ROWS["Applications"]))
+    submissions = max(1, round(BASE_ROWS["Submissions"] / BASE_ROWS["Applications"]))
+
+    if source == "Applications":
+        for appl in range(1, applications + 1):
+            sponsor = rng.choice(CP1252_NAMES) if rng.random() < 0.01 else f"SPONSOR {appl % 5000}"
+            yield [f"{appl:06d}", rng.choice(["NDA", "ANDA", "BLA"]), "", sponsor]
+
+    elif source in ("Products", "MarketingStatus", "TE"):
+        for appl in range(1, applications + 1):
+            for product in range(1, products + 1):
+                if source == "Products":
+                    name = drug_name(rng)
+                    yield [f"{appl:06d}", f"{product:03d}", rng.choice(FORMS), rng.choice(STRENGTHS),
+                           str(rng.randint(0, 1)), name, name + " HYDROCHLORIDE", str(rng.randint(0, 1))]
+                elif source == "MarketingStatus":
+                    yield [str(rng.randint(1, LOOKUP_ROWS["MarketingStatus_Lookup"])), f"{appl:06d}", f"{product:03d}"]
+                elif rng.random() < BASE_ROWS["TE"] / BASE_ROWS["Products"]:
+                    yield [f"{appl:06d}", f"{product:03d}", "1", rng.choice(["AA", "AB", "AB1", "AP"])]
+
+    elif source in ("Submissions", "SubmissionPropertyType"):
+        for appl in range(1, applications + 1):
+            for number in range(1, submissions + 1):
+                kind = "ORIG" if number == 1 else "SUPPL"
+                if source == "Submissions":
+                    yield [f"{appl:06d}", str(rng.randint(1, LOOKUP_ROWS["SubmissionClass_Lookup"])) if number > 1 else "",
+                           kind, str(number), "AP", f"{rng.randint(1980, 2021)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)} 00:00:00",
+                           "", rng.choice(["STANDARD", "PRIORITY", "UNKNOWN"])]
+                else:
+                    yield [f"{appl:06d}", kind, str(number), rng.choice(["Null", "Orphan", "PEPFAR"]),
+                           str(rng.randint(0, 2))]
+
+    elif source == "ApplicationDocs":
+        count = max(1, int(BASE_ROWS["ApplicationDocs"] * scale))
+        for doc in range(1, count + 1):
+            appl = rng.randint(1, applications)
+            yield [str(doc), str(rng.randint(1, LOOKUP_ROWS["ApplicationsDocsType_Lookup"])), f"{appl:06d}",
+                   rng.choice(["ORIG", "SUPPL"]), str(rng.randint(1, submissions)), "",
+                   f"http://www.accessdata.fda.gov/drugsatfda_docs/label/{appl:06d}_{doc}.pdf",
+                   f"{rng.randint(1995, 2021)}-0{rng.randint(1, 9)}-2{rng.randint(0, 8)} 00:00:00"]
+
+
+def generate_tables(data_dir, scale=1.0, seed=0, sources=None):
+    """
+    Write the Drugs@FDA text files for a scale factor of the real data set
+
+    Returns:
+        dict: rows written per FDA_Files key
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    summary = {}
+    for source in (sources or FDA_Files.keys()):
+        rng = random.Random(f"{seed}-{source}")
+        count = 0
+        with open(os.path.join(data_dir, FDA_Files[source]), "wb") as f:
+            f.write(("\t".join(HEADERS[source]) + "\r\n").encode("utf-8"))
+            for row in table_rows(source, scale, rng):
+                line = "\t".join(row) + "\r\n"
+                ## sponsors with Windows-1252 characters are written in that encoding
+                f.write(line.encode("cp1252" if any(ord(c) > 127 for c in line) else "utf-8"))
+                count += 1
+        summary[source] = count
+    return summary
+
+
+def spl_section(rng, code, display_name, level, depth, branching, key):
+    paragraphs = "".join(
+        f"<paragraph>{' '.join(drug_name(rng).lower() for _ in range(12))} "
+        f"<content styleCode=\"bold\">{drug_name(rng).lower()}</content> patients.</paragraph>"
+        for _ in range(rng.randint(1, 3)))
+    text = f"<text>{paragraphs}<list><item>adverse reaction {key}</item><item>rash</item></list></text>"
+    inner = ""
+    if level < depth:
+        inner = "".join(f"<component>{spl_section(rng, '42229-5', 'SPL UNCLASSIFIED SECTION', level + 1, depth, branching, f'{key}.{k}')}</component>"
+                        for k in range(branching))
+    return (f'<section><id root="{key}"/><code code="{code}" codeSystem="2.16.840.1.113883.6.1" '
+            f'displayName="{display_name}"/><title>{key} {display_name.replace("&amp;", "and").title()}</title>{text}{inner}</section>')
+
+
+def spl_label(set_id, version=1, sections=len(LOINC_SECTIONS), depth=3, branching=2, products=1, seed=0):
+    """
+    One SPL document.
+
+    Args:
+        set_id (str): setId root
+        version (int, optional): versionNumber
+        sections (int, optional): top level sections, cycling through LOINC_SECTIONS
+        depth (int, optional): nesting levels of every top level section
+        branching (int, optional): subsections per section above the last level
+        products (int, optional): manufacturedProduct entries
+        seed (int, optional): random seed
+
+    Returns:
+        str: the xml document
+    """
+    rng = random.Random(seed)
+    name = drug_name(rng)
+    product_xml = "".join(f'''<subject><manufacturedProduct><manufacturedProduct>
+<code code="{rng.randint(1000, 9999)}-{rng.randint(100, 999)}" codeSystem="2.16.840.1.113883.6.69"/><name>{name} </name>
+<formCode code="C42998" codeSystem="2.16.840.1.113883.3.26.1.1" displayName="TABLET"/>
+<asEntityWithGeneric><genericMedicine><name>{name.lower()}</name></genericMedicine></asEntityWithGeneric>
+<ingredient classCode="ACTIB"><quantity/><ingredientSubstance><code code="U{p}"/><name>{name} HYDROCHLORIDE</name>
+<activeMoiety><activeMoiety><code code="M{p}"/><name>{name}</name></activeMoiety></activeMoiety></ingredientSubstance></ingredient>
+<ingredient classCode="IACT"><ingredientSubstance><name>LACTOSE MONOHYDRATE</name></ingredientSubstance></ingredient>
+<inactiveIngredient><inactiveIngredientSubstance><name>STARCH</name></inactiveIngredientSubstance></inactiveIngredient>
+</manufacturedProduct><subjectOf><approval><id extension="NDA0{rng.randint(10000, 99999)}"/><code code="C73594" displayName="NDA"/></approval></subjectOf>
+<subjectOf><marketingAct><code code="C53292"/><statusCode code="active"/><effectiveTime><low value="2010011{p % 10}"/></effectiveTime></marketingAct></subjectOf>
+<consumedIn><substanceAdministration><routeCode code="C38288" displayName="ORAL"/></substanceAdministration></consumedIn>
+</manufacturedProduct></subject>''' for p in range(products))
+    product_section = ('<section><id root="products"/><code code="48780-1" displayName="SPL PRODUCT DATA ELEMENTS SECTION"/>'
+                       f'<title/><text/>{product_xml}</section>')
+    body = "".join(
+        f"<component>{spl_section(rng, *LOINC_SECTIONS[i % len(LOINC_SECTIONS)], 1, depth, branching, str(i))}</component>"
+        for i in range(sections))
+    return f'''<?xml version="1.0" encoding="UTF-8"?>
+<?xml-stylesheet href="https://www.accessdata.fda.gov/spl/stylesheet/spl.xsl" type="text/xsl"?>
+<document xmlns="urn:hl7-org:v3" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<id root="doc-{set_id}-{version}"/><code code="34391-3" codeSystem="2.16.840.1.113883.6.1" displayName="HUMAN PRESCRIPTION DRUG LABEL"/>
+<title>{name} <content styleCode="bold">tablets</content>, for oral use</title>
+<effectiveTime value="2020{rng.randint(1, 12):02d}{rng.randint(10, 28)}"/><setId root="{set_id}"/><versionNumber value="{version}"/>
+<author><assignedEntity><representedOrganization><id extension="1234"/><name>{rng.choice(CP1252_NAMES)} Inc.</name></representedOrganization></assignedEntity></author>
+<component><structuredBody><component>{product_section}</component>{body}</structuredBody></component></document>'''
+
+
+def generate_labels(label_dir, count, depth=3, branching=2, sections=len(LOINC_SECTIONS), seed=0):
+    """
+    Write count SPL documents to label_dir
+
+    Returns:
+        int: bytes written
+    """
+    os.makedirs(label_dir, exist_ok=True)
+    written = 0
+    for i in range(count):
+        xml = spl_label(f"set-{seed}-{i}", version=1 + i % 3, sections=sections, depth=depth,
+                        branching=branching, seed=seed * 1000003 + i).encode("utf-8")
+        with open(os.path.join(label_dir, f"label{i:06d}.xml"), "wb") as f:
+            f.write(xml)
+        written += len(xml)
+    return written
+
+
+def label_record(rng, i):
+    """
+    One openFDA drug/label record
+    """
+    name = drug_name(rng)
+    record = {
+        "id": f"id-{i}",
+        "set_id": f"set-0-{i}",
+        "version": str(1 + i % 3),
+        "effective_time": f"2020{rng.randint(1, 12):02d}{rng.randint(10, 28)}",
+        "openfda": {"generic_name": [name], "substance_name": [name], "brand_name": [name.title()],
+                    "product_ndc": [f"{rng.randint(1000, 9999)}-{rng.randint(100, 999)}"]},
+    }
+    for code, display_name in LOINC_SECTIONS:
+        field = display_name.replace("&amp;", "and").replace(" SECTION", "").lower().replace(" ", "_")
+        record[field] = [" ".join(drug_name(rng).lower() for _ in range(rng.randint(40, 200)))]
+    record["openfda"]["manufacturer_name"] = [f"{rng.choice(CP1252_NAMES)} Inc."]
+    return record
+
+
+def generate_label_shard(path, count, seed=0):
+    """
+    Write a drug/label download shard: a zip holding one json member with meta
+    and results, as served by download.open.fda.gov
+
+    Returns:
+        int: bytes of the uncompressed json member
+    """
+    rng = random.Random(seed)
+    buffer = io.StringIO()
+    buffer.write('{"meta": ' + json.dumps({"last_updated": "2021-02-26", "results": {"total": count}}))
+    buffer.write(', "results": [')
+    for i in range(count):
+        if i:
+            buffer.write(", ")
+        buffer.write(json.dumps(label_record(rng, i)))
+    buffer.write("]}")
+    data = buffer.getvalue().encode("utf-8")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    member = os.path.basename(path)[:-len(".zip")] if path.endswith(".zip") else "drug-label.json"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zfile:
+        zfile.writestr(member, data)
+    return len(data)
+
+
+if __name__ == "__main__":
+    ## python -m benchmarks.generate <output directory> [scale] [labels] [label depth]
+    output = sys.argv[1]
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    labels = int(sys.argv[3]) if len(sys.argv) > 3 else int(1000 * scale)
+    depth = int(sys.argv[4]) if len(sys.argv) > 4 else 3
+    print(generate_tables(os.path.join(output, "fda"), scale))
+    print(generate_labels(os.path.join(output, "labels"), labels, depth=depth), "label bytes")
+    print(generate_label_shard(os.path.join(output, "drug-label-0001-of-0001.json.zip"), labels), "shard bytes")
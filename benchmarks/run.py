@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Run benchmark scenarios and track the results.
+
+Every run appends one JSON line per scenario to the history file
+(data/benchmarks/results.jsonl by default, outside version control), with the git
+commit, scale, best and median wall time and throughput, and is compared with
+the last recorded run of the same scenario and scale. A scenario slower than
+that by more than the threshold is reported as a regression, and the exit
+status is 1 so the run can gate a change.
+
+    python -m benchmarks.run [--scale 1] [--repeat 3] [--labels N] [--depth 3]
+                             [--scenario NAME ...] [--corpus DIR] [--history FILE]
+                             [--threshold 0.1]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+from benchmarks import generate
+from benchmarks.scenarios import Corpus, SCENARIOS
+
+## kept out of the source tree, next to the other generated data
+HISTORY_PATH = "data/benchmarks/results.jsonl"
+## slowdown over the previous run reported as a regression
+THRESHOLD = 0.10
+## labels per unit of scale
+LABELS_PER_SCALE = 200
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def corpus_tag(scale, labels, depth):
+    return f"scale{scale:g}-labels{labels}-depth{depth}"
+
+
+def build_corpus(root, scale, labels, depth):
+    """
+    Generate a corpus under root unless it is already there
+    """
+    corpus = Corpus(root)
+    marker = os.path.join(root, "corpus.json")
+    if os.path.exists(marker):
+        return corpus
+
+    os.makedirs(root, exist_ok=True)
+    print(f"generating corpus in {root}")
+    info = {"tables": generate.generate_tables(corpus.data_dir, scale),
+            "labelBytes": generate.generate_labels(corpus.label_dir, labels, depth=depth),
+            "shardBytes": generate.generate_label_shard(corpus.shard, labels)}
+    with open(marker, "w") as f:
+        json.dump(info, f)
+    return corpus
+
+
+def run_scenario(name, corpus, repeat):
+    """
+    Time one scenario repeat times in a scratch directory
+
+    Returns:
+        dict: timings and throughput
+    """
+    prepare, run, unit = SCENARIOS[name]
+    times = []
+    items = 0
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    try:
+        for _ in range(repeat):
+            state = prepare(corpus, workdir) if prepare else {}
+            start = time.perf_counter()
+            items = run(corpus, workdir, state)
+            times.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    best = min(times)
+    return {"scenario": name, "unit": unit, "items": items, "repeat": repeat,
+            "best": round(best, 4), "median": round(statistics.median(times), 4),
+            "throughput": round(items / best, 1) if best else None}
+
+
+def last_results(history_path):
+    """
+    Latest recorded result per (scenario, corpus)
+    """
+    latest = {}
+    if os.path.exists(history_path):
+        with open(history_path) as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    latest[(result["scenario"], result["corpus"])] = result
+    return latest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark scenarios")
+    parser.add_argument("--scale", type=float, default=1.0, help="Drugs@FDA size relative to the real files")
+    parser.add_argument("--labels", type=int, default=None, help="SPL labels, defaults to 200 per unit of scale")
+    parser.add_argument("--depth", type=int, default=3, help="nesting depth of the SPL sections")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="defaults to all")
+    parser.add_argument("--corpus", default=None, help="corpus directory, kept between runs")
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args(argv)
+
+    labels = args.labels if args.labels is not None else max(1, int(LABELS_PER_SCALE * args.scale))
+    tag = corpus_tag(args.scale, labels, args.depth)
+    root = args.corpus or os.path.join(tempfile.gettempdir(), "fda-bench", tag)
+    corpus = build_corpus(root, args.scale, labels, args.depth)
+
+    previous = last_results(args.history)
+    commit = git_commit()
+    regressions = []
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, "a") as history:
+        for name in (args.scenario or list(SCENARIOS)):
+            result = run_scenario(name, corpus, args.repeat)
+            result.update(corpus=tag, commit=commit, python=platform.python_version(),
+                          timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"))
+            history.write(json.dumps(result) + "\n")
+            history.flush()
+
+            line = f"{name:26s} {result['best']:9.3f}s  {result['throughput']:>12} {result['unit']}/s"
+            before = previous.get((name, tag))
+            if before and before.get("best"):
+                change = result["best"] / before["best"] - 1
+                line += f"  {change:+.1%} vs {before.get('commit')}"
+                if change > args.threshold:
+                    regressions.append(name)
+                    line += "  REGRESSION"
+            print(line)
+
+    if regressions:
+        print(f"regressions: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
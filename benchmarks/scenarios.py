@@ -0,0 +1,165 @@
+"""
+Timed benchmark scenarios.
+
+Each scenario takes a Corpus and a scratch directory, does its work and returns
+the number of items it processed (rows, labels or records), which run.py turns
+into a throughput. Setup that is not being measured - creating tables, listing
+files - happens in the scenario's prepare function, outside the timing.
+"""
+import os
+import glob
+import zipfile
+
+import ijson
+
+from main import FDADatabase, read_data, BATCH_SIZE
+from schema import TABLES
+from drug_label import DrugLabel, process_streaming
+from label_store import LabelStore
+from columnar import row_batches
+
+
+class Corpus(object):
+    """
+    Locations of a generated corpus: Drugs@FDA files, SPL labels, one label shard
+    """
+    def __init__(self, root):
+        self.root = root
+        self.data_dir = os.path.join(root, "fda")
+        self.label_dir = os.path.join(root, "labels")
+        self.shard = os.path.join(root, "drug-label-0001-of-0001.json.zip")
+
+    def labels(self):
+        return sorted(glob.glob(os.path.join(self.label_dir, "*.xml")))
+
+
+def new_database(workdir):
+    path = os.path.join(workdir, "bench.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    fdaDB = FDADatabase(dbtype="sqlite", dbname=path)
+    fdaDB.create_db_table()
+    return fdaDB
+
+
+def read_tables(corpus, workdir, state):
+    """
+    read_data and row conversion of every file, no database
+    """
+    rows = 0
+    for spec in TABLES.values():
+        (colnames, batches) = read_data(os.path.join(corpus.data_dir, spec.filename), BATCH_SIZE)
+        for batch in batches:
+            rows += len(spec.convert(batch))
+    return rows
+
+
+def read_tables_columnar(corpus, workdir, state):
+    """
+    columnar.row_batches of every file, no database
+    """
+    rows = 0
+    for spec in TABLES.values():
+        for (batch, rejects) in row_batches(spec, os.path.join(corpus.data_dir, spec.filename), BATCH_SIZE):
+            rows += len(batch)
+    return rows
+
+
+def load_sequential(corpus, workdir, state):
+    """
+    Every file through FDADatabase.insert_rows in one load session
+    """
+    fdaDB = state["db"]
+    with fdaDB.load_session():
+        for spec in TABLES.values():
+            (colnames, batches) = read_data(os.path.join(corpus.data_dir, spec.filename), BATCH_SIZE)
+            fdaDB.insert_rows(spec, batches)
+    return table_rows(fdaDB)
+
+
+def load_parallel(corpus, workdir, state):
+    """
+    loader.load_all: parsing in a process pool, one writer
+    """
+    from loader import load_all
+    load_all(state["db"], corpus.data_dir)
+    return table_rows(state["db"])
+
+
+def table_rows(fdaDB):
+    """
+    Rows stored across all tables
+    """
+    with fdaDB.load_session(), fdaDB.transaction() as cur:
+        return sum(cur.execute(f"SELECT COUNT(*) FROM {spec.table}").fetchone()[0] for spec in TABLES.values())
+
+
+def prepare_database(corpus, workdir):
+    return {"db": new_database(workdir)}
+
+
+def extract_summary(corpus, workdir, state):
+    for path in state["labels"]:
+        DrugLabel(path).extract_summary()
+    return len(state["labels"])
+
+
+def extract_sections(corpus, workdir, state):
+    for path in state["labels"]:
+        DrugLabel(path).extract_text_sections()
+    return len(state["labels"])
+
+
+def process_labels(corpus, workdir, state):
+    for path in state["labels"]:
+        DrugLabel(path).process()
+    return len(state["labels"])
+
+
+def process_label_fields(corpus, workdir, state):
+    for path in state["labels"]:
+        DrugLabel(path).process(fields=["setId", "versionNumber", "effectiveTime"])
+    return len(state["labels"])
+
+
+def process_labels_streaming(corpus, workdir, state):
+    for path in state["labels"]:
+        process_streaming(path)
+    return len(state["labels"])
+
+
+def prepare_labels(corpus, workdir):
+    return {"labels": corpus.labels()}
+
+
+def parse_shard(corpus, workdir, state):
+    """
+    Stream the label shard with ijson into a fresh LabelStore, as FDAAPI.download_data does
+    """
+    path = os.path.join(workdir, "labels.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    count = 0
+    with LabelStore(path) as store, zipfile.ZipFile(corpus.shard) as zfile:
+        for zipinfo in zfile.infolist():
+            with zfile.open(zipinfo) as f:
+                count += store.put_many(ijson.items(f, "results.item", use_float=True))
+    return count
+
+
+## name -> (prepare, run, unit)
+SCENARIOS = {
+    "read_tables": (None, read_tables, "rows"),
+    "read_tables_columnar": (None, read_tables_columnar, "rows"),
+    "load_sequential": (prepare_database, load_sequential, "rows"),
+    "load_parallel": (prepare_database, load_parallel, "rows"),
+    "extract_summary": (prepare_labels, extract_summary, "labels"),
+    "extract_sections": (prepare_labels, extract_sections, "labels"),
+    "process_labels": (prepare_labels, process_labels, "labels"),
+    "process_label_fields": (prepare_labels, process_label_fields, "labels"),
+    "process_labels_streaming": (prepare_labels, process_labels_streaming, "labels"),
+    "parse_shard": (None, parse_shard, "records"),
+}
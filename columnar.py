@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+Columnar parsing of the Drugs@FDA text files.
+
+A file is read in chunks of whole lines, and pyarrow.csv parses each chunk
+straight into typed Arrow columns - int64 and string, from the schema registry -
+with no Python object per cell. Strings are trimmed and empty cells become nulls
+in Arrow compute kernels, matching TableSpec.frame. Only one chunk is held at a
+time, so memory stays bounded as with read_data. The columns then feed any
+consumer:
+
+    arrow_batches  - RecordBatches, for Parquet and other Arrow consumers
+    frame_batches  - pandas DataFrames with nullable Int64 columns
+    row_batches    - tuples ready for executemany
+
+Chunks with Windows-1252 lines are re-encoded as UTF-8 first. A chunk Arrow
+cannot parse as declared - rows with missing or extra cells, non numeric keys -
+is split and converted in Python as read_data and TableSpec.convert do, so the
+result is the same either way. pyarrow is optional: without it every file goes
+through read_data.
+"""
+import os
+import logging
+import functools
+
+import pandas as pd
+
+from main import read_data, decode_line, split_lines, iter_batches, BATCH_SIZE
+from schema import INTEGER, STRING
+from quarantine import convert_batch
+import instrumentation
+from instrumentation import stage, timed
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+## bytes of whole lines parsed at a time - the unit held in memory while a file is read
+CHUNK_SIZE = 256 << 10
+
+
+def arrow_type(kind):
+    return {INTEGER: pa.int64(), STRING: pa.string()}[kind]
+
+
+def arrow_schema(spec):
+    """
+    Arrow schema for a table spec
+    """
+    return pa.schema([pa.field(name, arrow_type(kind)) for name, kind in spec.columns])
+
+
+def clean_batch(spec, schema, batch):
+    """
+    Trim string columns and turn empty strings into nulls
+    """
+    columns = []
+    for (name, kind), column in zip(spec.columns, batch.columns):
+        if kind == STRING:
+            column = pc.utf8_trim_whitespace(column)
+            column = pc.if_else(pc.equal(column, ""), pa.scalar(None, pa.string()), column)
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def parse_columns(spec, schema, data):
+    """
+    Parse tab-delimited data rows into one typed, cleaned RecordBatch.
+
+    Raises:
+        pyarrow.ArrowInvalid: the data does not parse as declared
+    """
+    ## the whole chunk is one parse block
+    read_options = pv.ReadOptions(column_names=spec.column_names, block_size=len(data) + 1, use_threads=False)
+    parse_options = pv.ParseOptions(delimiter="\t", quote_char=False, double_quote=False, escape_char=False,
+                                    newlines_in_values=False, ignore_empty_lines=True)
+    ## every cell is read as text or int64; strings are cleaned after
+    convert_options = pv.ConvertOptions(
+        column_types={name: arrow_type(kind) for name, kind in spec.columns},
+        null_values=[""], strings_can_be_null=False, quoted_strings_can_be_null=False)
+    table = pv.read_csv(pa.py_buffer(data), read_options=read_options, parse_options=parse_options,
+                        convert_options=convert_options)
+    if not table.num_rows:
+        return None
+    batch = clean_batch(spec, schema, table.combine_chunks().to_batches()[0])
+    ## a line of tabs and spaces is a blank line to read_data, not a row of nulls
+    filled = functools.reduce(pc.or_, [pc.is_valid(column) for column in batch.columns])
+    if not pc.all(filled).as_py():
+        batch = batch.filter(filled)
+    return batch if batch.num_rows else None
+
+
+def parse_chunk(spec, schema, lines):
+    """
+    RecordBatch of a chunk of raw lines, None if the chunk has no rows. Chunks
+    with Windows-1252 lines are re-encoded as UTF-8 line by line, as read_data
+    decodes them.
+
+    Raises:
+        pyarrow.ArrowInvalid: the chunk does not parse as columns
+    """
+    data = b"".join(lines)
+    try:
+        return parse_columns(spec, schema, data)
+    except pa.ArrowInvalid as ex:
+        if "utf8" not in str(ex).lower():
+            logger.debug("%d lines of %s do not parse as columns: %s", len(lines), spec.filename, ex)
+            raise
+    return parse_columns(spec, schema, "".join([decode_line(line) for line in lines]).encode("utf-8"))
+
+
+def stream_batches(spec, fname, batch_size=BATCH_SIZE):
+    """
+    Yield the batches of a Drugs@FDA file in file order. The file is read
+    CHUNK_SIZE bytes of whole lines at a time, so memory stays bounded as with
+    read_data. A chunk that parses as columns gives RecordBatches; a chunk that
+    does not - rows with missing or extra cells, non numeric keys - gives lists
+    of raw string rows, split and padded as read_data does, for TableSpec.convert.
+    """
+    if pa is None:
+        (colnames, batches) = read_data(fname, batch_size)
+        yield from batches
+        return
+
+    schema = arrow_schema(spec)
+    name = os.path.basename(fname)
+    instrumentation.count("read_bytes", os.path.getsize(fname), file=name)
+    with open(fname, "rb") as file:
+        header = next(split_lines(iter(file.readline, b"")), [])
+        while True:
+            lines = file.readlines(CHUNK_SIZE)
+            if not lines:
+                break
+            try:
+                with stage("arrow_parse", table=spec.table) as timer:
+                    batch = parse_chunk(spec, schema, lines)
+                    timer.add(rows=batch.num_rows if batch is not None else 0)
+            except pa.ArrowInvalid:
+                instrumentation.count("columnar_fallback_lines", len(lines), table=spec.table)
+                rows = split_lines(lines, first=False)
+                yield from timed(iter_batches(rows, len(header), batch_size), "parse",
+                                 count=lambda batch: {"rows": len(batch)}, file=name)
+                continue
+            if batch is not None:
+                for offset in range(0, batch.num_rows, batch_size):
+                    yield batch.slice(offset, batch_size)
+
+
+def rows_batch(schema, rows):
+    """
+    RecordBatch of converted row tuples
+    """
+    columns = list(zip(*rows)) or [[] for _ in schema]
+    return pa.RecordBatch.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                                      schema=schema)
+
+
+def arrow_batches(spec, fname, batch_size=BATCH_SIZE, on_reject=None):
+    """
+    Yield typed RecordBatches of at most batch_size rows. Chunks that do not
+    parse as columns are converted with convert_batch, so a bad cell costs its
+    row, not the file.
+
+    Args:
+        on_reject (callable, optional): called with the (raw row, reason) pairs
+            of each batch that has rows failing to convert. Defaults to raising
+            ValueError on the first such batch.
+    """
+    schema = arrow_schema(spec)
+    for batch in stream_batches(spec, fname, batch_size):
+        if isinstance(batch, pa.RecordBatch):
+            yield batch
+            continue
+        rows, rejects = convert_batch(spec, batch)
+        if rejects:
+            if on_reject is None:
+                raise ValueError(f"{len(rejects)} rows of {spec.filename} do not convert: {rejects[0][1]}")
+            on_reject(rejects)
+        if rows:
+            yield rows_batch(schema, rows)
+
+
+def frame_batches(spec, fname, batch_size=BATCH_SIZE):
+    """
+    Yield DataFrames of at most batch_size rows, typed like TableSpec.frame
+    """
+    if pa is None:
+        (colnames, batches) = read_data(fname, batch_size)
+        for batch in batches:
+            yield spec.frame(batch)
+        return
+
+    for batch in arrow_batches(spec, fname, batch_size):
+        yield batch.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+
+def row_batches(spec, fname, batch_size=BATCH_SIZE):
+    """
+    Yield (rows, rejects) per batch: tuples for executemany, and the raw rows
+    that failed to convert with their reason. Only the read_data path can
+    reject rows - a chunk with a bad cell never parses as columns.
+    """
+    for batch in stream_batches(spec, fname, batch_size):
+        if pa is not None and isinstance(batch, pa.RecordBatch):
+            yield list(zip(*[column.to_pylist() for column in batch.columns])), []
+        else:
+            yield convert_batch(spec, batch)
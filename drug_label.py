@@ -1,279 +1,628 @@
 #!/usr/bin/env python
+import io
 import json
-import xml.etree.ElementTree as ET
-from lxml import etree, objectify
+from lxml import etree
 import pprint
 import pdb
+import logging
 from datetime import date
+from functools import cached_property
+from collections.abc import Mapping
 import string
 
 # meta data along with text from section
 import traceback
 
+from instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+
+SPL_NAMESPACE = 'urn:hl7-org:v3'
+
+## version of the process() response; bump it whenever the output changes so
+## cached responses from older versions are no longer served
+EXTRACTOR_VERSION = 1
+
+
+def strip_namespaces(root):
+    """
+    Drop namespace prefixes from every element tag in place, so plain paths like
+    "./component/structuredBody" match without namespace maps. Works on the parsed
+    tree - nothing is serialized or parsed again.
+    """
+    for elem in root.iter(etree.Element):
+        tag = elem.tag
+        if tag[0] == '{':
+            elem.tag = tag[tag.index('}') + 1:]
+    etree.cleanup_namespaces(root)
+    return root
+
+
+def parse_label(source):
+    """
+    Parse an SPL document exactly once and strip its namespace.
+
+    Args:
+        source: path to the xml file, a file object, xml bytes/str, or an already
+            parsed lxml element / tree
+
+    Returns:
+        lxml ElementTree
+    """
+    if isinstance(source, etree._ElementTree):
+        tree = source
+    elif isinstance(source, etree._Element):
+        tree = source.getroottree()
+    else:
+        parser = etree.XMLParser(remove_blank_text=True, huge_tree=True)
+        if isinstance(source, str) and source.lstrip().startswith('<'):
+            source = source.encode('utf-8')
+        if isinstance(source, bytes):
+            tree = etree.ElementTree(etree.fromstring(source, parser=parser))
+        else:
+            tree = etree.parse(source, parser=parser)
+
+    strip_namespaces(tree.getroot())
+    return tree
+
+
+## compiled once, evaluated with the document root as context
+XPATHS = {
+    "documentId": etree.XPath("./id[1]/@root"),
+    "setId": etree.XPath("./setId[1]/@root"),
+    "versionNumber": etree.XPath("./versionNumber[1]/@value"),
+    "productType": etree.XPath("./code[1]/@displayName"),
+    "title": etree.XPath("./title//text()"),
+    "manufacturer": etree.XPath("(./author//representedOrganization/name)[1]"),
+    "effectiveTime": etree.XPath("./effectiveTime/@value"),
+    ## outermost manufacturedProduct elements - their subtrees hold every product field
+    "manufacturedProducts": etree.XPath(".//manufacturedProduct[not(ancestor::manufacturedProduct)]"),
+    "sections": etree.XPath("./component/structuredBody/component/section"),
+    "sectionDisplayName": etree.XPath("(.//@displayName)[1]"),
+    "subsections": etree.XPath("./component/section"),
+    "sectionText": etree.XPath("./text"),
+}
+
+
+def strip_newline_tab(x):
+    return x.strip("\n\t ") if x != None else ""
+
+
+def normalize_date(datestr):
+    """
+    "20200315" (first item of an xpath result) -> "Mar 15, 2020"
+    """
+    result = ""
+
+    try:
+        if datestr != None and len(datestr) > 0:
+            datestr = datestr[0]
+            year, month, day = int(datestr[0:4]), int(datestr[4:6]), int(datestr[6:])
+            result = date(year, month, day).strftime("%b %d, %Y")
+        else:
+            result = ""
+    except Exception as ex:
+        logger.warning("invalid date %s: %s", datestr, ex)
+        return ""
 
-class DrugLabel(object):
-    def __init__(self, xmlstr):
-        p = etree.XMLParser(remove_blank_text=True, huge_tree=True)
+    return result
 
-        self.tree = ET.ElementTree(ET.fromstring(xmlstr,parser=p))
-        self.tree_et = etree.ElementTree(etree.fromstring(xmlstr,parser=p))
 
-        self.root = self.tree.getroot()
-        self.xml_ns = {None: 'urn:hl7-org:v3'}
+def first_value(values):
+    return values[0] if len(values) > 0 else ""
 
-        self.strip_newline_tab = lambda x: x.strip("\n\t ") if x != None else ""
 
-        ## adding regular expression name space for case insensitive matching
-        self.ns = {"re": "http://exslt.org/regular-expressions"}
+def label_title(root):
+    return " ".join([strip_newline_tab(t) for t in XPATHS["title"](root)])
 
-    def process(self):
-        # extract 
-        # code, systemName and displayName
-        response = {}
-        try:
-            summary = self.extract_summary()
-            sections, section_text = self.extract_text_sections
-            response.update(summary)
-            response["sections"] = sections
-            response["sectionText"] = section_text
 
-        except Exception as e:
-            tb = traceback.format_exc()
-            print(tb)
-            raise Exception("error occurred value processing xml", e)
+def label_manufacturer(root):
+    manufacturer = XPATHS["manufacturer"](root)
+    return strip_newline_tab(manufacturer[0].text) if len(manufacturer) > 0 else ""
 
-        return response
 
-    def extract_summary(self):
+## document level fields, each computed on its own from the document root
+HEADER_FIELDS = {
+    "documentId": lambda root: first_value(XPATHS["documentId"](root)),
+    "setId": lambda root: first_value(XPATHS["setId"](root)),
+    "versionNumber": lambda root: first_value(XPATHS["versionNumber"](root)),
+    "productType": lambda root: first_value(XPATHS["productType"](root)),
+    "title": label_title,
+    "manufacturer": label_manufacturer,
+    "effectiveTime": lambda root: normalize_date(XPATHS["effectiveTime"](root)),
+}
+
+## fields of ProductSummary.result, all computed by one walk over the products
+PRODUCT_FIELDS = ("drugName", "routeOfAdministration", "ndcCode", "genericName", "dosageForm", "substanceName",
+                  "inactiveIngredients", "ingredients", "marketingCategory", "consumedIn", "marketingDate")
+
+## summary fields in response order; publishedDate repeats effectiveTime
+SUMMARY_FIELDS = tuple(HEADER_FIELDS) + ("publishedDate",) + PRODUCT_FIELDS
+
+## everything DrugLabel.process can return
+FIELDS = SUMMARY_FIELDS + ("sections", "sectionText")
+
+
+def header_summary(root):
+    """
+    Document level fields: ids, version, product type, title, manufacturer, dates
+    """
+    metadata = {name: extract(root) for name, extract in HEADER_FIELDS.items()}
+    metadata["publishedDate"] = metadata["effectiveTime"]
+    return metadata
+
+
+def parent_tags(elem, depth):
+    """
+    Tags of the depth nearest ancestors, nearest first
+    """
+    tags = []
+    for ancestor in elem.iterancestors():
+        tags.append(ancestor.tag)
+        if len(tags) == depth:
+            break
+    return tuple(tags)
+
+
+class ProductSummary(object):
+    """
+    Product fields gathered in one walk over the manufacturedProduct subtrees.
+    Subtrees are added in document order, so they can be fed as a streaming
+    parser completes them.
+
+    Each field keeps the semantics of the xpath it replaces - the first match in
+    document order, e.g. drugName is the first .//manufacturedProduct//name.
+    """
+    def __init__(self):
+        self.first = {}
+        self.substances = []
+        self.inactive_ingredients = []
+        self.ingredients = []
+
+    def add(self, product):
         """
-        method to extra meta data from the document
-        - drug name, ndc code, revised ndc code,  
-        - setid, document id, drug class, active moiety, active ingredient,
-        - inactive ingredient, any ingredient, 
-        - dosage form,
-        - product type,
-        - consumedIn
-        - marketing date,
-        - marketing category
-        
+        Walk one outermost manufacturedProduct element
         """
+        for elem in product.iter(etree.Element):
+            tag = elem.tag
+            attrib = elem.attrib
+
+            if tag == "name":
+                text = elem.text
+                self.first.setdefault("drugName", text)
+                parents = parent_tags(elem, 2)
+                if parents == ("activeMoiety", "activeMoiety"):
+                    self.substances.append(strip_newline_tab(text))
+                elif parents == ("inactiveIngredientSubstance", "inactiveIngredient"):
+                    self.inactive_ingredients.append(strip_newline_tab(text))
+                elif parents == ("ingredientSubstance", "ingredient"):
+                    self.ingredients.append(strip_newline_tab(text))
+                elif parents[:1] == ("genericMedicine",) and "genericName" not in self.first:
+                    if any(a.tag == "asEntityWithGeneric" for a in elem.iterancestors()):
+                        self.first["genericName"] = text
+
+            elif tag == "formCode":
+                if "code" in attrib:
+                    self.first.setdefault("routeOfAdministration", attrib["code"])
+                if "displayName" in attrib:
+                    self.first.setdefault("dosageForm", attrib["displayName"])
+
+            elif tag == "code":
+                if "code" in attrib:
+                    self.first.setdefault("ndcCode", attrib["code"])
+                if "displayName" in attrib and parent_tags(elem, 3) == ("approval", "subjectOf", "manufacturedProduct"):
+                    self.first.setdefault("marketingCategory", attrib["displayName"])
+
+            elif tag == "routeCode":
+                if "displayName" in attrib and parent_tags(elem, 2) == ("substanceAdministration", "consumedIn"):
+                    self.first.setdefault("consumedIn", attrib["displayName"])
+
+            elif tag == "low":
+                if "value" in attrib and parent_tags(elem, 2) == ("effectiveTime", "marketingAct"):
+                    self.first.setdefault("marketingDate", attrib["value"])
+
+    def result(self):
         metadata = {}
+        metadata["drugName"] = strip_newline_tab(self.first.get("drugName"))
+        metadata["routeOfAdministration"] = strip_newline_tab(self.first.get("routeOfAdministration"))
+        metadata["ndcCode"] = strip_newline_tab(self.first.get("ndcCode"))
+        metadata["genericName"] = strip_newline_tab(self.first.get("genericName"))
+        metadata["dosageForm"] = self.first.get("dosageForm", "")
+        metadata["substanceName"] = ", ".join(sorted(set(self.substances)))
+        metadata["inactiveIngredients"] = ",".join(sorted(set(self.inactive_ingredients)))
+        metadata["ingredients"] = ", ".join(sorted(set(self.ingredients)))
+        metadata["marketingCategory"] = strip_newline_tab(self.first.get("marketingCategory"))
+        metadata["consumedIn"] = self.first.get("consumedIn", "")
+        metadata["marketingDate"] = normalize_date([self.first["marketingDate"]] if "marketingDate" in self.first else [])
+        return metadata
 
-        ## document Id
-        documentId = self.tree.find("./id")
-        documentId = documentId.attrib['root'] if documentId is not None and "root" in documentId.attrib else ""
-        metadata["documentId"] = documentId
-
-        ## setId
-        setid = self.tree.find("./setId")
-        setid = setid.attrib['root'] if setid is not None and "root" in setid.attrib else ""
-        metadata["setId"] = setid
-
-        ## version number
-        splversion = self.tree.find("./versionNumber")
-        versionNumber = ""
-        if splversion is not None:
-            if "value" in splversion.attrib:
-                versionNumber = splversion.attrib["value"]
-        metadata["versionNumber"] = versionNumber
-
-        ## product type   
-        code = self.tree.find("./code")
-        check_if_attrib_exists = lambda x, key: x[key] if key in x else ''
-        product_type = check_if_attrib_exists(code.attrib, "displayName")
-        metadata["productType"] = product_type
-
-        ## title
-        title_text = self.tree_et.xpath("./title//text()")
-        title = (" ".join([self.strip_newline_tab(t) for t in title_text]) if len(title_text) > 0 else "")
-        metadata["title"] = title
-
-        ## manufacturer
-        manufacturer = self.tree.find("./author//representedOrganization/name")
-        if manufacturer != None and manufacturer.text != None:
-            manufacturer = self.strip_newline_tab(manufacturer.text)
-        else:
-            manufacturer = ""
-        metadata["manufacturer"] = manufacturer
-
-        ## effectivetime
-        effectiveTime = self.tree_et.xpath("./effectiveTime/@value")
-        effectiveTime = self.__normalize_date(effectiveTime)
-
-        metadata["effectiveTime"] = effectiveTime
-        metadata["publishedDate"] = effectiveTime
-
-        ## From manufacturedProduct section
-        brand_name = self.tree_et.xpath(".//manufacturedProduct//name")
-        brand_name = self.strip_newline_tab(brand_name[0].text) if len(brand_name) > 0 else ""
-        metadata["drugName"] = brand_name
-
-        route = self.tree_et.xpath(".//manufacturedProduct//formCode/@code")
-        route = self.strip_newline_tab(route[0]) if len(route) > 0 else ""
-        metadata["routeOfAdministration"] = route
-
-        product_ndc = self.tree_et.xpath(".//manufacturedProduct//code/@code")
-        product_ndc = self.strip_newline_tab(product_ndc[0]) if len(product_ndc) > 0 else ""
-        metadata["ndcCode"] = product_ndc
-
-        generic_name = self.tree_et.xpath(".//manufacturedProduct//asEntityWithGeneric//genericMedicine/name")
-        generic_name = self.strip_newline_tab(generic_name[0].text) if len(generic_name) > 0 else ""
-        metadata["genericName"] = generic_name
-
-        ## dosage form
-        dosage_form = self.tree_et.xpath(".//manufacturedProduct//formCode/@displayName")
-        dosage_form = dosage_form[0] if len(dosage_form) > 0 else ""
-        metadata["dosageForm"] = dosage_form
-
-        # active ingredients
-        substance_name = sorted([self.strip_newline_tab(a.text) for a in
-                                 self.tree_et.xpath(".//.//manufacturedProduct//activeMoiety/activeMoiety/name")])
-        substance_name = ", ".join(set(substance_name))
-        metadata["substanceName"] = substance_name
-
-        ## inactive ingredients
-        inactive_ingredients = sorted([self.strip_newline_tab(inactive.text) for inactive in self.tree_et.xpath(
-            ".//manufacturedProduct//inactiveIngredient/inactiveIngredientSubstance/name")])
-
-        if len(inactive_ingredients) == 0:
-            inactive_ingredients = ""
-        else:
-            inactive_ingredients = ",".join(set(inactive_ingredients))
 
-        metadata["inactiveIngredients"] = inactive_ingredients
+def product_summary(products):
+    summary = ProductSummary()
+    for product in products:
+        summary.add(product)
+    return summary.result()
+
+
+def section_content(section):
+    """
+    Text under the section's own <text> element, nested sections excluded
+    """
+    content = []
+    for text in XPATHS["sectionText"](section):
+        content.extend(text.itertext())
+    return " ".join(content).encode("ascii", "ignore").decode("utf-8") if len(content) > 0 else ""
+
+
+def section_title(section):
+    title = section.find("title")
+    return (title.text or "") if title is not None else ""
+
+
+def section_name(section, index):
+    """
+    Display name of a top level section, section<index> when it has none
+    """
+    display_name = XPATHS["sectionDisplayName"](section)
+    return strip_newline_tab(display_name[0]) if len(display_name) > 0 else f"section{index}"
+
+
+def convert_text_title_case(text):
+    text = "".join([x.lower() if index == 0 else x.title() for index, x in enumerate(text.split(" "))])
+    text = text.translate(str.maketrans('', '', string.punctuation)) if text != None else ""
+    return text
+
+
+def section_body(section, heading):
+    """
+    heading, the section's own text, then title and text of every nested
+    section depth first. Walks the nesting with an explicit stack and joins
+    the fragments once, so deep labels stay linear.
+    """
+    fragments = [heading, "\n", section_content(section), "\n"]
+    stack = list(reversed(XPATHS["subsections"](section)))
+    while stack:
+        compsec = stack.pop()
+        fragments.append(section_title(compsec))
+        fragments.extend(["\n", section_content(compsec), "\n"])
+        stack.extend(reversed(XPATHS["subsections"](compsec)))
+    return "".join(fragments)
+
+
+def local_name(tag):
+    return tag[tag.index('}') + 1:] if tag[0] == '{' else tag
+
+
+def iterparse_label(source, sections=True):
+    """
+    Stream an SPL document with lxml iterparse instead of building the whole tree.
+
+    Tags lose their namespace as they are opened, and every top level section is
+    cleared from the tree once it has been reported, so memory stays bounded by
+    the largest section rather than the document.
+
+    Args:
+        source: path to the xml file, a file object, or xml bytes
+        sections (bool, optional): report section text. With False only the
+            header and summary are built. Defaults to True.
+
+    Yields:
+        ("header", dict) - document level fields, once the body starts
+        ("section", key, text) - each top level section as it completes; repeated
+            keys are headed by the section title, as in extract_text_sections
+        ("summary", dict) - header and product fields, at the end of the document
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    root = None
+    header = None
+    products = ProductSummary()
+    seen_keys = set()
+    index = 0
+    ## local names of the open elements
+    stack = []
+    ## number of open manufacturedProduct elements
+    open_products = 0
+
+    for event, elem in etree.iterparse(source, events=("start", "end"), remove_blank_text=True,
+                                       huge_tree=True):
+        if event == "start":
+            if isinstance(elem.tag, str):
+                elem.tag = local_name(elem.tag)
+            stack.append(elem.tag)
+            if root is None:
+                root = elem
+            elif header is None and stack[1:] == ["component"]:
+                ## header elements precede the body
+                header = header_summary(root)
+                yield ("header", header)
+            if elem.tag == "manufacturedProduct":
+                open_products += 1
+            continue
+
+        tag = stack.pop()
+        if tag == "manufacturedProduct":
+            open_products -= 1
+            if open_products == 0:
+                products.add(elem)
+
+        elif sections and tag == "section" and stack[1:] == ["component", "structuredBody", "component"]:
+            sec_name = section_name(elem, index)
+            key = convert_text_title_case(sec_name)
+            heading = section_title(elem) if key in seen_keys else sec_name
+            seen_keys.add(key)
+            index += 1
+            yield ("section", key, section_body(elem, heading))
+
+        elif tag == "component" and stack[1:] == ["component", "structuredBody"]:
+            ## drop the finished section and every earlier sibling
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    if root is None:
+        return
+    if header is None:
+        header = header_summary(root)
+        yield ("header", header)
+
+    metadata = dict(header)
+    metadata.update(products.result())
+    yield ("summary", metadata)
+
+
+def process_streaming(source):
+    """
+    Same response as DrugLabel(source).process(), built from iterparse_label
+    """
+    response = {}
+    sections = {}
+    full_text = []
+    with stage("xml_stream") as timer:
+        for event in iterparse_label(source):
+            if event[0] == "section":
+                key, text = event[1], event[2]
+                sections.setdefault(key, []).append(text)
+                full_text.append(text)
+            elif event[0] == "summary":
+                response.update(event[1])
+        timer.add(documents=1, sections=len(full_text))
+
+    response["sections"] = {key: "".join(texts) for key, texts in sections.items()}
+    response["sectionText"] = "".join(full_text)
+    return response
+
+
+class LabelSections(Mapping):
+    """
+    Top level sections of a label keyed as extract_text_sections keys them.
+    Keys are read up front; a section's text is built the first time it is
+    looked up and kept.
+    """
+    def __init__(self, root):
+        ## key -> [(section element, heading)], repeated sections in document order
+        self.parts = {}
+        ## (key, position in parts[key]) of every section in document order
+        self.order = []
+        self.bodies = {}
+        self.texts = {}
+        for index, sec in enumerate(XPATHS["sections"](root)):
+            sec_name = section_name(sec, index)
+            key = convert_text_title_case(sec_name)
+            parts = self.parts.setdefault(key, [])
+            ## section repeated multiple times
+            heading = section_title(sec) if parts else sec_name
+            self.order.append((key, len(parts)))
+            parts.append((sec, heading))
+
+    def section_bodies(self, key):
+        bodies = self.bodies.get(key)
+        if bodies is None:
+            bodies = self.bodies[key] = [section_body(sec, heading) for sec, heading in self.parts[key]]
+        return bodies
+
+    def __getitem__(self, key):
+        text = self.texts.get(key)
+        if text is None:
+            text = self.texts[key] = "".join(self.section_bodies(key))
+        return text
 
-        ## other ingredients
-        ingredients = sorted([self.strip_newline_tab(ingredient.text) for ingredient in
-                              self.tree_et.xpath(".//manufacturedProduct//ingredient/ingredientSubstance/name")])
+    def __iter__(self):
+        return iter(self.parts)
 
-        if len(ingredients) == 0:
-            ingredients = ""
-        else:
-            ingredients = ", ".join(set(ingredients))
-        metadata["ingredients"] = ingredients
+    def __len__(self):
+        return len(self.parts)
 
-        # marketing_category
-        marketing_category = self.tree_et.xpath(".//manufacturedProduct/subjectOf/approval/code/@displayName")
-        marketing_category = self.strip_newline_tab(marketing_category[0]) if len(marketing_category) > 0 else ""
-        metadata["marketingCategory"] = marketing_category
+    def full_text(self):
+        """
+        Text of all sections in document order
+        """
+        return "".join([self.section_bodies(key)[position] for key, position in self.order])
 
-        # consumed in
-        consumed_in = self.tree_et.xpath(
-            ".//manufacturedProduct//consumedIn/substanceAdministration/routeCode/@displayName")
-        consumed_in = consumed_in[0] if len(consumed_in) > 0 else ""
-        metadata["consumedIn"] = consumed_in
 
-        # revision date
-        marketing_date = self.tree_et.xpath(".//manufacturedProduct//marketingAct/effectiveTime/low/@value")
-        marketing_date = self.__normalize_date(marketing_date)
-        metadata["marketingDate"] = marketing_date
+def check_field(name):
+    """
+    Raises:
+        ValueError: name is neither in FIELDS nor a "sections.<key>" field
+    """
+    if name not in FIELDS and not name.startswith("sections."):
+        raise ValueError(f"unknown DrugLabel field {name}, expected one of {', '.join(FIELDS)}")
 
-        return metadata
+
+def header_field(name):
+    extract = HEADER_FIELDS[name]
+
+    def field(self):
+        return extract(self.root)
+    field.__doc__ = f"{name} of the label, computed on first access"
+    return cached_property(field)
+
+
+def product_field(name):
+    def field(self):
+        return self.products[name]
+    field.__doc__ = f"{name} of the label, from the product walk on first access"
+    return cached_property(field)
+
+
+class DrugLabel(object):
+    """
+    Fields of an SPL document. Every summary field (label.setId,
+    label.genericName, ...) and every section (label.sections[key]) is computed
+    on first access and cached, so callers pay only for what they read:
+
+        label = DrugLabel(path)
+        label.setId, label.versionNumber                        ## two xpaths
+        label.process(fields=["setId", "versionNumber", "sections.indications"])
+        label.process()                                         ## everything
+    """
+    documentId = header_field("documentId")
+    setId = header_field("setId")
+    versionNumber = header_field("versionNumber")
+    productType = header_field("productType")
+    title = header_field("title")
+    manufacturer = header_field("manufacturer")
+    effectiveTime = header_field("effectiveTime")
+
+    drugName = product_field("drugName")
+    routeOfAdministration = product_field("routeOfAdministration")
+    ndcCode = product_field("ndcCode")
+    genericName = product_field("genericName")
+    dosageForm = product_field("dosageForm")
+    substanceName = product_field("substanceName")
+    inactiveIngredients = product_field("inactiveIngredients")
+    ingredients = product_field("ingredients")
+    marketingCategory = product_field("marketingCategory")
+    consumedIn = product_field("consumedIn")
+    marketingDate = product_field("marketingDate")
+
+    def __init__(self, source):
+        """
+        Args:
+            source: path to an SPL xml file, xml bytes/str, or a parsed lxml tree.
+                The document is parsed once; tree and tree_et are the same lxml tree.
+        """
+        with stage("xml_parse") as timer:
+            self.tree_et = parse_label(source)
+            timer.add(documents=1)
+        self.tree = self.tree_et
+
+        self.root = self.tree.getroot()
 
     @property
-    def extract_text_sections(self):
+    def publishedDate(self):
+        return self.effectiveTime
 
-        ## get all sections
-        query = "./component/structuredBody/component/section"
-        sections = self.tree_et.xpath(query)
-        response = {}
+    @cached_property
+    def products(self):
+        """
+        Product fields, gathered in one walk over the manufacturedProduct subtrees
+        """
+        return product_summary(XPATHS["manufacturedProducts"](self.root))
 
-        section_text = ""
-
-        for index, sec in enumerate(sections):
-            sec_name =  (self.strip_newline_tab(sec.xpath(".//@displayName")[0])) if len(
-                sec.xpath(".//@displayName")) > 0 and sec.xpath(".//@displayName")!= None else f"section{index}"
-            
-            ## check if section has components
-            component_sections = self.__check_section_has_components(sec)
-            has_components = len(component_sections) > 0
-            content = self.__extract_section_text(sec)
-
-            # = content
-            section_text += sec_name + "\n" + content
-            innertext = ""
-            if has_components:
-                innertext = self.__recursively_get_text(sec)
-                
-            key = self.__convert_text_title_case(sec_name)
-            ## section repeated multiple times
-            if key in response:
-                title = sec.xpath("./title")
-                if len(title) > 0:
-                    title = title[0].text or ""
-                else:
-                    title = ""
-                
-                text = title + "\n" + content + "\n" + innertext
-                section_text += text
-                response[key] += text
-            else:
-                text = sec_name + "\n" + content + "\n" + innertext
-                section_text += text
-                response[key] = text
+    @cached_property
+    def sections(self):
+        """
+        LabelSections of the document, each section's text built when read
+        """
+        return LabelSections(self.root)
 
+    @cached_property
+    def sectionText(self):
+        return self.sections.full_text()
 
-        return response, section_text
+    def field(self, name):
+        """
+        Value of one field as process returns it: a summary field, "sections"
+        (a dict of every section), "sectionText", or "sections.<key>" for a
+        single section
 
-    #### Private methods - helpers
-    def __get_component_section(self, section_name):
-        query = "./component/structuredBody/component/section[re:test(./code/@displayName, '^{0}$', 'i')]".format(
-            section_name)
-        section = self.tree_et.xpath(query, namespaces=self.ns)
-        return section
+        Raises:
+            ValueError: unknown field
+        """
+        if name == "sections":
+            return dict(self.sections)
+        check_field(name)
+        if name.startswith("sections."):
+            return self.sections.get(name[len("sections."):])
+        return getattr(self, name)
+
+    def process(self, fields=None):
+        """
+        Response of the label, all of it or a projection.
 
-    def __check_section_has_components(self, section_xml):
-        components = section_xml.xpath("./component/section")
-        return components
+        Args:
+            fields (list, optional): field names to compute - names from FIELDS
+                or "sections.<key>" for single sections, which are gathered
+                under "sections" (a missing section is left out). Defaults to
+                every field.
 
-    def __extract_section_text(self, section):
-        content = ""
-        content = section.xpath("./text//descendant-or-self::*/text()")
-        return " ".join(content).encode("ascii", "ignore").decode("utf-8") if len(content) > 0 else ""
+        Returns:
+            dict: field name -> value
 
-    def __normalize_date(self, datestr):
-        result = ""
+        Raises:
+            ValueError: unknown field
+        """
+        for name in (fields or []):
+            check_field(name)
 
+        response = {}
         try:
-            if datestr != None and len(datestr) > 0:
-                datestr = datestr[0]
-                year, month, day = int(datestr[0:4]), int(datestr[4:6]), int(datestr[6:])
-                result = date(year, month, day).strftime("%b %d, %Y")
+            if fields is None:
+                summary = self.extract_summary()
+                sections, section_text = self.extract_text_sections()
+                response.update(summary)
+                response["sections"] = sections
+                response["sectionText"] = section_text
             else:
-                result = ""
-        except Exception as ex:
-            print(ex)
-            return ""
-
-        return result
-
-    def __recursively_get_text(self, sec):
-        response = ""
-        component_sections = self.__check_section_has_components(sec)
-        for compsec in component_sections:
-            has_components = self.__check_section_has_components(compsec)
-            title = compsec.xpath("./title")
-
-            if len(title) > 0:
-                title = title[0].text or ""
-            else:
-                title = ""
-
-            response +=title
-            content = self.__extract_section_text(compsec)
-            if content is not None:
-                response += "\n" + content + "\n"
+                with stage("xml_fields") as timer:
+                    for name in fields:
+                        if name.startswith("sections."):
+                            value = self.field(name)
+                            if value is not None:
+                                response.setdefault("sections", {})[name[len("sections."):]] = value
+                        else:
+                            response[name] = self.field(name)
+                    timer.add(documents=1, fields=len(fields))
 
-            if has_components:
-                innertext = self.__recursively_get_text(compsec)
-                if innertext != None:
-                    response += innertext
+        except Exception as e:
+            logger.error("error occurred processing xml\n%s", traceback.format_exc())
+            raise Exception("error occurred value processing xml", e)
 
         return response
 
-    def __convert_text_title_case(self, text):
-        text = "".join([x.lower() if index == 0 else x.title() for index, x in enumerate(text.split(" "))])
-        text = text.translate(str.maketrans('', '', string.punctuation)) if text != None else ""
-        return text
+    def extract_summary(self):
+        """
+        method to extra meta data from the document
+        - drug name, ndc code, revised ndc code,  
+        - setid, document id, drug class, active moiety, active ingredient,
+        - inactive ingredient, any ingredient, 
+        - dosage form,
+        - product type,
+        - consumedIn
+        - marketing date,
+        - marketing category
+        
+        """
+        with stage("xml_summary") as timer:
+            metadata = {name: getattr(self, name) for name in SUMMARY_FIELDS}
+            timer.add(documents=1)
 
+        return metadata
 
+    def extract_text_sections(self):
+        """
+        Text of every top level section in one pass.
+
+        Returns:
+            tuple: (sections, section_text) - dict of title cased section name to
+            its text (repeated sections are appended, headed by their title), and
+            the text of all sections in document order
+        """
+        with stage("xml_sections") as timer:
+            sections = dict(self.sections)
+            section_text = self.sectionText
+            timer.add(documents=1, sections=len(self.sections.order))
+        return sections, section_text
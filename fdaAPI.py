@@ -1,82 +1,423 @@
 #!/usr/bin/env python
 
 import os
+import sys
 import yaml
 import requests
-import io
+import time
+import random
+import hashlib
+import logging
+import threading
+from urllib.parse import urlparse, urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 
 import zipfile
-import json
+import ijson
 
 ## methods from other classes
 import utils
 import pprint
+import instrumentation
+from instrumentation import stage
+from label_store import LabelStore
+
+logger = logging.getLogger(__name__)
 
 ## place to save data
 SAVE_PATH = "data"
 
+## bytes per read while streaming a download to disk
+CHUNK_SIZE = 1 << 20
+## seconds to wait for the server to connect / send the next chunk
+TIMEOUT = (10, 60)
+
+## download defaults, overridable in config.yaml
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_BACKOFF = 2.0
+## report progress every PROGRESS_STEP bytes
+PROGRESS_STEP = 50 * CHUNK_SIZE
+
+## errors worth retrying - the next attempt resumes from the partial file
+RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, IOError)
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+## incremental sync through the query API
+LABEL_ENDPOINT = "label.json"
+## largest page the API serves
+SYNC_PAGE_SIZE = 1000
+## the API refuses skip beyond this - deeper pages need the search_after Link header
+MAX_SKIP = 25000
+## sync_state key holding meta.last_updated of the last successful download / sync
+LAST_UPDATED = "last_updated"
+
+class ChecksumError(IOError):
+    pass
+
+def http_error(response):
+    """
+    HTTPError for a failed response. Unlike raise_for_status the message carries
+    the url with the api key masked, as it ends up in logs.
+    """
+    return requests.HTTPError(f"{response.status_code} {response.reason or ''} for {utils.redact_url(response.url)}",
+                              response=response)
+
+class TimedReader(object):
+    """
+    File wrapper timing read() as the decompress stage of a shard. ijson pulls
+    the zip member through read(), so this is the inflate time; the rest of the
+    parse stage is json decoding and storing.
+    """
+    def __init__(self, f, shard):
+        self.f = f
+        self.timer = instrumentation.METRICS.timer("decompress", {"shard": shard})
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.f.read(size)
+        self.timer.record(time.perf_counter() - start)
+        self.timer.add(bytes=len(data))
+        return data
+
 class FDAAPI(object):
     """
     FDA API class - to download drug label dataset
     """
-    def __init__(self,configuration_file = "config.yaml"):
+    def __init__(self, configuration_file = "config.yaml", save_path = SAVE_PATH, session = None, download = True):
         self.config = utils.read_configuration(configuration_file)
         self.endpoint = self.config.get('API_ENDPOINT_PREFIX','')
-        self.endpoint = f"{self.endpoint}?api_key={self.config.get('API_KEY','')}"
+        self.api_key = self.config.get('API_KEY','')
+        self.label_url = urljoin(self.endpoint, LABEL_ENDPOINT)
+        self.page_size = self.config.get("SYNC_PAGE_SIZE", SYNC_PAGE_SIZE)
         self.metadata = {}
+        self.save_path = save_path
+        ## parsed labels are appended to one packed store
+        self.store = LabelStore(os.path.join(save_path, "labels.db"))
+
+        self.workers = self.config.get("DOWNLOAD_WORKERS", DOWNLOAD_WORKERS)
+        self.retries = self.config.get("DOWNLOAD_RETRIES", DOWNLOAD_RETRIES)
+        self.backoff = self.config.get("DOWNLOAD_BACKOFF", DOWNLOAD_BACKOFF)
+        ## optional expected sha256 per shard url
+        self.checksums = self.config.get("API_CHECKSUMS") or {}
+
+        ## one pooled session shared by all download threads
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.progress_lock = threading.Lock()
 
         ## read data
         ## API URLS
         self.api_urls = self.config.get("API_URLS","")
 
-        list(map(self.download_data,self.api_urls))
-    
+        if download:
+            self.download_all(self.api_urls)
+
+
 
-        
     def read_metadata(self,json_object):
         pass
 
+    def download_all(self, urls):
+        """
+        Download and parse shards concurrently on the shared session.
+
+        Args:
+            urls (list): shard urls
+
+        Returns:
+            dict: url -> path of the downloaded shard, None for shards that failed
+        """
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.download_data, url): url for url in urls}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        return results
+
     def download_data(self, url):
+        shard = os.path.basename(urlparse(url).path)
         try:
-            response = requests.get(url)
-            with zipfile.ZipFile(io.BytesIO(response.content)) as zfile:
+            with stage("download", shard=shard) as timer:
+                zip_path = self.download_with_retries(url)
+                timer.add(bytes=os.path.getsize(zip_path))
+
+            with zipfile.ZipFile(zip_path) as zfile:
                 for zipinfo in zfile.infolist():
-                    filename = zipinfo.filename
+                    ## meta precedes results in the shard, so this only reads the head of the member
                     with zfile.open(zipinfo) as f:
-                        
-                        ## save zip file
-                        content = f.read()
-                        
-                        ## save json file
-                        with open(os.path.join(SAVE_PATH,filename),'w') as sf:
-                            sf.write(content.decode("utf-8"))
-
-                        d = json.loads(content.decode('utf-8'))
-                        # parse json content into individual files
-                        self.parse_json_download(d)     
-                        
-        except IOError as ex:
-            print(ex)
+                        metadata = next(ijson.items(f, "meta", use_float=True), {})
+                    self.metadata[zipinfo.filename] = metadata
+
+                    # parse json content into individual files, one record at a time
+                    with stage("parse", shard=shard) as timer, zfile.open(zipinfo) as f:
+                        stored = self.parse_json_download(
+                            metadata, ijson.items(TimedReader(f, shard), "results.item", use_float=True))
+                        timer.add(documents=stored or 0, bytes=zipinfo.file_size)
+
+            return zip_path
 
-    def parse_json_download(self, json_content):
+        except (IOError, requests.RequestException, zipfile.BadZipFile, ijson.JSONError) as ex:
+            logger.error("failed to download %s: %s", utils.redact_url(url), utils.redact_url(ex))
+
+    def download_with_retries(self, url):
+        """
+        download_file with exponential backoff. Each retry resumes from the partial
+        file, and a shard whose sha256 does not match API_CHECKSUMS is fetched again.
         """
-        parse json download, extract individual results
+        for attempt in range(self.retries + 1):
+            try:
+                path = self.download_file(url)
+                self.verify_checksum(url, path)
+                return path
+            except (requests.HTTPError, ChecksumError) as ex:
+                status = getattr(ex.response, "status_code", None) if isinstance(ex, requests.HTTPError) else None
+                if isinstance(ex, requests.HTTPError) and status not in RETRYABLE_STATUS:
+                    raise
+                error = ex
+            except RETRYABLE_ERRORS as ex:
+                error = ex
+
+            if attempt < self.retries:
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                logger.warning("download of %s failed (%s), retrying in %.1fs", utils.redact_url(url),
+                               utils.redact_url(error), delay)
+                time.sleep(delay)
+
+        raise error
+
+    def verify_checksum(self, url, path):
+        """
+        Compare the sha256 of path with the expected checksum, if configured, and
+        record it in <path>.sha256. A mismatching file is removed so the retry
+        starts from scratch.
+        """
+        digest = hashlib.sha256()
+        with stage("checksum", shard=os.path.basename(path)) as timer, open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                timer.add(bytes=len(chunk))
+        checksum = digest.hexdigest()
+
+        expected = self.checksums.get(url)
+        if expected and expected.lower() != checksum:
+            os.remove(path)
+            raise ChecksumError(f"sha256 mismatch for {utils.redact_url(url)}: expected {expected}, got {checksum}")
+
+        with open(path + ".sha256", "w") as cf:
+            cf.write(f"{checksum}  {os.path.basename(path)}\n")
+
+    def report_progress(self, url, done, total):
+        name = os.path.basename(urlparse(url).path)
+        with self.progress_lock:
+            if total:
+                logger.info("%s: %.0f%% of %d bytes", name, 100.0 * done / total, total)
+            else:
+                logger.info("%s: %d bytes", name, done)
+
+    def download_file(self, url):
+        """
+        Stream url to SAVE_PATH without holding it in memory. An interrupted
+        download is left as <name>.part and resumed with an HTTP Range request on
+        the next call; the ETag sent as If-Range makes the server restart from
+        scratch if the file changed in between.
 
         Args:
-            json_content ([type]): [description]
+            url (str): shard url
+
+        Returns:
+            str: path of the downloaded file
+        """
+        filename = os.path.basename(urlparse(url).path)
+        path = os.path.join(self.save_path, filename)
+        partial = path + ".part"
+        etag_path = partial + ".etag"
+
+        headers = {}
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        if offset and os.path.exists(etag_path):
+            with open(etag_path) as ef:
+                headers["If-Range"] = ef.read().strip()
+            headers["Range"] = f"bytes={offset}-"
+
+        with self.session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+            ## 416: partial already holds the whole file
+            if response.status_code != 416:
+                if response.status_code >= 400:
+                    raise http_error(response)
+                if response.status_code != 206:
+                    offset = 0
+
+                etag = response.headers.get("ETag")
+                if etag:
+                    with open(etag_path, "w") as ef:
+                        ef.write(etag)
+
+                length = response.headers.get("Content-Length")
+                total = offset + int(length) if length else None
+                done = offset
+                reported = offset
+                with open(partial, "ab" if offset else "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        done += len(chunk)
+                        if done - reported >= PROGRESS_STEP:
+                            self.report_progress(url, done, total)
+                            reported = done
+                self.report_progress(url, done, total)
+
+        os.replace(partial, path)
+        if os.path.exists(etag_path):
+            os.remove(etag_path)
+        return path
+
+    def parse_json_download(self, metadata, results):
         """
-        metadata = json_content.get("meta","")
-        results = json_content.get("results","")
+        parse json download, append individual results to the label store
 
+        Args:
+            metadata (dict): "meta" object of the download
+            results (iterable): "results" records, read lazily
+
+        Returns:
+            int: number of labels stored
+        """
         try:
-            for result in results:
-                # extract application id
-                application_id = result.get("id")
-                json_object = json.dumps(result, indent = 4) 
-                json_filename = f"{application_id}.json"
-                with open(os.path.join(SAVE_PATH,json_filename), "w") as outfile: 
-                    outfile.write(json_object) 
+            count = self.store.put_many(results)
+            self.record_last_updated(metadata.get("last_updated"))
+            return count
         except IOError as ex:
-            print("failed to parse json",ex)
+            logger.error("failed to parse json: %s", ex)
+
+    def record_last_updated(self, last_updated):
+        """
+        Remember the newest meta.last_updated seen, the starting point of the next
+        sync. Shard threads call this concurrently; the store compares and writes
+        under its lock.
+        """
+        if last_updated:
+            self.store.advance_state(LAST_UPDATED, last_updated)
+
+    def fetch_page(self, url, params):
+        """
+        GET one page of the query API, retrying throttled and failed requests.
+        A 404 is the API's answer to a search without matches and returns None.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(url, params=params, timeout=TIMEOUT)
+                if response.status_code == 404:
+                    return None
+                if response.status_code not in RETRYABLE_STATUS:
+                    if response.status_code >= 400:
+                        raise http_error(response)
+                    return response
+                error = http_error(response)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                error = ex
+
+            if attempt < self.retries:
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                logger.warning("request to %s failed (%s), retrying in %.1fs", utils.redact_url(url),
+                               utils.redact_url(error), delay)
+                time.sleep(delay)
+
+        if isinstance(error, requests.HTTPError):
+            raise error
+        ## connection errors quote the full url, api key included
+        raise type(error)(utils.redact_url(error)) from None
+
+    def sync(self, since=None, until=None):
+        """
+        Incremental refresh: fetch only labels with an effective_time since the
+        last successful download or sync from the drug/label query endpoint and
+        add them to the label store. Pages follow the search_after Link header
+        and fall back to skip when the server does not send one.
+
+        Args:
+            since (str, optional): first effective_time, YYYY-MM-DD or YYYYMMDD.
+                Defaults to the recorded last_updated.
+            until (str, optional): last effective_time. Defaults to today.
+
+        The recorded last_updated only advances when every page was read: a
+        search without matches or a walk stopped at the skip limit keep it, so
+        no label is left out of the next sync.
+
+        Returns:
+            int: number of labels stored, None if there is nothing to sync from
+        """
+        since = since or self.store.get_state(LAST_UPDATED)
+        if not since:
+            logger.warning("no previous download recorded - run a full download first")
+            return None
+        until = until or time.strftime("%Y%m%d")
+
+        search = f"effective_time:[{since.replace('-', '')} TO {until.replace('-', '')}]"
+        params = {"search": search, "limit": self.page_size}
+        if self.api_key:
+            params["api_key"] = self.api_key
+
+        url = self.label_url
+        count = 0
+        skip = 0
+        pages = 0
+        last_updated = None
+        complete = False
+        while url:
+            with stage("sync_request", endpoint=LABEL_ENDPOINT) as timer:
+                response = self.fetch_page(url, params)
+                if response is not None:
+                    timer.add(bytes=len(response.content))
+            if response is None:
+                ## no matches: past the last page, or nothing to sync at all
+                complete = pages > 0
+                break
+
+            pages += 1
+            page = response.json()
+            meta = page.get("meta") or {}
+            last_updated = meta.get("last_updated") or last_updated
+            results = page.get("results") or []
+            count += self.store.put_many(results)
+
+            next_url = response.links.get("next", {}).get("url")
+            if next_url:
+                ## the next link carries search and search_after; only add the key if missing
+                url = next_url
+                params = {"api_key": self.api_key} if self.api_key and "api_key=" not in next_url else None
+                continue
+            if url != self.label_url:
+                ## paging by link and this was the last page
+                complete = True
+                break
+
+            skip += len(results)
+            total = (meta.get("results") or {}).get("total", 0)
+            if not results or skip >= total:
+                complete = True
+                break
+            if skip > MAX_SKIP:
+                logger.warning("stopping sync at skip %d: the server sent no search_after link, "
+                               "last_updated is not advanced", skip)
+                break
+            params["skip"] = skip
+
+        if complete:
+            self.record_last_updated(last_updated or time.strftime("%Y-%m-%d"))
+        instrumentation.count("sync_documents", count, endpoint=LABEL_ENDPOINT)
+        logger.info("synced %d labels with %s", count, search)
+        return count
 
-api_obj = FDAAPI()
+if __name__ == "__main__":
+    ## fdaAPI.py [--sync]: full shard download, or only labels changed since the last run
+    instrumentation.configure_logging()
+    with instrumentation.session(utils.read_configuration()):
+        if "--sync" in sys.argv:
+            api_obj = FDAAPI(download=False)
+            api_obj.sync()
+        else:
+            api_obj = FDAAPI()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""
+Stage timings, counters and profiling for the ingestion pipeline.
+
+Code marks a stage with
+
+    with stage("insert", table="products") as timer:
+        ...
+        timer.add(rows=len(rows))
+
+and every stage accumulates calls, wall time, the slowest call and item counts
+(rows, bytes, documents) per label set in the process wide METRICS. A snapshot
+can be exported as JSON, with per second rates, or in the Prometheus text
+format, together with the peak RSS of the process. Worker processes send their
+snapshot back to the parent, which merges it.
+
+cProfile and tracemalloc are switched on from config.yaml:
+
+    METRICS_PATH: data/metrics.json     ## or .prom for Prometheus text
+    PROFILE: cprofile                   ## cprofile, tracemalloc or off
+    PROFILE_PATH: data/profile.out
+"""
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+## prefix of the exported Prometheus metric names
+PROMETHEUS_PREFIX = "fda"
+## allocation sites reported by tracemalloc
+TRACEMALLOC_TOP = 25
+CPROFILE = "cprofile"
+TRACEMALLOC = "tracemalloc"
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process in bytes
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## kilobytes on Linux, bytes on macOS
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class StageTimer(object):
+    """
+    Totals of one stage and label set
+    """
+    __slots__ = ("calls", "seconds", "max_seconds", "counts")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.counts = {}
+
+    def add(self, **counts):
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def record(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+
+class Metrics(object):
+    """
+    Stage timers keyed by (stage, labels). Thread safe.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.started = time.time()
+
+    def timer(self, name, labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            timer = self.stages.get(key)
+            if timer is None:
+                timer = self.stages[key] = StageTimer()
+        return timer
+
+    @contextmanager
+    def stage(self, name, **labels):
+        timer = self.timer(name, labels)
+        start = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                timer.record(elapsed)
+
+    def timed(self, iterable, name, count=None, **labels):
+        """
+        Wrap an iterable, timing the production of each item as stage name.
+
+        Args:
+            count (callable, optional): item -> {count name: value}, e.g.
+                lambda batch: {"rows": len(batch)}
+        """
+        timer = self.timer(name, labels)
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                with self.lock:
+                    timer.seconds += time.perf_counter() - start
+                return
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                timer.record(elapsed)
+                if count is not None:
+                    timer.add(**count(item))
+            yield item
+
+    def count(self, name, value=1, **labels):
+        """
+        Add to a plain counter, reported as a stage without time
+        """
+        timer = self.timer(name, labels)
+        with self.lock:
+            timer.add(total=value)
+
+    def snapshot(self):
+        """
+        Picklable copy of the timers, for merge in another process
+        """
+        with self.lock:
+            return [(name, labels, timer.calls, timer.seconds, timer.max_seconds, dict(timer.counts))
+                    for (name, labels), timer in self.stages.items()]
+
+    def merge(self, snapshot):
+        for name, labels, calls, seconds, max_seconds, counts in snapshot:
+            timer = self.timer(name, dict(labels))
+            with self.lock:
+                timer.calls += calls
+                timer.seconds += seconds
+                timer.max_seconds = max(timer.max_seconds, max_seconds)
+                timer.add(**counts)
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.started = time.time()
+
+    def to_dict(self):
+        """
+        Stages with totals and per second rates, plus process level figures
+        """
+        stages = []
+        for name, labels, calls, seconds, max_seconds, counts in sorted(self.snapshot()):
+            entry = {"stage": name, "labels": dict(labels), "calls": calls, "seconds": round(seconds, 6),
+                     "maxSeconds": round(max_seconds, 6), "counts": counts}
+            if seconds > 0:
+                entry["perSecond"] = {count: round(value / seconds, 2) for count, value in counts.items()}
+            stages.append(entry)
+        return {"started": self.started, "elapsed": round(time.time() - self.started, 3),
+                "peakRssBytes": peak_rss(), "stages": stages}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self):
+        """
+        Prometheus text exposition format
+        """
+        prefix = PROMETHEUS_PREFIX
+        snapshot = sorted(self.snapshot())
+        families = {
+            "stage_seconds_total": ("counter", lambda calls, seconds, max_seconds: seconds),
+            "stage_calls_total": ("counter", lambda calls, seconds, max_seconds: calls),
+            "stage_max_seconds": ("gauge", lambda calls, seconds, max_seconds: max_seconds),
+        }
+        ## samples of one metric family must be contiguous
+        lines = []
+        for family, (kind, value) in families.items():
+            lines.append(f"# TYPE {prefix}_{family} {kind}")
+            for name, labels, calls, seconds, max_seconds, counts in snapshot:
+                lines.append(f"{prefix}_{family}{prometheus_labels(dict(labels, stage=name))} "
+                             f"{value(calls, seconds, max_seconds)}")
+        lines.append(f"# TYPE {prefix}_stage_items_total counter")
+        for name, labels, calls, seconds, max_seconds, counts in snapshot:
+            for count, value in sorted(counts.items()):
+                lines.append(f"{prefix}_stage_items_total{prometheus_labels(dict(labels, stage=name, unit=count))} {value}")
+        lines.append(f"# TYPE {prefix}_peak_rss_bytes gauge")
+        lines.append(f"{prefix}_peak_rss_bytes {peak_rss()}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Export to path: Prometheus text for .prom/.txt, JSON otherwise
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(self.to_prometheus() if path.endswith((".prom", ".txt")) else self.to_json())
+
+
+def prometheus_labels(labels):
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+## process wide metrics
+METRICS = Metrics()
+stage = METRICS.stage
+timed = METRICS.timed
+count = METRICS.count
+
+
+@contextmanager
+def session(config=None):
+    """
+    Profile and export metrics around a pipeline run, as configured.
+
+    Args:
+        config (dict, optional): configuration with METRICS_PATH, PROFILE and
+            PROFILE_PATH. Defaults to no export and no profiling.
+    """
+    config = config or {}
+    profile = str(config.get("PROFILE") or "").lower()
+    profile_path = config.get("PROFILE_PATH")
+    profiler = None
+
+    if profile == CPROFILE:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile == TRACEMALLOC:
+        import tracemalloc
+        tracemalloc.start()
+
+    try:
+        yield METRICS
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            import pstats
+            if profile_path:
+                profiler.dump_stats(profile_path)
+                logger.info("cProfile stats written to %s", profile_path)
+            else:
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(40)
+        elif profile == TRACEMALLOC:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            top = snapshot.statistics("lineno")[:TRACEMALLOC_TOP]
+            report = [f"traced memory: current {current} bytes, peak {peak} bytes"] + [str(stat) for stat in top]
+            if profile_path:
+                with open(profile_path, "w") as f:
+                    f.write("\n".join(report) + "\n")
+                logger.info("tracemalloc report written to %s", profile_path)
+            else:
+                logger.info("\n".join(report))
+
+        metrics_path = config.get("METRICS_PATH")
+        if metrics_path:
+            METRICS.write(metrics_path)
+            logger.info("metrics written to %s", metrics_path)
+
+
+def configure_logging(level=logging.INFO):
+    """
+    Log format for command line runs
+    """
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
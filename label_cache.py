@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Persistent cache of processed DrugLabel responses.
+
+Entries are keyed by the sha256 of the SPL document and the extractor version
+that produced them, and also record its setId and versionNumber, so a batch run
+can skip any label whose content was processed before by the same extractor.
+Entries of other extractor versions are never served; invalidate() drops them.
+The cache is bounded in bytes and evicts least recently used entries.
+"""
+import time
+import json
+import zlib
+import sqlite3
+import hashlib
+
+from drug_label import EXTRACTOR_VERSION
+
+CACHE_PATH = "data/label_cache.db"
+## default size bound of the stored responses
+MAX_BYTES = 2 * 1024 ** 3
+
+CACHE_DDL = [
+    """CREATE TABLE IF NOT EXISTS label_cache (
+        content_hash TEXT,
+        extractor_version INTEGER,
+        set_id TEXT,
+        version TEXT,
+        response BLOB,
+        size INTEGER,
+        last_access REAL,
+        PRIMARY KEY (content_hash, extractor_version))""",
+    "CREATE INDEX IF NOT EXISTS ix_label_cache_set_id ON label_cache (set_id, version, extractor_version)",
+    "CREATE INDEX IF NOT EXISTS ix_label_cache_last_access ON label_cache (last_access)",
+]
+
+## entries removed per eviction statement
+EVICT_BATCH = 256
+
+
+def content_hash(data):
+    """
+    sha256 hex digest of the raw document bytes
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_source(source):
+    """
+    Raw bytes of a label given as a path or as bytes
+    """
+    if isinstance(source, bytes):
+        return source
+    with open(source, "rb") as f:
+        return f.read()
+
+
+class LabelCache(object):
+    """
+    Size bounded LRU cache of processed label responses in a SQLite file,
+    reading and writing the entries of one extractor version.
+
+    Usage:
+        with LabelCache() as cache:
+            response = cache.get(content_hash(data))
+            if response is None:
+                response = DrugLabel(data).process()
+                cache.put(content_hash(data), response)
+    """
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES, extractor_version=EXTRACTOR_VERSION):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.extractor_version = extractor_version
+        self.conn = sqlite3.connect(path, timeout=30)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            ## a cache written before entries carried their extractor version is dropped
+            columns = [info[1] for info in self.conn.execute("PRAGMA table_info(label_cache)")]
+            if columns and "extractor_version" not in columns:
+                self.conn.execute("DROP TABLE label_cache")
+            for ddl in CACHE_DDL:
+                self.conn.execute(ddl)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM label_cache").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def get(self, key, touch=True):
+        """
+        Cached response for a content hash, None on a miss
+
+        Args:
+            key (str): content_hash of the document
+            touch (bool, optional): mark the entry as recently used. Defaults to True.
+        """
+        row = self.conn.execute("SELECT response FROM label_cache WHERE content_hash = ? AND extractor_version = ?",
+                                (key, self.extractor_version)).fetchone()
+        if row is None:
+            return None
+        if touch:
+            self.touch(key)
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def get_version(self, set_id, version):
+        """
+        Cached response for a label version, None on a miss
+        """
+        row = self.conn.execute("SELECT content_hash FROM label_cache "
+                                "WHERE set_id = ? AND version = ? AND extractor_version = ?",
+                                (set_id, str(version), self.extractor_version)).fetchone()
+        return self.get(row[0]) if row else None
+
+    def touch(self, key):
+        with self.conn:
+            self.conn.execute("UPDATE label_cache SET last_access = ? WHERE content_hash = ? AND extractor_version = ?",
+                              (time.time(), key, self.extractor_version))
+
+    def put(self, key, response):
+        """
+        Store a processed response under its content hash, evicting least
+        recently used entries beyond max_bytes
+        """
+        body = zlib.compress(json.dumps(response, separators=(",", ":")).encode("utf-8"))
+        with self.conn:
+            previous = self.conn.execute("SELECT size FROM label_cache WHERE content_hash = ? AND extractor_version = ?",
+                                         (key, self.extractor_version)).fetchone()
+            self.conn.execute("INSERT or REPLACE INTO label_cache VALUES (?,?,?,?,?,?,?)",
+                              (key, self.extractor_version, response.get("setId"), response.get("versionNumber"),
+                               body, len(body), time.time()))
+        self.total_bytes += len(body) - (previous[0] if previous else 0)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def invalidate(self, everything=False):
+        """
+        Drop the entries of other extractor versions, or every entry
+
+        Args:
+            everything (bool, optional): also drop the current version's entries. Defaults to False.
+
+        Returns:
+            int: entries dropped
+        """
+        with self.conn:
+            if everything:
+                dropped = self.conn.execute("DELETE FROM label_cache").rowcount
+            else:
+                dropped = self.conn.execute("DELETE FROM label_cache WHERE extractor_version != ?",
+                                            (self.extractor_version,)).rowcount
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM label_cache").fetchone()[0]
+        return dropped
+
+    def evict(self):
+        """
+        Drop least recently used entries until the cache fits in max_bytes
+        """
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute("SELECT content_hash, extractor_version, size FROM label_cache "
+                                     "ORDER BY last_access LIMIT ?", (EVICT_BATCH,)).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+
+            victims = []
+            freed = 0
+            for key, extractor_version, size in rows:
+                victims.append((key, extractor_version))
+                freed += size
+                if self.total_bytes - freed <= self.max_bytes:
+                    break
+            with self.conn:
+                self.conn.executemany("DELETE FROM label_cache WHERE content_hash = ? AND extractor_version = ?",
+                                      victims)
+            self.total_bytes -= freed
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM label_cache").fetchone()[0]
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""
+Full-text search over processed label sections.
+
+Responses of DrugLabel.process are indexed into a SQLite FTS5 table with one
+column per common section (the key DrugLabel gives it, e.g.
+adverseReactionsSection) and an "other" column for the rest. Labels are keyed
+by setId and the newest version replaces older ones, so re-indexing a batch
+output only touches labels that changed. Queries are ranked with bm25.
+"""
+import os
+import sys
+import json
+import zlib
+import sqlite3
+
+import utils
+import instrumentation
+from instrumentation import stage
+
+SEARCH_PATH = "data/label_search.db"
+
+## section key from DrugLabel.process -> FTS column
+SECTION_COLUMNS = {
+    "boxedWarningSection": "boxed_warning",
+    "indicationsUsageSection": "indications_usage",
+    "dosageAdministrationSection": "dosage_administration",
+    "dosageFormsStrengthsSection": "dosage_forms_strengths",
+    "contraindicationsSection": "contraindications",
+    "warningsAndPrecautionsSection": "warnings_precautions",
+    "warningsSection": "warnings",
+    "precautionsSection": "precautions",
+    "adverseReactionsSection": "adverse_reactions",
+    "drugInteractionsSection": "drug_interactions",
+    "useInSpecificPopulationsSection": "specific_populations",
+    "overdosageSection": "overdosage",
+    "descriptionSection": "description",
+    "clinicalPharmacologySection": "clinical_pharmacology",
+    "howSuppliedSection": "how_supplied",
+}
+## every other section
+OTHER_COLUMN = "other"
+COLUMNS = ["title"] + list(SECTION_COLUMNS.values()) + [OTHER_COLUMN]
+
+## bm25 weight per column, in COLUMNS order; matches in the title count most
+WEIGHTS = [5.0] + [1.0] * len(SECTION_COLUMNS) + [0.5]
+
+## documents per transaction when indexing
+WRITE_BATCH_SIZE = 500
+## words around a match in a snippet
+SNIPPET_TOKENS = 16
+
+SEARCH_DDL = [
+    """CREATE TABLE IF NOT EXISTS label_docs (
+        id INTEGER PRIMARY KEY,
+        set_id TEXT UNIQUE,
+        version INTEGER,
+        document_id TEXT,
+        title TEXT,
+        effective_time TEXT)""",
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS label_fts USING fts5(
+        {", ".join(COLUMNS)}, tokenize = 'porter unicode61')""",
+]
+
+SEARCH_SQL = f"""
+    SELECT d.set_id, d.version, d.title, bm25(label_fts, {", ".join(map(str, WEIGHTS))}) AS score,
+           snippet(label_fts, -1, '[', ']', '...', {SNIPPET_TOKENS})
+    FROM label_fts JOIN label_docs d ON d.id = label_fts.rowid
+    WHERE label_fts MATCH ?
+    ORDER BY score
+    LIMIT ?"""
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def section_columns(response):
+    """
+    FTS column values of a DrugLabel.process response, in COLUMNS order
+    """
+    values = dict.fromkeys(COLUMNS, "")
+    values["title"] = response.get("title", "")
+    other = []
+    for key, text in (response.get("sections") or {}).items():
+        column = SECTION_COLUMNS.get(key)
+        if column is None:
+            other.append(text)
+        else:
+            values[column] = text
+    values[OTHER_COLUMN] = "\n".join(other)
+    return [values[column] for column in COLUMNS]
+
+
+def iter_responses(path):
+    """
+    Processed responses from a batch_labels output, .jsonl or .db
+    """
+    if path.endswith((".db", ".sqlite")):
+        conn = sqlite3.connect(path)
+        try:
+            for (body,) in conn.execute("SELECT response FROM processed_labels"):
+                yield json.loads(zlib.decompress(body).decode("utf-8"))
+        finally:
+            conn.close()
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                result = json.loads(line)
+                if "response" in result:
+                    yield result["response"]
+
+
+class LabelSearch(object):
+    """
+    FTS5 index of label sections.
+
+    Usage:
+        with LabelSearch() as index:
+            index.add_many(iter_responses("labels.jsonl"))
+            for hit in index.search("hepatotoxicity", column="adverse_reactions"):
+                print(hit)
+    """
+    def __init__(self, path=SEARCH_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        for ddl in SEARCH_DDL:
+            self.conn.execute(ddl)
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def add(self, response, force=False):
+        """
+        Index one response unless the same or a newer version of its set_id is
+        already indexed. Commits are left to the caller.
+
+        Returns:
+            bool: whether the label was (re)indexed
+        """
+        set_id = response.get("setId")
+        if not set_id:
+            return False
+        version = to_int(response.get("versionNumber"))
+
+        row = self.conn.execute("SELECT id, version FROM label_docs WHERE set_id = ?", (set_id,)).fetchone()
+        if row is not None:
+            if row[1] >= version and not force:
+                return False
+            self.conn.execute("DELETE FROM label_fts WHERE rowid = ?", (row[0],))
+            self.conn.execute("DELETE FROM label_docs WHERE id = ?", (row[0],))
+
+        cur = self.conn.execute("INSERT INTO label_docs (set_id, version, document_id, title, effective_time) "
+                                "VALUES (?,?,?,?,?)",
+                                (set_id, version, response.get("documentId"), response.get("title"),
+                                 response.get("effectiveTime")))
+        self.conn.execute(f"INSERT INTO label_fts (rowid, {', '.join(COLUMNS)}) "
+                          f"VALUES (?, {', '.join('?' * len(COLUMNS))})",
+                          [cur.lastrowid] + section_columns(response))
+        return True
+
+    def add_many(self, responses, force=False):
+        """
+        Index responses, committing every WRITE_BATCH_SIZE labels
+
+        Returns:
+            dict: counts of indexed and skipped (already current) labels
+        """
+        summary = {"indexed": 0, "skipped": 0}
+        pending = 0
+        for response in responses:
+            with stage("search_index") as timer:
+                if self.add(response, force):
+                    summary["indexed"] += 1
+                    timer.add(labels=1)
+                else:
+                    summary["skipped"] += 1
+            pending += 1
+            if pending >= WRITE_BATCH_SIZE:
+                self.conn.commit()
+                pending = 0
+        self.conn.commit()
+        return summary
+
+    def remove(self, set_id):
+        with self.conn:
+            row = self.conn.execute("SELECT id FROM label_docs WHERE set_id = ?", (set_id,)).fetchone()
+            if row is not None:
+                self.conn.execute("DELETE FROM label_fts WHERE rowid = ?", (row[0],))
+                self.conn.execute("DELETE FROM label_docs WHERE id = ?", (row[0],))
+
+    def optimize(self):
+        """
+        Merge the FTS b-trees after a large load
+        """
+        with self.conn:
+            self.conn.execute("INSERT INTO label_fts (label_fts) VALUES ('optimize')")
+
+    def search(self, query, column=None, limit=20):
+        """
+        Labels matching an FTS5 query, best bm25 score first.
+
+        Args:
+            query (str): FTS5 query, e.g. 'hepatotoxicity', '"serotonin syndrome"',
+                'rash NOT pediatric'
+            column (str, optional): restrict the query to one column of COLUMNS
+            limit (int, optional): maximum hits. Defaults to 20.
+
+        Returns:
+            list: dicts with setId, version, title, score and a snippet
+        """
+        if column is not None:
+            if column not in COLUMNS:
+                raise ValueError(f"unknown column {column}, expected one of {COLUMNS}")
+            query = f"{column} : ({query})"
+        with stage("search_query") as timer:
+            hits = [{"setId": set_id, "version": version, "title": title, "score": score, "snippet": snippet}
+                    for set_id, version, title, score, snippet in self.conn.execute(SEARCH_SQL, (query, limit))]
+            timer.add(hits=len(hits))
+        return hits
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM label_docs").fetchone()[0]
+
+
+if __name__ == "__main__":
+    ## label_search.py index <batch output .jsonl | .db>
+    ## label_search.py search <query> [column]
+    instrumentation.configure_logging()
+    config = utils.read_configuration() if os.path.exists("config.yaml") else {}
+    with instrumentation.session(config), LabelSearch() as index:
+        if sys.argv[1] == "index":
+            print(index.add_many(iter_responses(sys.argv[2])))
+        else:
+            column = sys.argv[3] if len(sys.argv) > 3 else None
+            for hit in index.search(sys.argv[2], column):
+                print(json.dumps(hit))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Packed store for openFDA drug label records.
+
+Labels are appended as zlib-compressed compact JSON blobs in a single SQLite file
+instead of one pretty-printed file per label. The primary key on id and the index
+on set_id are the offset index: a label is one B-tree lookup away, and iterating
+in rowid order reads the blobs sequentially in the order they were appended.
+"""
+import json
+import zlib
+import sqlite3
+import threading
+
+STORE_PATH = "data/labels.db"
+
+## records per transaction when appending
+WRITE_BATCH_SIZE = 1000
+
+STORE_DDL = [
+    """CREATE TABLE IF NOT EXISTS labels (
+        id TEXT PRIMARY KEY,
+        set_id TEXT,
+        version TEXT,
+        effective_time TEXT,
+        body BLOB)""",
+    "CREATE INDEX IF NOT EXISTS ix_labels_set_id ON labels (set_id, version)",
+    ## sync bookkeeping, e.g. the meta.last_updated of the last successful download
+    """CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT)""",
+]
+
+
+def pack(record):
+    return zlib.compress(json.dumps(record, separators=(",", ":")).encode("utf-8"))
+
+
+def unpack(body):
+    return json.loads(zlib.decompress(body).decode("utf-8"))
+
+
+class LabelStore(object):
+    """
+    Append-only label store keyed by id and set_id.
+
+    Usage:
+        with LabelStore() as store:
+            store.put_many(records)
+            store.latest(set_id)
+    """
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        ## shared by download threads, writes are serialised by the lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            for ddl in STORE_DDL:
+                self.conn.execute(ddl)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def put_many(self, records):
+        """
+        Append records, replacing any stored record with the same id.
+
+        Args:
+            records (iterable): openFDA label dicts, consumed lazily
+
+        Returns:
+            int: number of records written
+        """
+        count = 0
+        batch = []
+        for record in records:
+            batch.append((record.get("id"), record.get("set_id"), record.get("version"),
+                          record.get("effective_time"), pack(record)))
+            if len(batch) >= WRITE_BATCH_SIZE:
+                count += self.__write(batch)
+                batch = []
+        if batch:
+            count += self.__write(batch)
+        return count
+
+    def put(self, record):
+        return self.put_many([record])
+
+    def get(self, label_id):
+        """
+        Label by openFDA id, None if not stored
+        """
+        row = self.conn.execute("SELECT body FROM labels WHERE id = ?", (label_id,)).fetchone()
+        return unpack(row[0]) if row else None
+
+    def get_by_set_id(self, set_id):
+        """
+        Every stored version of a label, newest version first
+        """
+        rows = self.conn.execute(
+            "SELECT body FROM labels WHERE set_id = ? ORDER BY CAST(version AS INTEGER) DESC", (set_id,))
+        return [unpack(body) for (body,) in rows]
+
+    def latest(self, set_id):
+        versions = self.get_by_set_id(set_id)
+        return versions[0] if versions else None
+
+    def get_state(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT or REPLACE INTO sync_state VALUES (?,?)", (key, value))
+
+    def advance_state(self, key, value):
+        """
+        Set a state value only if it sorts after the stored one. The compare and
+        the write happen in one statement under the write lock, so concurrent
+        callers keep the greatest value.
+
+        Returns:
+            bool: True if the value was stored
+        """
+        with self.lock, self.conn:
+            cur = self.conn.execute("""INSERT INTO sync_state VALUES (?,?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+                WHERE sync_state.value IS NULL OR excluded.value > sync_state.value""", (key, value))
+            return cur.rowcount > 0
+
+    def index(self):
+        """
+        Iterate (id, set_id, version, effective_time) without decompressing bodies
+        """
+        return self.conn.execute("SELECT id, set_id, version, effective_time FROM labels ORDER BY rowid")
+
+    def __iter__(self):
+        cur = self.conn.execute("SELECT body FROM labels ORDER BY rowid")
+        for (body,) in cur:
+            yield unpack(body)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def __write(self, batch):
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT or REPLACE INTO labels VALUES (?,?,?,?,?)", batch)
+        return len(batch)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Parallel Drugs@FDA load.
+
+Files are read and converted in a process pool. Converted batches travel over one
+bounded queue per dependency level to a single writer thread, which owns the
+database connection and drains the levels in order, so lookup tables are written
+before the fact tables that reference them.
+"""
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from main import FDADatabase, DATA_DIR, DB_PATH, BATCH_SIZE
+from schema import TABLES, load_levels
+import utils
+import instrumentation
+from instrumentation import METRICS, stage, timed
+from quarantine import insert_batch, quarantine, CONVERT, INSERT
+from columnar import row_batches
+
+logger = logging.getLogger(__name__)
+
+## batches buffered per level before parser processes block
+QUEUE_SIZE = 16
+
+## queue message kinds
+ROWS = "rows"
+DONE = "done"
+ERROR = "error"
+
+
+def parse_file(source, data_dir, queue, batch_size=BATCH_SIZE):
+    """
+    Worker: parse one Drugs@FDA file into columns, putting converted batches on
+    queue, each with the rows that failed to convert, and finishing with a DONE
+    (or ERROR) message. DONE carries the worker's stage metrics for this file.
+    """
+    spec = TABLES[source]
+    ## worker processes are reused across files - report this file only
+    METRICS.reset()
+    try:
+        batches = row_batches(spec, os.path.join(data_dir, spec.filename), batch_size)
+        for (rows, rejects) in timed(batches, "convert", count=lambda batch: {"rows": len(batch[0])},
+                                     table=spec.table):
+            queue.put((ROWS, source, (rows, rejects)))
+        queue.put((DONE, source, METRICS.snapshot()))
+    except Exception as ex:
+        queue.put((ERROR, source, repr(ex)))
+
+
+def drain(levels, queues, finished):
+    """
+    Read and drop the remaining messages of every file not in finished, so
+    parser processes never block on a full queue
+    """
+    for level, queue in zip(levels, queues):
+        pending = set(level) - finished
+        while pending:
+            kind, source, payload = queue.get()
+            if kind != ROWS:
+                pending.discard(source)
+
+
+def write_levels(fdaDB, levels, queues, summary, failures):
+    """
+    Writer: drain the level queues in order, one transaction per level.
+    Row counts per table are recorded in summary, rejected rows under
+    "rejected" and failures under "errors". An error outside a single batch -
+    a failed session, BEGIN or COMMIT - stops the writes and is appended to
+    failures; the queues are still drained to the end.
+    """
+    finished = set()
+    try:
+        write_queues(fdaDB, levels, queues, summary, finished)
+    except Exception as ex:
+        logger.error("writer failed, discarding the remaining batches: %s", ex)
+        failures.append(ex)
+        drain(levels, queues, finished)
+
+
+def write_queues(fdaDB, levels, queues, summary, finished):
+    """
+    write_levels' writes; files whose last message was read are added to finished
+    """
+    with fdaDB.load_session():
+        for level, queue in zip(levels, queues):
+            pending = set(level)
+            with fdaDB.transaction() as cur:
+                while pending:
+                    kind, source, payload = queue.get()
+                    if kind == ROWS:
+                        spec = TABLES[source]
+                        rows, rejects = payload
+                        try:
+                            rejected = quarantine(cur, spec, rejects, CONVERT)
+                            with stage("insert", table=spec.table) as timer:
+                                inserted, rejects = insert_batch(cur, spec, rows)
+                                timer.add(rows=inserted)
+                            rejected += quarantine(cur, spec, rejects, INSERT)
+                            summary[source] = summary.get(source, 0) + inserted
+                            if rejected:
+                                counts = summary.setdefault("rejected", {})
+                                counts[source] = counts.get(source, 0) + rejected
+                        except Exception as ex:
+                            ## keep draining so parser processes never block on a full queue
+                            logger.error("failed to insert into %s: %s", TABLES[source].table, ex)
+                            summary.setdefault("errors", {})[source] = repr(ex)
+                        continue
+
+                    pending.discard(source)
+                    finished.add(source)
+                    if kind == DONE:
+                        METRICS.merge(payload)
+                    elif kind == ERROR:
+                        logger.error("failed to load %s: %s", source, payload)
+                        summary.setdefault("errors", {})[source] = payload
+
+
+def load_all(fdaDB, data_dir=DATA_DIR, sources=None, workers=None, batch_size=BATCH_SIZE,
+             queue_size=QUEUE_SIZE):
+    """
+    Load Drugs@FDA files into fdaDB, parsing in parallel.
+
+    Args:
+        fdaDB (FDADatabase): target database, tables must exist
+        data_dir (str, optional): directory with the text files. Defaults to DATA_DIR.
+        sources (list, optional): FDA_Files keys to load. Defaults to every table.
+        workers (int, optional): parser processes. Defaults to the cpu count.
+        batch_size (int, optional): rows per batch. Defaults to BATCH_SIZE.
+        queue_size (int, optional): batches buffered per level. Defaults to QUEUE_SIZE.
+
+    Returns:
+        dict: rows written per FDA_Files key, plus "rejected" row counts and
+        "errors" if a file failed
+
+    Raises:
+        Exception: the writer's error when it could not write a level
+    """
+    levels = load_levels(sources)
+    workers = workers or os.cpu_count() or 1
+    summary = {}
+    failures = []
+
+    with multiprocessing.Manager() as manager:
+        queues = [manager.Queue(queue_size) for _ in levels]
+        writer = threading.Thread(target=write_levels, args=(fdaDB, levels, queues, summary, failures))
+        writer.start()
+
+        ## submitted in level order: the pool picks tasks FIFO, so a level is always
+        ## fully dispatched before any task that waits on it
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(parse_file, source, data_dir, queue, batch_size)
+                       for level, queue in zip(levels, queues) for source in level]
+            for future in futures:
+                future.result()
+
+        writer.join()
+
+    if failures:
+        raise failures[0]
+    fdaDB.create_indexes()
+    return summary
+
+
+if __name__ == "__main__":
+    instrumentation.configure_logging()
+    config = utils.read_configuration() if os.path.exists("config.yaml") else {}
+    with instrumentation.session(config):
+        fdaDB = FDADatabase(dbtype='sqlite', dbname=DB_PATH)
+        fdaDB.create_db_table()
+        print(load_all(fdaDB))
@@ -1,44 +1,33 @@
 #!/usr/bin/env python
 import os
+import sys
 import pandas as pd
 import csv
 import pdb
 import numpy as np
-import sqlite3
+import logging
+from contextlib import contextmanager
 
 from sqlalchemy import create_engine
-from sqlalchemy import Table, Column, Integer, String, MetaData, ForeignKey
+from sqlalchemy import MetaData
+
+from schema import TABLES, LOAD_STATE, ROW_FINGERPRINTS
+from instrumentation import stage, timed
+from quarantine import convert_batch, insert_batch, quarantine, CONVERT, INSERT
+import instrumentation
+import utils
+
+logger = logging.getLogger(__name__)
 
 ## global variables
 SQLITE = 'sqlite'
 DATA_DIR = "data/drugs@fda_txtfiles/"
+DB_PATH = "data/database/fda.db"
+
+## rows per batch handed to executemany
+BATCH_SIZE = 5000
+FILE_ENCODINGS = ("utf-8", "cp1252")
 
-FDA_Files = {
-    "ActionTypes_Lookup": "ActionTypes_Lookup.txt",
-    "ApplicationDocs": "ApplicationDocs.txt",
-    "Applications": "Applications.txt",
-    "ApplicationsDocsType_Lookup": "ApplicationsDocsType_Lookup.txt",
-    "MarketingStatus": "MarketingStatus.txt",
-    "MarketingStatus_Lookup": "MarketingStatus_Lookup.txt",
-    "Products": "Products.txt",
-    "SubmissionClass_Lookup": "SubmissionClass_Lookup.txt",
-    "SubmissionPropertyType": "SubmissionPropertyType.txt",
-    "Submissions": "Submissions.txt",
-    "TE": "TE.txt"
-}
-
-# Table Names
-ACTIONTYPES_LOOKUP = 'action_types_lookup'
-APPLICATION_DOCS = 'application_docs'
-APPLICATIONS = 'applications'
-APPLICATION_DOCSTYPE_LOOKUP = "application_docs_type_lookup"
-MARKETINGSTATUS = "marketing_status"
-MARKETINGSTATUS_LOOKUP = "marketing_status_lookup"
-PRODUCTS = "products"
-SUBMISSION_CLASS_LOOKUP = "submission_class_lookup"
-SUBMISSION_PROPERTY_TYPE = "submission_property_type"
-SUBMISSIONS = "submissions"
-TE = "te"
 
 class FDADatabase:
     # sqlalchemy
@@ -46,459 +35,314 @@ class FDADatabase:
         SQLITE: 'sqlite:///{DB}'
     }
 
+    ## pragmas applied while a bulk load session is open
+    BULK_LOAD_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -200000,
+    }
+
     ## db connection - ref obj
     db_engine = None
+    ## pooled DBAPI connection held by the active load session
+    connection = None
     def __init__(self, dbtype, username='', password='', dbname=''):
         dbtype = dbtype.lower()
         if dbtype in self.DB_ENGINE.keys():
             engine_url = self.DB_ENGINE[dbtype].format(DB=dbname)
             self.db_engine = create_engine(engine_url)
-            print(self.db_engine)
+            logger.info("database engine %s", self.db_engine)
         else:
-            print("DBType is not found in DB_ENGINE")
+            logger.error("DBType %s is not found in DB_ENGINE", dbtype)
 
     def create_db_table(self):
         metadata = MetaData()
 
-        #ActionTypes_LookupID	ActionTypes_LookupDescription	SupplCategoryLevel1Code	#SupplCategoryLevel2Code
-        action_type_lookup_tb = Table(ACTIONTYPES_LOOKUP, metadata,
-        Column('id', Integer, primary_key=True),
-        Column('description', String),
-        Column('supplCategoryLevel1Code', String),
-        Column('supplCategoryLevel2Code', String))
-        """
-        ## ApplicationDocsID	ApplicationDocsTypeID	ApplNo	SubmissionType	SubmissionNo	ApplicationDocsTitle	ApplicationDocsURL	ApplicationDocsDate
-        application_docs_tb = Table(APPLICATION_DOCS, metadata, Column('id', Integer, primary_key=True),
-                                    Column('docsTypeId', Integer),
-                                    Column('applNo', Integer),
-                                    Column('submissionType', String), Column('submissionNo', Integer),
-                                    Column("applicationDocsTitle", String),
-                                    Column("applicationDocsURL", String),
-                                    Column("applicationDocsDate", String)
-                                    )
-
-        #ApplNo	ApplType	ApplPublicNotes	SponsorName
-        # 000004	NDA		PHARMICS
-        application_tb = Table(APPLICATIONS, metadata, Column('applNo', Integer, primary_key=True),
-        Column('applType', String), Column("applPublicNotes", String), Column("SponsorName", String))
-        
-        ## ApplicationDocsType
-        # ApplicationDocsType_Lookup_ID	ApplicationDocsType_Lookup_Description
-        application_doc_type_tb = Table(APPLICATION_DOCSTYPE_LOOKUP, metadata, Column('id', Integer, primary_key=True), Column('description', String))
-        
-        # MarketingStatus
-        # MarketingStatusID	ApplNo	ProductNo
-        #3	000004	004
-        marketing_status_tb = Table(MARKETINGSTATUS, metadata, Column('id', Integer, primary_key=True), Column('applNo', Integer), Column('productNo', Integer))
-        
-        # MarketingStatus lookup
-        #MarketingStatusID	MarketingStatusDescription
-        marketing_status_type_tb = Table(MARKETINGSTATUS_LOOKUP, metadata, Column('id', Integer, primary_key=True), Column('description', String))
-        
-        # ApplNo	ProductNo	Form	Strength	ReferenceDrug	DrugName	ActiveIngredient	ReferenceStandard
-        # 000004	004	SOLUTION/DROPS;OPHTHALMIC	1%	0	PAREDRINE	HYDROXYAMPHETAMINE HYDROBROMIDE	0
-        products_tb = Table(PRODUCTS, metadata, Column('applNo', Integer), Column('productNo', Integer), Column('form', String), Column('strength', String), Column('referenceDrug', String), Column('drugName', String),
-        Column('activeIngredient', String))
-        
-        ##
-        # SubmissionClassCodeID	SubmissionClassCode	SubmissionClassCodeDescription
-        # 1	BIOEQUIV	Bioequivalence
-        ##
-        submission_class_lookup_tb = Table(SUBMISSION_CLASS_LOOKUP, metadata, Column('id',Integer,primary_key=True),Column('submissionClassCode',String),Column('submissionClassDescription',String))
-        
-        ## Submission PropertyType
-        #ApplNo SubmissionType SubmissionNo SubmissionPropertyTypeCode SubmissionPropertyTypeID
-        #000159	ORIG      	1	Null	0
-        submission_prop_type_code_tb = Table(SUBMISSION_PROPERTY_TYPE, metadata, Column('applNo', Integer),
-        Column('submissionType', String), Column("submissionNo", Integer), Column("submissionPropertyTypeCode", String),
-        Column("submissionPropertyTypeId", Integer))
-        
-        ## ApplNo	ProductNo	MarketingStatusID	TECode
-        # 003444	001	1	AA
-        te_tb = Table(TE, metadata, Column('applNo',Integer),Column('productNo',Integer),Column('marketingStatusId',Integer),Column('teCode',String))
-        """
+        ## one Table per Drugs@FDA file, built from the schema registry
+        for spec in TABLES.values():
+            spec.sqlalchemy_table(metadata)
+
         try:
+            self.drop_outdated_tables()
             metadata.create_all(self.db_engine)
-            print("Tables created")
+            logger.info("Tables created")
 
         except Exception as e:
-            print("Error occurred during Table creation!")
-            print(e)
+            logger.error("Error occurred during Table creation: %s", e)
+
+    def drop_outdated_tables(self):
+        """
+        Drop tables whose columns or primary key differ from the schema
+        registry - create_all never alters an existing table - and forget their
+        refresh state, so they are created anew and the next load or refresh
+        fills them from the source files.
+
+        Returns:
+            list: FDA_Files keys of the dropped tables
+        """
+        dropped = []
+        with self.transaction() as cur:
+            tables = {name for (name,) in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for spec in TABLES.values():
+                if spec.table not in tables or spec.matches(cur.execute(f"PRAGMA table_info({spec.table})").fetchall()):
+                    continue
+                logger.warning("table %s does not match the schema, recreating it empty - reload %s",
+                               spec.table, spec.filename)
+                cur.execute(f"DROP TABLE {spec.table}")
+                for state in (LOAD_STATE, ROW_FINGERPRINTS):
+                    if state in tables:
+                        cur.execute(f"DELETE FROM {state} WHERE source = ?", (spec.source,))
+                dropped.append(spec.source)
+        return dropped
+
+    def create_indexes(self):
+        """
+        Build the secondary indexes declared in the schema registry and refresh
+        planner statistics. Run after a bulk load - maintaining the indexes row
+        by row during the load is slower than building them once.
+        """
+        with stage("index"), self.transaction() as cur:
+            try:
+                for spec in TABLES.values():
+                    for statement in spec.index_ddl():
+                        cur.execute(statement)
+                cur.execute("ANALYZE")
+
+            except Exception as ex:
+                logger.error("Error occurred during index creation: %s", ex)
+
+    @contextmanager
+    def load_session(self):
+        """
+        Check out one connection from the engine pool and reuse it for every
+        insert until the session closes. Bulk load pragmas are applied for the
+        duration of the session and the previous values restored afterwards.
+
+        Usage:
+            with fdaDB.load_session():
+                fdaDB.insert_into_products(batches)
+                ...
+        """
+        if self.connection is not None:
+            ## already inside a session - share it
+            yield self.connection
+            return
+
+        conn = self.db_engine.raw_connection()
+        previous = self.__set_pragmas(conn, self.BULK_LOAD_PRAGMAS)
+        self.connection = conn
+        try:
+            yield conn
+        finally:
+            self.connection = None
+            try:
+                conn.rollback()
+                self.__set_pragmas(conn, previous)
+            finally:
+                ## return connection to the pool
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the enclosed statements in one explicit transaction on the session
+        connection, opening a short-lived session when none is active.
+        Commits on success, rolls back on error.
+        """
+        with self.load_session() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("BEGIN")
+                yield cur
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def __set_pragmas(self, conn, pragmas):
+        """
+        Apply pragmas on a connection, return the values they replaced
+        """
+        previous = {}
+        cur = conn.cursor()
+        try:
+            for name, value in pragmas.items():
+                previous[name] = cur.execute(f"PRAGMA {name}").fetchone()[0]
+                cur.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cur.close()
+        return previous
 
     def execute_query(self, query=''):
         if query == '':
             return
-        print(query)
+        logger.debug(query)
         with self.db_engine.connect() as connection:
             try:
                 connection.execute(query)
             except Exception as e:
-                print(e)
+                logger.error("query failed: %s", e)
 
-    def insert_action_type_lookup(self, data):
-        conn = sqlite3.connect("data/database/fda.db")
-        cur = conn.cursor()
-        try:
-            types = []
-            ids = []
-            for row in data:
-                #ActionTypes_LookupID	ActionTypes_LookupDescription	
-                # SupplCategoryLevel1Code	SupplCategoryLevel2Code
-                id = int(row[0])
-                desc = row[1] if row[1] else ""
-                code1 = row[2] if row[2] else  ""
-                code2 = row[3] if row[3] else ""
-                if id not in ids:
-                    ids.append(id)
-                else:
-                    print("id exists", id)
-                types.append((id,desc,code1,code2))
-
-            
-            cur.executemany(
-                'INSERT or IGNORE INTO action_types_lookup VALUES (?,?,?,?)', types)
-
-        except Exception as ex:
-            print(ex)
-                
-        conn.commit()
-        cur.close()
-
-    def insert_into_application_docs(self, data):
-        conn = sqlite3.connect("data/database/fda.db")
-        cur = conn.cursor()
-        try:
-            types = []
-            ids = []
-            for row in data:
-                ## ApplicationDocsID	ApplicationDocsTypeID	ApplNo	SubmissionType	SubmissionNo	ApplicationDocsTitle	ApplicationDocsURL	ApplicationDocsDate
-
-                id = int(row[0])
-                docTypeId = int(row[1]) if row[1] else None
-                applNo = int(row[2]) if row[2] else None
-                subtype = row[3] if row[3] else ""
-                subno = int(row[4]) if row[4] else ""
-                appDocTitle = row[5] if row[5] else ""
-                applDocUrl = row[6] if row[6] else ""
-                applDate = row[7] if row[7] else ""
-                
-                types.append((id, docTypeId, applNo, subtype,subno,
-                              appDocTitle, applDocUrl, applDate))
-
-            cur.executemany(
-                'INSERT or IGNORE INTO application_docs VALUES (?,?,?,?,?,?,?,?)', types)
-
-        except Exception as ex:
-            print(ex)
-
-        conn.commit()
-        cur.close()
-        
-    def insert_into_application(self, data):
-        conn = sqlite3.connect("data/database/fda.db")
-        cur = conn.cursor()
-        #ApplNo	ApplType	ApplPublicNotes	SponsorName
-
-        try:
-            types = []
-            ids = []
-            for row in data:
-                #ApplNo	ApplType	ApplPublicNotes	SponsorName
+    def insert_rows(self, spec, data):
+        """
+        Convert and insert batches of raw rows into the table described by spec.
+        Rows that fail to convert or insert are isolated and recorded in the
+        rejected_rows table; the rest of their batch is still loaded.
 
-                applNo = int(row[0]) if row[0] else None
-                appltype = row[1] if row[1] else ""
-                applPublicNotes = row[2] if row[2] else ""
-                sponsorName = row[3] if row[3] else ""
+        Args:
+            spec (TableSpec): entry from schema.TABLES
+            data (iterable): batches of raw string rows, as yielded by read_data
 
-                types.append((applNo, appltype, applPublicNotes,
-                              sponsorName))
+        Returns:
+            dict: rows inserted and rows rejected
+        """
+        summary = {"rows": 0, "rejected": 0}
+        with self.transaction() as cur:
+            try:
+                for batch in data:
+                    with stage("convert", table=spec.table) as timer:
+                        rows, rejects = convert_batch(spec, batch)
+                        timer.add(rows=len(rows))
+                    summary["rejected"] += quarantine(cur, spec, rejects, CONVERT)
+
+                    with stage("insert", table=spec.table) as timer:
+                        inserted, rejects = insert_batch(cur, spec, rows)
+                        timer.add(rows=inserted)
+                    summary["rows"] += inserted
+                    summary["rejected"] += quarantine(cur, spec, rejects, INSERT)
+
+            except Exception as ex:
+                logger.error("failed to insert into %s: %s", spec.table, ex)
+        return summary
 
-            cur.executemany(
-                'INSERT or IGNORE INTO applications VALUES (?,?,?,?)', types)
+    def insert_action_type_lookup(self, data):
+        self.insert_rows(TABLES["ActionTypes_Lookup"], data)
 
-        except Exception as ex:
-            print(ex)
+    def insert_into_application_docs(self, data):
+        self.insert_rows(TABLES["ApplicationDocs"], data)
 
-        conn.commit()
-        cur.close()
+    def insert_into_application(self, data):
+        self.insert_rows(TABLES["Applications"], data)
 
     def insert_into_application_docstype(self, data):
-        conn = sqlite3.connect("data/database/fda.db")
-        cur = conn.cursor()
-        #ApplNo	ApplType	ApplPublicNotes	SponsorName
-
-        try:
-            types = []
-            ids = []
-            for row in data:
-                #ApplicationDocsType_Lookup_ID	ApplicationDocsType_Lookup_Description
-                id = int(row[0]) if row[0] else None
-                desc = row[1] if row[1] else ""
-                
-                types.append((id,desc))
-
-            cur.executemany(
-                'INSERT or IGNORE INTO application_docs_type_lookup VALUES (?,?)', types)
-
-        except Exception as ex:
-            print(ex)
-
-        conn.commit()
-        cur.close()
+        self.insert_rows(TABLES["ApplicationsDocsType_Lookup"], data)
 
     def insert_into_marketing_status(self, data):
-        conn = sqlite3.connect("data/database/fda.db")
-        cur = conn.cursor()
-
-        #MarketingStatusID	ApplNo	ProductNo
-        try:
-            types = []
-            ids = []
-            for row in data:
-                id = int(row[0]) if row[0] else None
-                applNo = int(row[1]) if row[1] else None
-                productNo = int(row[2]) if row[2] else None
-
-                types.append((id, applNo, productNo))
-
-            cur.executemany(
-                'INSERT or IGNORE INTO marketing_status VALUES (?,?,?)', types)
-
-        except Exception as ex:
-            print(ex)
-
-        conn.commit()
-        cur.close()
+        self.insert_rows(TABLES["MarketingStatus"], data)
 
     def insert_into_marketingstatus_lookup(self, data):
-        conn = sqlite3.connect("data/database/fda.db")
-        cur = conn.cursor()
+        self.insert_rows(TABLES["MarketingStatus_Lookup"], data)
 
-        #MarketingStatusID	ApplNo	ProductNo
-        try:
-            types = []
-            ids = []
-            for row in data:
-                id = int(row[0]) if row[0] else None
-                desc = row[1] if row[1] else None
- 
-                types.append((id, desc))
-
-            cur.executemany(
-                'INSERT or IGNORE INTO marketing_status_lookup VALUES (?,?)', types)
-
-        except Exception as ex:
-            print(ex)
-
-        conn.commit()
-        cur.close()
-        
     def insert_into_products(self, data):
-        conn = sqlite3.connect("data/database/fda.db")
-        cur = conn.cursor()
-        # ApplNo	ProductNo	Form	Strength	ReferenceDrug	DrugName	ActiveIngredient	ReferenceStandard
-
-        try:
-            types = []
-            ids = []
-            for row in data:
-                applNo = int(row[0]) if row[0] else None
-                productNo = int(row[1]) if row[1] else None
-                form = row[2] if row[2] else None
-                strength = row[3] if row[3] else None
-                refdrug = row[4] if row[4] else None
-                drugName = row[5] if row[5] else None
-                activeIngredient = row[6] if row[6] else None
-                refstandard = row[7] if row[7] else None
-
-                types.append((applNo, productNo, form, strength, refdrug,
-                              drugName, activeIngredient, refstandard))
-
-            cur.executemany(
-                'INSERT or IGNORE INTO products VALUES (?,?,?,?,?,?,?,?)', types)
-
-        except Exception as ex:
-            print(ex)
-
-        conn.commit()
-        cur.close()
+        self.insert_rows(TABLES["Products"], data)
 
     def insert_into_submission_class_lookup(self, data):
-        conn = sqlite3.connect("data/database/fda.db")
-        cur = conn.cursor()
-        # id, code, desc
-        try:
-            types = []
-            ids = []
-            for row in data:
-                id = int(row[0]) if row[0] else None
-                code = (row[1]) if row[1] else None
-                desc = row[2] if row[2] else None
-
-                types.append((id, code, desc))
-
-            cur.executemany(
-                'INSERT or IGNORE INTO submission_class_lookup VALUES (?,?,?)', types)
-
-        except Exception as ex:
-            print(ex)
-
-        conn.commit()
-        cur.close()
+        self.insert_rows(TABLES["SubmissionClass_Lookup"], data)
 
     def insert_into_submissions(self, data):
-        conn = sqlite3.connect("data/database/fda.db")
-        cur = conn.cursor()
-        # ApplNo	SubmissionClassCodeID	SubmissionType	SubmissionNo	SubmissionStatus	SubmissionStatusDate	SubmissionsPublicNotes	ReviewPriority
-        try:
-            types = []
-            ids = []
-            for row in data:
-                applNo = int(row[0]) if row[0] else None
-                subclasscodeId = int(row[1]) if row[1] else None
-                subType = row[2] if row[2] else None
-                subNo = int(row[3]) if row[3] else None
-                subStatus = row[4] if row[4] else None
-                subDate = row[5] if row[5] else None
-                subPublicNotes = row[6] if row[6] else None
-                reviewPriority = row[7] if row[7] else None
-
-                types.append(
-                    (applNo, subclasscodeId, subType, subNo, subStatus, subDate, subPublicNotes, reviewPriority))
-
-            cur.executemany(
-                'INSERT or IGNORE INTO submissions VALUES (?,?,?,?,?,?,?,?)', types)
-
-        except Exception as ex:
-            print(ex)
+        self.insert_rows(TABLES["Submissions"], data)
 
-        conn.commit()
-        cur.close()
+    def insert_into_submission_property_type(self, data):
+        self.insert_rows(TABLES["SubmissionPropertyType"], data)
 
+    def insert_into_te(self, data):
+        self.insert_rows(TABLES["TE"], data)
 
-    def insert_into_submission_property_type(self, data):
-        conn = sqlite3.connect("data/database/fda.db")
-        cur = conn.cursor()
-        # ApplNo	SubmissionType	SubmissionNo	SubmissionPropertyTypeCode	SubmissionPropertyTypeID
 
+def decode_line(line):
+    """
+    Decode a raw line from a Drugs@FDA file. The files are mostly UTF-8 but
+    some descriptions carry Windows-1252 characters, so fall back per line.
+    """
+    for encoding in FILE_ENCODINGS:
         try:
-            types = []
-            ids = []
-            for row in data:
-                applNo = int(row[0]) if row[0] else None
-                submissionType = (row[1]) if row[1] else None
-                submissionNo = int(row[2]) if row[2] else None
-                submissionTypeCode = row[3] if row[3] else None
-                submissionPropertyTypeID = int(row[4]) if row[4] else None
-                
-                types.append((applNo, submissionType, submissionNo, submissionTypeCode,
-                              submissionPropertyTypeID))
-
-            cur.executemany(
-                'INSERT or IGNORE INTO submission_property_type VALUES (?,?,?,?,?)', types)
-
-        except Exception as ex:
-            print(ex)
-
-        conn.commit()
-        cur.close()
-
-    
-    
-        conn = sqlite3.connect("data/database/fda.db")
-        cur = conn.cursor()
-        # ApplNo	productNo, marketingStatusId, teCode
-        try:
-            types = []
-            ids = []
-            for row in data:
-                applNo = int(row[0]) if row[0] else None
-                productNo =int(row[1]) if row[1] else None
-                marketingStatusId = int(row[2]) if row[2] else None
-                teCode = (row[3]) if row[3] else None
-
-                types.append((applNo, productNo, marketingStatusId, teCode))
-
-            cur.executemany(
-                'INSERT or IGNORE INTO te VALUES (?,?,?,?)', types)
-
-        except Exception as ex:
-            print(ex)
-
-        conn.commit()
-        cur.close()
-        
-def read_data(fname):
-    rows = []
-    header = []
-    file = open(fname, 'r')
-
-    def split_line_into_words(line): return [w for w in line.split('\t')]
-    
-    for index, line in enumerate(file.readlines()):
-        if index == 0:
-            header = split_line_into_words(line)
+            return line.decode(encoding)
+        except UnicodeDecodeError:
             continue
-        data = split_line_into_words(line)
-        rows.append(data)
-    return (header,rows)
+    return line.decode(FILE_ENCODINGS[0], errors="replace")
+
+
+def split_lines(lines, first=True):
+    """
+    Yield raw lines decoded and split into cells, without the trailing newline.
+    Blank lines are skipped.
+
+    Args:
+        lines (iterable): raw byte lines
+        first (bool, optional): lines start the file, strip a byte order mark
+            from the first one. Defaults to True.
+    """
+    for index, line in enumerate(lines):
+        line = decode_line(line).rstrip("\r\n")
+        if index == 0 and first:
+            line = line.lstrip("\ufeff")
+        if not line.strip():
+            continue
+        yield line.split('\t')
+
+
+def iter_lines(fname):
+    """
+    Yield the lines of a tab-delimited file split into cells, without the
+    trailing newline. Blank lines are skipped.
+    """
+    with open(fname, 'rb') as file:
+        yield from split_lines(file)
+
+
+def iter_batches(lines, width, batch_size=BATCH_SIZE):
+    """
+    Group rows into lists of at most batch_size rows. Short rows are padded
+    and extra cells are folded into the last column so every row has width cells.
+    """
+    batch = []
+    for row in lines:
+        if len(row) < width:
+            row.extend([""] * (width - len(row)))
+        elif len(row) > width:
+            row[width - 1:] = ["\t".join(row[width - 1:])]
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_data(fname, batch_size=BATCH_SIZE):
+    """
+    Read a Drugs@FDA text file lazily.
+
+    Args:
+        fname (str): path to the tab-delimited file
+        batch_size (int, optional): rows per batch. Defaults to BATCH_SIZE.
+
+    Returns:
+        tuple: (header, batches) - batches is a generator of row lists, so only
+        one batch is held in memory at a time
+    """
+    lines = iter_lines(fname)
+    header = next(lines, [])
+    instrumentation.count("read_bytes", os.path.getsize(fname), file=os.path.basename(fname))
+    batches = iter_batches(lines, len(header), batch_size)
+    return (header, timed(batches, "parse", count=lambda batch: {"rows": len(batch)}, file=os.path.basename(fname)))
 
 if __name__ == "__main__":
-    # read text files
-    
-    # action types
-    (action_type_colnames, action_types_data) = read_data(os.path.join(DATA_DIR, FDA_Files.get("ActionTypes_Lookup", "")))
-    
-    # application docs
-    (application_docs_colnames, application_docs_data) = read_data(
-        os.path.join(DATA_DIR, FDA_Files.get("ApplicationDocs", "")))
-    
-    # applications
-    (applications_colnames, applications_data) = read_data(
-        os.path.join(DATA_DIR, FDA_Files.get("Applications", "")))
-
-    # application doc type
-    (application_doc_type_colnames, applications_doc_type_data) = read_data(os.path.join(DATA_DIR, FDA_Files.get("ApplicationsDocsType_Lookup")))
-
-    # marketing status
-    (marketing_status_colnames, marketing_status_data) = read_data(os.path.join(DATA_DIR, FDA_Files.get("MarketingStatus", "")))
-    
-    # marketing status lookup
-    (marketing_status_lookup_colnames, marketing_status_lookup_data) = read_data(os.path.join(DATA_DIR, FDA_Files.get("MarketingStatus_Lookup", "")))
-    
-    # products
-    (products_colnames, products_data) = read_data(os.path.join(DATA_DIR, FDA_Files.get("Products", "")))
-    
-    # submission class lookup
-    (submission_class_lookup_colnames, submission_class_lookup_data) = read_data(
-        os.path.join(DATA_DIR, FDA_Files.get("SubmissionClass_Lookup", "")))
-
-    # submission property type
-    (submission_prop_type_colnames, submission_prop_type_data) = read_data(os.path.join(DATA_DIR, FDA_Files.get("SubmissionPropertyType", "")))
-    
-    # submissions
-    (submissions_colnames, submissions_data) = read_data(os.path.join(DATA_DIR, FDA_Files.get("Submissions", "")))
-    
-    # TE
-    (te_colnames, te_data) = read_data(os.path.join(DATA_DIR,FDA_Files.get("TE","")))
-
-
-    ## initiate DB class
-    fdaDB = FDADatabase(dbtype='sqlite', dbname='fda')
-    
-    #fdaDB.insert_action_type_lookup(action_types_data)
-    #fdaDB.insert_into_application_docs(application_docs_data)
-    #fdaDB.insert_into_application(applications_data)
-    #fdaDB.insert_into_application_docstype(applications_doc_type_data)
-
-    # marketing status 
-    #fdaDB.insert_into_marketing_status(marketing_status_data)
-    #fdaDB.insert_into_marketingstatus_lookup(marketing_status_lookup_data)
-    #fdaDB.insert_into_products(products_data)
-    #fdaDB.insert_into_submission_class_lookup(submission_class_lookup_data)
-    #fdaDB.insert_into_submission_property_type(submission_prop_type_data)
-    #fdaDB.insert_into_te(te_data)
-    #fdaDB.insert_into_submissions(submissions_data)
-
-
-
+    instrumentation.configure_logging()
+    config = utils.read_configuration() if os.path.exists("config.yaml") else {}
+
+    with instrumentation.session(config):
+        ## initiate DB class
+        fdaDB = FDADatabase(dbtype='sqlite', dbname=DB_PATH)
+        fdaDB.create_db_table()
+
+        if "--full" in sys.argv:
+            ## parse files in parallel, lookup tables are written first
+            from loader import load_all
+            logger.info("loaded %s", load_all(fdaDB))
+        else:
+            ## only reload files whose content changed since the last run
+            from refresh import refresh
+            logger.info("refreshed %s", refresh(fdaDB))
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+"""
+Asyncio client for the openFDA query API.
+
+Built for bulk lookups - thousands of set_ids or NDCs against drug/label and
+drug/drugsfda - at the highest rate one API key allows:
+    - token buckets keep requests within the per-key quotas (240 per minute,
+      120,000 per day), so requests wait instead of drawing 429s
+    - lookup values are ORed together, BATCH_TERMS per query; a batch whose
+      matches fill a whole page is split, and a single value paged with skip
+    - identical queries in flight are coalesced into one request
+    - responses are cached for CACHE_TTL seconds
+
+Requests go through a pooled requests.Session on a thread pool, so the client
+needs no http library beyond the one fdaAPI already uses.
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import utils
+from fdaAPI import http_error
+
+logger = logging.getLogger(__name__)
+
+## openFDA quotas per api key
+REQUESTS_PER_MINUTE = 240
+REQUESTS_PER_DAY = 120000
+
+## concurrent requests on the wire
+CONCURRENCY = 8
+## terms ORed into one search, kept well below the api's url length limit
+BATCH_TERMS = 50
+## largest page the api serves
+MAX_LIMIT = 1000
+## the api refuses skip beyond this
+MAX_SKIP = 25000
+## seconds a response stays cached
+CACHE_TTL = 3600
+## seconds to wait for the server to connect / respond
+TIMEOUT = (10, 60)
+RETRIES = 5
+BACKOFF = 1.0
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class TokenBucket(object):
+    """
+    Asyncio token bucket: capacity tokens, refilled continuously at rate per second.
+    The tokens outlive event loops; the lock is made for each loop that waits
+    on the bucket.
+
+    Usage:
+        bucket = TokenBucket(240 / 60.0, 240)
+        await bucket.acquire()
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.loop = None
+        self.lock = None
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.lock = asyncio.Lock()
+        ## the lock makes waiters queue in order instead of all waking on the same token
+        async with self.lock:
+            self.refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+
+class TTLCache(object):
+    """
+    Dict of values that expire ttl seconds after being set
+    """
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def quote_term(value):
+    return '"' + str(value).replace('"', '') + '"'
+
+
+def or_search(field, values):
+    """
+    search expression matching any of values on field; openFDA reads the
+    space (sent as +) between terms as OR
+    """
+    return " ".join(f"{field}:{quote_term(value)}" for value in values)
+
+
+def field_values(record, field):
+    """
+    Values of a dotted field of a record, as a list - openfda.* fields are lists
+    """
+    value = record
+    for part in field.split("."):
+        if not isinstance(value, dict):
+            return []
+        value = value.get(part)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class OpenFDAClient(object):
+    """
+    Rate limited, caching openFDA query client.
+
+    Usage:
+        client = OpenFDAClient()
+        labels = asyncio.run(client.lookup("label", "set_id", set_ids))
+        applications = asyncio.run(client.lookup("drugsfda", "openfda.product_ndc", ndcs))
+        client.close()
+
+    or, inside a coroutine:
+        async with OpenFDAClient() as client:
+            labels = await client.lookup("label", "set_id", set_ids)
+
+    The quotas are tracked across event loops; the asyncio primitives are made
+    for each loop the client runs in.
+    """
+    def __init__(self, configuration_file="config.yaml", session=None, concurrency=CONCURRENCY,
+                 per_minute=REQUESTS_PER_MINUTE, per_day=REQUESTS_PER_DAY, ttl=CACHE_TTL,
+                 batch_terms=BATCH_TERMS):
+        config = utils.read_configuration(configuration_file)
+        self.endpoint = config.get("API_ENDPOINT_PREFIX", "")
+        self.api_key = config.get("API_KEY", "")
+        self.concurrency = concurrency
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.batch_terms = batch_terms
+        self.cache = TTLCache(ttl)
+        self.inflight = {}
+        self.requests_sent = 0
+
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        self.minute_bucket = TokenBucket(per_minute / 60.0, per_minute)
+        self.day_bucket = TokenBucket(per_day / 86400.0, per_day)
+        ## bound to an event loop, made by limits() for each loop
+        self.loop = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        self.limits()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def url(self, endpoint):
+        """
+        Query url of an endpoint under API_ENDPOINT_PREFIX, e.g. "label" or "drugsfda"
+        """
+        return urljoin(self.endpoint, f"{endpoint}.json")
+
+    def limits(self):
+        """
+        Rate limits and the concurrency semaphore for the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.minute_bucket, self.day_bucket, self.semaphore
+
+    async def search(self, endpoint, search, limit=None, skip=0):
+        """
+        One query, served from the cache or shared with an identical query in flight.
+
+        Args:
+            endpoint (str): "label", "drugsfda", ...
+            search (str): openFDA search expression
+            limit (int, optional): results per query. Defaults to MAX_LIMIT.
+            skip (int, optional): results to skip. Defaults to 0.
+
+        Returns:
+            list: matching records, empty when nothing matches
+        """
+        limit = limit or MAX_LIMIT
+        key = (endpoint, search, limit, skip)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        future = self.inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.fetch(endpoint, search, limit, skip))
+            self.inflight[key] = future
+            try:
+                results = await future
+                self.cache.set(key, results)
+                return results
+            finally:
+                del self.inflight[key]
+        return await asyncio.shield(future)
+
+    async def search_all(self, endpoint, search):
+        """
+        Every record matching search, paged with skip
+        """
+        records = []
+        skip = 0
+        while True:
+            page = await self.search(endpoint, search, MAX_LIMIT, skip)
+            records.extend(page)
+            if len(page) < MAX_LIMIT:
+                return records
+            skip += MAX_LIMIT
+            if skip > MAX_SKIP:
+                logger.warning("%s search %s has more than %d results, stopping at the skip limit",
+                               endpoint, search, MAX_SKIP)
+                return records
+
+    async def fetch(self, endpoint, search, limit, skip=0):
+        minute_bucket, day_bucket, semaphore = self.limits()
+        params = {"search": search, "limit": limit}
+        if skip:
+            params["skip"] = skip
+        if self.api_key:
+            params["api_key"] = self.api_key
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(RETRIES + 1):
+            await day_bucket.acquire()
+            await minute_bucket.acquire()
+            async with semaphore:
+                self.requests_sent += 1
+                try:
+                    response = await loop.run_in_executor(self.executor, self.get, self.url(endpoint), params)
+                    status = response.status_code
+                except (requests.ConnectionError, requests.Timeout) as ex:
+                    response, status = ex, None
+
+            ## no match is a 404 in openFDA
+            if status == 404:
+                return []
+            if status is not None and status not in RETRYABLE_STATUS:
+                if status >= 400:
+                    raise http_error(response)
+                return response.json().get("results") or []
+            if attempt == RETRIES:
+                break
+
+            retry_after = response.headers.get("Retry-After") if status else None
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else \
+                BACKOFF * (2 ** attempt) * (1 + random.random())
+            logger.warning("%s query failed (%s), retrying in %.1fs", endpoint,
+                           utils.redact_url(status or response), delay)
+            await asyncio.sleep(delay)
+
+        if isinstance(response, Exception):
+            ## connection errors quote the full url, api key included
+            raise type(response)(utils.redact_url(response)) from None
+        raise http_error(response)
+
+    def get(self, url, params):
+        return self.session.get(url, params=params, timeout=TIMEOUT)
+
+    async def lookup(self, endpoint, field, values):
+        """
+        Records for many values of one field, batch_terms values per query.
+
+        Args:
+            endpoint (str): "label", "drugsfda", ...
+            field (str): search field, e.g. "set_id" or "openfda.product_ndc"
+            values (iterable): values to look up, duplicates are queried once
+
+        Returns:
+            dict: value -> list of matching records, empty for values without a match
+        """
+        values = list(dict.fromkeys(str(value) for value in values))
+        batches = [values[i:i + self.batch_terms] for i in range(0, len(values), self.batch_terms)]
+        results = await asyncio.gather(*[self.lookup_batch(endpoint, field, batch) for batch in batches])
+
+        found = {value: [] for value in values}
+        for parts in results:
+            for batch, records in parts:
+                wanted = set(batch)
+                for record in records:
+                    for value in set(map(str, field_values(record, field))) & wanted:
+                        found[value].append(record)
+        return found
+
+    async def lookup_batch(self, endpoint, field, batch):
+        """
+        Records matching a batch of values. A query whose matches fill a whole
+        page may have been cut short, so the batch is split in halves until
+        each part fits one page; a single value is paged with skip.
+
+        Returns:
+            list: (values, records) per part of the batch
+        """
+        records = await self.search(endpoint, or_search(field, batch))
+        if len(records) < MAX_LIMIT:
+            return [(batch, records)]
+        if len(batch) == 1:
+            return [(batch, await self.search_all(endpoint, or_search(field, batch)))]
+
+        middle = len(batch) // 2
+        logger.debug("%s lookup on %s filled a page, splitting %d values", endpoint, field, len(batch))
+        first, second = await asyncio.gather(self.lookup_batch(endpoint, field, batch[:middle]),
+                                             self.lookup_batch(endpoint, field, batch[middle:]))
+        return first + second
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+
+if __name__ == "__main__":
+    ## openfda_client.py <endpoint> <field> <file with one value per line>
+    endpoint, field, path = sys.argv[1:4]
+    with open(path) as f:
+        values = [line.strip() for line in f if line.strip()]
+    client = OpenFDAClient()
+    try:
+        found = asyncio.run(client.lookup(endpoint, field, values))
+    finally:
+        client.close()
+    json.dump(found, sys.stdout)
+    print(f"\n{sum(1 for records in found.values() if records)} of {len(found)} found "
+          f"in {client.requests_sent} requests", file=sys.stderr)
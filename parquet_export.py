@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+Columnar export of the Drugs@FDA tables.
+
+Each table is parsed into typed Arrow columns and written as a hive partitioned
+Parquet dataset: one directory per value of the table's partition columns
+(<table>/applType=NDA/part-0.parquet), so a filter on those columns skips
+whole directories, readers prune columns and scan the files in parallel. Lookup
+tables are small and written unpartitioned. A file holds at most ROWS_PER_FILE
+rows in row groups of at most ROWS_PER_GROUP. Column types come from the same
+schema registry the SQLite loader uses, and rows that fail to convert are
+recorded in <export_dir>/rejected_rows/<table>.parquet with the columns of the
+loader's rejected_rows table.
+"""
+import os
+import sys
+import shutil
+import logging
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from main import DATA_DIR, BATCH_SIZE
+from schema import TABLES
+from columnar import arrow_batches, arrow_schema, rows_batch
+from quarantine import QUARANTINE, QUARANTINE_COLUMNS, CONVERT, reject_records
+import utils
+import instrumentation
+from instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = "data/parquet"
+ROWS_PER_FILE = 1000000
+ROWS_PER_GROUP = 64 * 1024
+
+## hive partition columns per FDA_Files key: low cardinality columns scans filter on
+PARTITION_COLUMNS = {
+    "ApplicationDocs": ["submissionType"],
+    "Applications": ["applType"],
+    "MarketingStatus": ["id"],
+    "Products": ["referenceDrug"],
+    "SubmissionPropertyType": ["submissionType"],
+    "Submissions": ["submissionType"],
+    "TE": ["marketingStatusId"],
+}
+QUARANTINE_SCHEMA = pa.schema([pa.field(name, pa.string()) for name in QUARANTINE_COLUMNS])
+
+
+class FDAParquetExport(object):
+    """
+    Parquet counterpart of FDADatabase: writes each table to
+    <export_dir>/<table>/<column>=<value>/part-N.parquet
+
+    Usage:
+        export = FDAParquetExport()
+        export.export_all()
+        export.dataset("Applications").to_table(filter=pc.field("applType") == "NDA")
+    """
+    def __init__(self, export_dir=EXPORT_DIR, rows_per_file=ROWS_PER_FILE, compression="snappy",
+                 rows_per_group=ROWS_PER_GROUP):
+        self.export_dir = export_dir
+        self.rows_per_file = rows_per_file
+        self.rows_per_group = min(rows_per_group, rows_per_file)
+        self.compression = compression
+
+    def partitioning(self, spec):
+        """
+        Hive partitioning of a table, None for an unpartitioned one
+        """
+        columns = PARTITION_COLUMNS.get(spec.source)
+        if not columns:
+            return None
+        schema = arrow_schema(spec)
+        return ds.partitioning(pa.schema([schema.field(name) for name in columns]), flavor="hive")
+
+    def dataset(self, source):
+        """
+        pyarrow Dataset of an exported table, with the registry's column types
+        and its partitioning
+        """
+        spec = TABLES[source]
+        return ds.dataset(os.path.join(self.export_dir, spec.table), schema=arrow_schema(spec), format="parquet",
+                          partitioning=self.partitioning(spec))
+
+    def export_table(self, spec, data):
+        """
+        Write batches for one table. The table directory is replaced only once
+        every file has been written; on failure the partial output is removed.
+
+        Args:
+            spec (TableSpec): entry from schema.TABLES
+            data (iterable): Arrow RecordBatches, as yielded by columnar.arrow_batches,
+                or lists of converted row tuples
+
+        Returns:
+            int: rows written
+        """
+        schema = arrow_schema(spec)
+        partitioning = self.partitioning(spec)
+        target = os.path.join(self.export_dir, spec.table)
+        staging = target + ".tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        counts = {"rows": 0}
+
+        def batches():
+            for batch in data:
+                if not isinstance(batch, pa.RecordBatch):
+                    batch = rows_batch(schema, batch)
+                counts["rows"] += batch.num_rows
+                yield batch
+
+        try:
+            with stage("parquet_write", table=spec.table) as timer:
+                ds.write_dataset(batches(), staging, schema=schema, format="parquet", partitioning=partitioning,
+                                 basename_template="part-{i}.parquet", max_rows_per_file=self.rows_per_file,
+                                 max_rows_per_group=self.rows_per_group,
+                                 file_options=ds.ParquetFileFormat().make_write_options(compression=self.compression),
+                                 existing_data_behavior="overwrite_or_ignore")
+                timer.add(rows=counts["rows"])
+            if counts["rows"] == 0:
+                ## empty file - keep an empty, typed file so readers still see the schema
+                names = [field.name for field in partitioning.schema] if partitioning else []
+                empty = pa.schema([field for field in schema if field.name not in names])
+                pq.write_table(empty.empty_table(), os.path.join(staging, "part-0.parquet"))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(staging, target)
+        return counts["rows"]
+
+    def write_rejects(self, spec, rejects):
+        """
+        Replace the rejected rows file of a table, removing it when there are none
+        """
+        path = os.path.join(self.export_dir, QUARANTINE, spec.table + ".parquet")
+        if not rejects:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        records = reject_records(spec, rejects, CONVERT)
+        pq.write_table(pa.Table.from_arrays([pa.array(column, type=pa.string()) for column in zip(*records)],
+                                            schema=QUARANTINE_SCHEMA), path)
+
+    def export_all(self, data_dir=DATA_DIR, sources=None, batch_size=BATCH_SIZE):
+        """
+        Export every Drugs@FDA file in data_dir.
+
+        Returns:
+            dict: rows written per FDA_Files key, None for a failed file, plus
+            "rejected" row counts
+        """
+        summary = {}
+        for source in (sources or TABLES.keys()):
+            spec = TABLES[source]
+            rejects = []
+            try:
+                batches = arrow_batches(spec, os.path.join(data_dir, spec.filename), batch_size,
+                                        on_reject=rejects.extend)
+                summary[source] = self.export_table(spec, batches)
+                self.write_rejects(spec, rejects)
+                if rejects:
+                    summary.setdefault("rejected", {})[source] = len(rejects)
+            except Exception as ex:
+                logger.error("failed to export %s: %s", source, ex)
+                summary[source] = None
+        return summary
+
+
+if __name__ == "__main__":
+    export_dir = sys.argv[1] if len(sys.argv) > 1 else EXPORT_DIR
+    instrumentation.configure_logging()
+    config = utils.read_configuration() if os.path.exists("config.yaml") else {}
+    with instrumentation.session(config):
+        print(FDAParquetExport(export_dir).export_all())
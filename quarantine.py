@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Fault tolerant conversion and insert of Drugs@FDA batches.
+
+A batch is converted and inserted whole, at full bulk speed. Only when that
+fails is it bisected - halves are retried until the failing rows are isolated -
+so one malformed row costs a few extra conversions instead of the batch or the
+table. Rejected rows land in the rejected_rows table with the stage that
+refused them and the reason.
+"""
+import json
+import logging
+import sqlite3
+from datetime import datetime, timezone
+
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+QUARANTINE = "rejected_rows"
+QUARANTINE_DDL = f"""CREATE TABLE IF NOT EXISTS {QUARANTINE} (
+    id INTEGER PRIMARY KEY,
+    table_name TEXT,
+    source_file TEXT,
+    stage TEXT,
+    reason TEXT,
+    row_data TEXT,
+    rejected_at TEXT)"""
+## columns of a rejected_rows record, as built by reject_records
+QUARANTINE_COLUMNS = ["table_name", "source_file", "stage", "reason", "row_data", "rejected_at"]
+
+## stages a row can be rejected at
+CONVERT = "convert"
+INSERT = "insert"
+
+## errors that reject rows rather than abort the load. Only row level failures:
+## an OperationalError (missing column, locked database, I/O error) or any other
+## database error fails every row alike and is raised
+CONVERT_ERRORS = (ValueError, TypeError, OverflowError)
+INSERT_ERRORS = (sqlite3.IntegrityError, OverflowError)
+
+
+def bisect(batch, attempt, errors):
+    """
+    Run attempt on the whole batch; when it raises one of errors, split the
+    batch in halves and retry each, down to single rows.
+
+    Args:
+        batch (list): items to process
+        attempt (callable): list of items -> result, raises on a bad item
+        errors (tuple): exception types that mark bad items
+
+    Returns:
+        tuple: (results, rejects) - results of the successful attempts in batch
+        order, rejects a list of (item, reason)
+    """
+    results = []
+    rejects = []
+    pending = [batch]
+    while pending:
+        part = pending.pop()
+        try:
+            results.append(attempt(part))
+        except errors as ex:
+            if len(part) == 1:
+                rejects.append((part[0], repr(ex)))
+            else:
+                middle = len(part) // 2
+                pending.append(part[middle:])
+                pending.append(part[:middle])
+    return results, rejects
+
+
+def convert_batch(spec, batch):
+    """
+    spec.convert, isolating the rows that fail to convert
+
+    Returns:
+        tuple: (rows, rejects) - converted tuples, and (raw row, reason) pairs
+    """
+    if not batch:
+        return [], []
+    results, rejects = bisect(batch, spec.convert, CONVERT_ERRORS)
+    if len(results) == 1:
+        return results[0], rejects
+    return [row for part in results for row in part], rejects
+
+
+def insert_batch(cur, spec, rows):
+    """
+    executemany spec.insert_sql inside a savepoint, isolating the rows the
+    database refuses. Must run inside a transaction. Errors other than
+    INSERT_ERRORS roll back the savepoint and are raised.
+
+    Returns:
+        tuple: (inserted, rejects) - rows sent successfully, (row, reason) pairs
+    """
+    def attempt(part):
+        cur.execute("SAVEPOINT insert_batch")
+        try:
+            cur.executemany(spec.insert_sql, part)
+        except Exception:
+            cur.execute("ROLLBACK TO insert_batch")
+            cur.execute("RELEASE insert_batch")
+            raise
+        cur.execute("RELEASE insert_batch")
+        return len(part)
+
+    if not rows:
+        return 0, []
+    results, rejects = bisect(rows, attempt, INSERT_ERRORS)
+    return sum(results), rejects
+
+
+def reject_records(spec, rejects, stage, source_file=None):
+    """
+    rejected_rows records of rejected rows, in QUARANTINE_COLUMNS order. The
+    rejects are counted and logged.
+
+    Args:
+        spec (TableSpec): table the rows were meant for
+        rejects (list): (row, reason) pairs
+        stage (str): CONVERT or INSERT
+        source_file (str, optional): defaults to the spec's file name
+
+    Returns:
+        list: one tuple per rejected row
+    """
+    rejected_at = datetime.now(timezone.utc).isoformat()
+    records = [(spec.table, source_file or spec.filename, stage, reason, json.dumps(list(row), default=str),
+                rejected_at) for row, reason in rejects]
+    instrumentation.count("rejected_rows", len(rejects), table=spec.table, stage=stage)
+    logger.warning("%d rows of %s rejected at %s, first: %s", len(rejects), spec.table, stage, rejects[0][1])
+    return records
+
+
+def quarantine(cur, spec, rejects, stage, source_file=None):
+    """
+    Record rejected rows in the rejected_rows table
+
+    Args:
+        cur: cursor inside the load transaction
+        spec (TableSpec): table the rows were meant for
+        rejects (list): (row, reason) pairs
+        stage (str): CONVERT or INSERT
+        source_file (str, optional): defaults to the spec's file name
+    """
+    if not rejects:
+        return 0
+    cur.execute(QUARANTINE_DDL)
+    cur.executemany(f"INSERT INTO {QUARANTINE} ({', '.join(QUARANTINE_COLUMNS)}) VALUES (?,?,?,?,?,?)",
+                    reject_records(spec, rejects, stage, source_file))
+    return len(rejects)
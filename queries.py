@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Prepared lookups over the loaded Drugs@FDA database.
+
+The SQL text of every lookup is a module constant with bound parameters, so the
+sqlite3 statement cache of the query connection prepares each one only once.
+"""
+from main import FDADatabase, DB_PATH
+from schema import (APPLICATIONS, PRODUCTS, SUBMISSIONS, MARKETINGSTATUS, MARKETINGSTATUS_LOOKUP,
+                    TE, APPLICATION_DOCS, APPLICATION_DOCSTYPE_LOOKUP, SUBMISSION_CLASS_LOOKUP,
+                    SUBMISSION_PROPERTY_TYPE)
+
+APPLICATION_SQL = f"""
+    SELECT applNo, applType, applPublicNotes, sponsorName
+    FROM {APPLICATIONS} WHERE applNo = ?"""
+
+PRODUCTS_SQL = f"""
+    SELECT p.applNo, p.productNo, p.form, p.strength, p.referenceDrug, p.drugName,
+           p.activeIngredient, p.referenceStandard,
+           ms.id AS marketingStatusId, msl.description AS marketingStatus
+    FROM {PRODUCTS} p
+    LEFT JOIN {MARKETINGSTATUS} ms ON ms.applNo = p.applNo AND ms.productNo = p.productNo
+    LEFT JOIN {MARKETINGSTATUS_LOOKUP} msl ON msl.id = ms.id
+    WHERE p.applNo = ?
+    ORDER BY p.productNo"""
+
+TE_SQL = f"""
+    SELECT applNo, productNo, marketingStatusId, teCode
+    FROM {TE} WHERE applNo = ?
+    ORDER BY productNo"""
+
+SUBMISSIONS_SQL = f"""
+    SELECT s.applNo, s.submissionType, s.submissionNo, s.submissionStatus, s.submissionStatusDate,
+           s.submissionsPublicNotes, s.reviewPriority,
+           scl.submissionClassCode, scl.submissionClassDescription
+    FROM {SUBMISSIONS} s
+    LEFT JOIN {SUBMISSION_CLASS_LOOKUP} scl ON scl.id = s.submissionClassCodeId
+    WHERE s.applNo = ?
+    ORDER BY s.submissionStatusDate, s.submissionNo"""
+
+SUBMISSION_PROPERTIES_SQL = f"""
+    SELECT applNo, submissionType, submissionNo, submissionPropertyTypeCode
+    FROM {SUBMISSION_PROPERTY_TYPE} WHERE applNo = ?"""
+
+DOCS_SQL = f"""
+    SELECT d.id, d.applNo, d.submissionType, d.submissionNo, d.applicationDocsTitle,
+           d.applicationDocsURL, d.applicationDocsDate, dt.description AS docsType
+    FROM {APPLICATION_DOCS} d
+    LEFT JOIN {APPLICATION_DOCSTYPE_LOOKUP} dt ON dt.id = d.docsTypeId
+    WHERE d.applNo = ?
+    ORDER BY d.applicationDocsDate"""
+
+PRODUCTS_BY_NAME_SQL = f"""
+    SELECT applNo, productNo, form, strength, drugName, activeIngredient
+    FROM {PRODUCTS} WHERE drugName = ? OR activeIngredient = ?
+    ORDER BY applNo, productNo"""
+
+APPLICATIONS_BY_SPONSOR_SQL = f"""
+    SELECT applNo, applType, sponsorName
+    FROM {APPLICATIONS} WHERE sponsorName = ?
+    ORDER BY applNo"""
+
+
+class FDAQueries(object):
+    """
+    Read side of FDADatabase - holds one pooled connection for its lifetime.
+
+    Usage:
+        with FDAQueries(fdaDB) as queries:
+            queries.application(4)
+    """
+    def __init__(self, fdaDB):
+        self.conn = fdaDB.db_engine.raw_connection()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            ## return connection to the pool
+            self.conn.close()
+            self.conn = None
+
+    def application(self, appl_no):
+        """
+        Application with its products (and marketing status), TE codes,
+        submissions (and their property types) and documents.
+
+        Args:
+            appl_no (int): application number, e.g. 4 for ApplNo 000004
+
+        Returns:
+            dict: application fields plus products, te, submissions, submissionProperties
+            and docs lists, or None when the application does not exist
+        """
+        appl_no = int(appl_no)
+        rows = self.__fetch(APPLICATION_SQL, (appl_no,))
+        if not rows:
+            return None
+
+        response = rows[0]
+        response["products"] = self.__fetch(PRODUCTS_SQL, (appl_no,))
+        response["te"] = self.__fetch(TE_SQL, (appl_no,))
+        response["submissions"] = self.__fetch(SUBMISSIONS_SQL, (appl_no,))
+        response["submissionProperties"] = self.__fetch(SUBMISSION_PROPERTIES_SQL, (appl_no,))
+        response["docs"] = self.__fetch(DOCS_SQL, (appl_no,))
+        return response
+
+    def products_by_name(self, name):
+        """
+        Products whose drug name or active ingredient matches name exactly
+        """
+        name = name.upper()
+        return self.__fetch(PRODUCTS_BY_NAME_SQL, (name, name))
+
+    def applications_by_sponsor(self, sponsor_name):
+        return self.__fetch(APPLICATIONS_BY_SPONSOR_SQL, (sponsor_name,))
+
+    def __fetch(self, query, params):
+        cur = self.conn.cursor()
+        try:
+            cur.execute(query, params)
+            columns = [column[0] for column in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+        finally:
+            cur.close()
+
+
+if __name__ == "__main__":
+    import sys
+    import utils
+
+    with FDAQueries(FDADatabase(dbtype='sqlite', dbname=DB_PATH)) as queries:
+        utils.pretty_print_json_response(queries.application(sys.argv[1]))
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""
+Reconciliation of DailyMed SPL labels with openFDA drug labels by set_id.
+
+Both corpora are indexed into one SQLite file as set_id -> (version,
+effective_time, location, compared fields), keeping the newest version of each
+set_id. DailyMed labels are streamed with iterparse across a process pool and
+openFDA labels are read one record at a time from the label store, so neither
+corpus is ever held in memory. The indexes are then joined in a single pass
+ordered by set_id and every label that is missing, stale or different is
+reported.
+
+openFDA drug/label records carry no title and no dosage form, so those
+DailyMed fields cannot be checked; the report counts them, and compared fields
+openFDA has no value for, as not comparable rather than as matches.
+"""
+import os
+import sys
+import json
+import logging
+import sqlite3
+from datetime import datetime
+from multiprocessing import Pool
+
+from batch_labels import iter_label_sources, imap_chunks, CHUNK_SIZE
+from drug_label import iterparse_label
+from label_store import LabelStore, STORE_PATH
+import utils
+import instrumentation
+from instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = "data/reconcile.db"
+
+## (DailyMed field, openFDA field, index column) compared between the corpora
+COMPARED_FIELDS = [
+    ("drugName", "openfda.brand_name", "brand_name"),
+    ("genericName", "openfda.generic_name", "generic_name"),
+    ("substanceName", "openfda.substance_name", "substance_name"),
+    ("manufacturer", "openfda.manufacturer_name", "manufacturer_name"),
+]
+## DailyMed fields without an openFDA drug/label counterpart
+NOT_COMPARABLE = ("title", "dosageForm")
+
+## rows per insert transaction
+WRITE_BATCH_SIZE = 1000
+
+## index columns after set_id: version, effective_time, location, then the compared fields
+COLUMNS = ["version", "effective_time", "location"] + [column for _, _, column in COMPARED_FIELDS]
+
+INDEX_DDL = [
+    "CREATE TABLE IF NOT EXISTS {table} (set_id TEXT PRIMARY KEY, version INTEGER, effective_time TEXT, "
+    "location TEXT, " + ", ".join(f"{column} TEXT" for _, _, column in COMPARED_FIELDS) + ") WITHOUT ROWID",
+]
+DAILYMED = "dailymed_index"
+OPENFDA = "openfda_index"
+
+## keep the newest version seen of each set_id
+UPSERT_SQL = ("INSERT INTO {table} VALUES (" + ",".join(["?"] * (len(COLUMNS) + 1)) + ") "
+              "ON CONFLICT (set_id) DO UPDATE SET "
+              + ", ".join(f"{column} = excluded.{column}" for column in COLUMNS) +
+              " WHERE excluded.version > {table}.version")
+
+## full outer join on set_id; SQLite before 3.39 has no FULL JOIN
+JOIN_SQL = f"""
+    SELECT d.set_id, {", ".join("d." + column for column in COLUMNS)}, {", ".join("o." + column for column in COLUMNS)}
+    FROM dailymed_index d LEFT JOIN openfda_index o ON o.set_id = d.set_id
+    UNION ALL
+    SELECT o.set_id, {", ".join(["NULL"] * len(COLUMNS))}, {", ".join("o." + column for column in COLUMNS)}
+    FROM openfda_index o
+    WHERE NOT EXISTS (SELECT 1 FROM dailymed_index d WHERE d.set_id = o.set_id)
+    ORDER BY 1"""
+
+## statuses of a joined set_id
+MATCH = "match"
+MISSING_OPENFDA = "missing_openfda"
+MISSING_DAILYMED = "missing_dailymed"
+OPENFDA_STALE = "openfda_stale"
+DAILYMED_STALE = "dailymed_stale"
+## same version, different effective_time
+VERSION_MISMATCH = "version_mismatch"
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def compact_date(text):
+    """
+    "Mar 15, 2020" (DrugLabel) -> "20200315" (openFDA)
+    """
+    try:
+        return datetime.strptime(text, "%b %d, %Y").strftime("%Y%m%d")
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_field(value):
+    """
+    Comparable form of a field: openFDA lists and DailyMed comma separated
+    values become one upper case, sorted, comma separated string. Empty values
+    are None, which is never compared.
+    """
+    if isinstance(value, list):
+        parts = value
+    elif value:
+        parts = value.split(",")
+    else:
+        return None
+    parts = sorted(set(" ".join(str(part).split()).upper() for part in parts) - {""})
+    return ", ".join(parts) or None
+
+
+def record_field(record, field):
+    value = record
+    for part in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def index_dailymed_label(task):
+    """
+    Worker: index row of one SPL document, summary fields only
+    """
+    name, source = task
+    try:
+        summary = {}
+        for event in iterparse_label(source, sections=False):
+            if event[0] == "summary":
+                summary = event[1]
+        if not summary.get("setId"):
+            return None
+        return (summary["setId"], to_int(summary.get("versionNumber")), compact_date(summary.get("effectiveTime")),
+                name) + tuple(normalize_field(summary.get(field)) for field, _, _ in COMPARED_FIELDS)
+    except Exception as ex:
+        logger.error("failed to index %s: %r", name, ex)
+        return None
+
+
+def openfda_row(record):
+    """
+    Index row of one openFDA label record
+    """
+    if not record.get("set_id"):
+        return None
+    return (record["set_id"], to_int(record.get("version")), record.get("effective_time"),
+            record.get("id")) + tuple(normalize_field(record_field(record, field)) for _, field, _ in COMPARED_FIELDS)
+
+
+def compare(row):
+    """
+    Status and field diffs of one joined row
+
+    Returns:
+        dict: report entry
+    """
+    set_id = row[0]
+    width = len(COLUMNS)
+    dailymed, openfda = row[1:1 + width], row[1 + width:1 + 2 * width]
+    entry = {"setId": set_id}
+
+    if dailymed[2] is None:
+        entry.update(status=MISSING_DAILYMED, openfda={"version": openfda[0], "location": openfda[2]})
+        return entry
+    if openfda[2] is None:
+        entry.update(status=MISSING_OPENFDA, dailymed={"version": dailymed[0], "location": dailymed[2]})
+        return entry
+
+    entry["dailymed"] = {"version": dailymed[0], "effectiveTime": dailymed[1], "location": dailymed[2]}
+    entry["openfda"] = {"version": openfda[0], "effectiveTime": openfda[1], "location": openfda[2]}
+    if dailymed[0] != openfda[0]:
+        entry["status"] = OPENFDA_STALE if (openfda[0] or 0) < (dailymed[0] or 0) else DAILYMED_STALE
+    elif dailymed[1] != openfda[1]:
+        entry["status"] = VERSION_MISMATCH
+    else:
+        entry["status"] = MATCH
+
+    ## only fields openFDA has a value for are compared, the rest are not comparable
+    diffs = {}
+    not_compared = list(NOT_COMPARABLE)
+    for (field, _, _), ours, theirs in zip(COMPARED_FIELDS, dailymed[3:], openfda[3:]):
+        if theirs is None:
+            not_compared.append(field)
+        elif ours != theirs:
+            diffs[field] = {"dailymed": ours, "openfda": theirs}
+    if diffs:
+        entry["diffs"] = diffs
+    entry["notCompared"] = not_compared
+    return entry
+
+
+class LabelReconciler(object):
+    """
+    Builds the set_id indexes and joins them.
+
+    Usage:
+        reconciler = LabelReconciler()
+        reconciler.index_dailymed("data/dailyMed/xml")
+        reconciler.index_openfda(LabelStore())
+        with open("report.jsonl", "w") as out:
+            reconciler.report(out)
+    """
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        for table in (DAILYMED, OPENFDA):
+            ## an index built with other compared fields is rebuilt
+            columns = [info[1] for info in self.conn.execute(f"PRAGMA table_info({table})")]
+            if columns and columns != ["set_id"] + COLUMNS:
+                self.conn.execute(f"DROP TABLE {table}")
+            for ddl in INDEX_DDL:
+                self.conn.execute(ddl.format(table=table))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def write_rows(self, table, rows):
+        """
+        Rebuild an index from an iterable of rows, committing in batches
+
+        Returns:
+            int: rows read, before keeping the newest version per set_id
+        """
+        sql = UPSERT_SQL.format(table=table)
+        count = 0
+        batch = []
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {table}")
+        for row in rows:
+            if row is None:
+                continue
+            batch.append(row)
+            count += 1
+            if len(batch) >= WRITE_BATCH_SIZE:
+                self.write_batch(table, sql, batch)
+                batch = []
+        if batch:
+            self.write_batch(table, sql, batch)
+        return count
+
+    def write_batch(self, table, sql, batch):
+        with stage("index_write", table=table) as timer, self.conn:
+            self.conn.executemany(sql, batch)
+            timer.add(rows=len(batch))
+
+    def index_dailymed(self, source, workers=None, chunksize=CHUNK_SIZE):
+        """
+        Index a directory or zip archive of SPL documents across a process pool
+        """
+        with Pool(processes=workers or os.cpu_count()) as pool:
+            rows = imap_chunks(pool, index_dailymed_label, iter_label_sources(source), chunksize)
+            return self.write_rows(DAILYMED, rows)
+
+    def index_openfda(self, store):
+        """
+        Index every record of a LabelStore, decompressing one record at a time
+        """
+        return self.write_rows(OPENFDA, (openfda_row(record) for record in store))
+
+    def report(self, out, include_matches=False):
+        """
+        Join the indexes in one pass, writing one JSON line per set_id that does
+        not match
+
+        Args:
+            out: text file for the report
+            include_matches (bool, optional): also write matching labels. Defaults to False.
+
+        Returns:
+            dict: count per status, labels with field diffs, diffs per field and,
+            per field, labels on both sides it could not be compared for
+        """
+        summary = {}
+        with stage("reconcile_join") as timer:
+            for row in self.conn.execute(JOIN_SQL):
+                entry = compare(row)
+                timer.add(labels=1)
+                status = entry["status"]
+                summary[status] = summary.get(status, 0) + 1
+                if "diffs" in entry:
+                    summary["field_diffs"] = summary.get("field_diffs", 0) + 1
+                    diffs = summary.setdefault("diffs_by_field", {})
+                    for field in entry["diffs"]:
+                        diffs[field] = diffs.get(field, 0) + 1
+                for field in entry.get("notCompared", []):
+                    not_comparable = summary.setdefault("not_comparable", {})
+                    not_comparable[field] = not_comparable.get(field, 0) + 1
+                if status != MATCH or "diffs" in entry or include_matches:
+                    out.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        return summary
+
+
+if __name__ == "__main__":
+    ## reconcile.py <DailyMed xml directory | zip archive> [report.jsonl] [labels.db]
+    source = sys.argv[1]
+    report_path = sys.argv[2] if len(sys.argv) > 2 else "reconcile_report.jsonl"
+    store_path = sys.argv[3] if len(sys.argv) > 3 else STORE_PATH
+
+    instrumentation.configure_logging()
+    config = utils.read_configuration() if os.path.exists("config.yaml") else {}
+    with instrumentation.session(config):
+        reconciler = LabelReconciler()
+        print(f"indexed {reconciler.index_dailymed(source)} DailyMed labels")
+        with LabelStore(store_path) as store:
+            print(f"indexed {reconciler.index_openfda(store)} openFDA labels")
+        with open(report_path, "w") as out:
+            print(reconciler.report(out))
+        reconciler.close()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Incremental Drugs@FDA refresh.
+
+load_state records the sha256 of every source file that was loaded and
+row_fingerprints a fingerprint per row key, so a refresh skips unchanged files and
+turns a changed file into deletes and upserts for only the rows that differ.
+"""
+import os
+import json
+import logging
+import hashlib
+from datetime import datetime, timezone
+
+from main import FDADatabase, DATA_DIR, DB_PATH, BATCH_SIZE
+from schema import TABLES, LOAD_STATE, ROW_FINGERPRINTS
+from quarantine import quarantine, CONVERT
+from columnar import row_batches
+import utils
+import instrumentation
+from instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+STATE_DDL = [
+    f"""CREATE TABLE IF NOT EXISTS {LOAD_STATE} (
+        source TEXT PRIMARY KEY,
+        filename TEXT,
+        sha256 TEXT,
+        rows INTEGER,
+        loaded_at TEXT)""",
+    f"""CREATE TABLE IF NOT EXISTS {ROW_FINGERPRINTS} (
+        source TEXT,
+        row_key TEXT,
+        fingerprint TEXT,
+        PRIMARY KEY (source, row_key)) WITHOUT ROWID""",
+]
+
+## bytes read per chunk while hashing a file
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_sha256(fname):
+    """
+    sha256 hex digest of a file, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def key_columns(spec):
+    """
+    Columns identifying a row: the primary key, or the whole row for tables without one
+    """
+    return list(spec.primary_key) or spec.column_names
+
+
+def row_fingerprint(row):
+    return hashlib.blake2b(repr(row).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def create_state_tables(fdaDB):
+    with fdaDB.transaction() as cur:
+        for ddl in STATE_DDL:
+            cur.execute(ddl)
+
+
+def stage_rows(cur, spec, batches):
+    """
+    Write converted batches, as yielded by columnar.row_batches, into the temp
+    staging table with each row's key and fingerprint. Rows that failed to
+    convert are quarantined instead of failing the refresh. Of rows sharing a
+    key the first is kept, as the full load's INSERT or IGNORE does. Tables
+    without a primary key keep every row, as the full load does: identical rows
+    are staged once with their number of copies, which is part of the
+    fingerprint.
+    Returns the number of rows the table holds once the diff is applied.
+    """
+    names = ",".join([f'"{name}"' for name in spec.column_names])
+    placeholders = ",".join(["?"] * (len(spec.column_names) + 2))
+    cur.execute(f"CREATE TEMP TABLE staging (row_key TEXT PRIMARY KEY, fingerprint TEXT, copies INTEGER DEFAULT 1, "
+                f"{names})")
+    if spec.primary_key:
+        insert = f"INSERT or IGNORE INTO staging (row_key, fingerprint, {names}) VALUES ({placeholders})"
+    else:
+        insert = (f"INSERT INTO staging (row_key, fingerprint, {names}) VALUES ({placeholders}) "
+                  "ON CONFLICT (row_key) DO UPDATE SET copies = copies + 1")
+
+    positions = [spec.column_names.index(name) for name in key_columns(spec)]
+    for (rows, rejects) in batches:
+        quarantine(cur, spec, rejects, CONVERT)
+        cur.executemany(insert, [(json.dumps([row[i] for i in positions]), row_fingerprint(row)) + row
+                                 for row in rows])
+    if not spec.primary_key:
+        cur.execute("UPDATE staging SET fingerprint = fingerprint || '*' || copies WHERE copies > 1")
+    return cur.execute("SELECT COALESCE(SUM(copies), 0) FROM staging").fetchone()[0]
+
+
+def apply_diff(conn, cur, spec, reset):
+    """
+    Delete stale rows from the target table and upsert changed rows from staging.
+    Returns (upserted, deleted): rows written and row keys deleted.
+    """
+    names = ",".join([f'"{name}"' for name in spec.column_names])
+    keys = key_columns(spec)
+
+    if reset:
+        ## no fingerprints yet: rebuild the table from the file
+        cur.execute(f"DELETE FROM {spec.table}")
+        cur.execute(f"DELETE FROM {ROW_FINGERPRINTS} WHERE source = ?", (spec.source,))
+
+    cur.execute(f"""CREATE TEMP TABLE changed AS
+        SELECT s.row_key FROM staging s
+        LEFT JOIN {ROW_FINGERPRINTS} f ON f.source = ? AND f.row_key = s.row_key
+        WHERE f.fingerprint IS NULL OR f.fingerprint != s.fingerprint""", (spec.source,))
+    cur.execute(f"""CREATE TEMP TABLE removed AS
+        SELECT f.row_key FROM {ROW_FINGERPRINTS} f
+        WHERE f.source = ? AND NOT EXISTS (SELECT 1 FROM staging s WHERE s.row_key = f.row_key)""",
+                (spec.source,))
+
+    ## delete old versions of changed rows and rows gone from the file, by key -
+    ## every copy of a row, for tables without a primary key
+    delete = f"DELETE FROM {spec.table} WHERE " + " AND ".join([f'"{name}" IS ?' for name in keys])
+    stale = conn.cursor()
+    try:
+        stale.execute("SELECT row_key FROM changed UNION ALL SELECT row_key FROM removed")
+        while True:
+            chunk = stale.fetchmany(BATCH_SIZE)
+            if not chunk:
+                break
+            cur.executemany(delete, [json.loads(row_key) for (row_key,) in chunk])
+    finally:
+        stale.close()
+
+    ## each staged row is written copies times
+    cur.execute(f"""INSERT or REPLACE INTO {spec.table} ({names})
+        WITH RECURSIVE copy (n) AS (
+            SELECT 1 UNION ALL SELECT n + 1 FROM copy WHERE n < (SELECT MAX(copies) FROM staging))
+        SELECT {names} FROM staging JOIN copy ON copy.n <= staging.copies
+        WHERE row_key IN (SELECT row_key FROM changed)""")
+    upserted = cur.rowcount
+
+    cur.execute(f"""DELETE FROM {ROW_FINGERPRINTS}
+        WHERE source = ? AND row_key IN (SELECT row_key FROM removed)""", (spec.source,))
+    deleted = cur.rowcount
+    cur.execute(f"""INSERT or REPLACE INTO {ROW_FINGERPRINTS} (source, row_key, fingerprint)
+        SELECT ?, s.row_key, s.fingerprint FROM staging s
+        WHERE s.row_key IN (SELECT row_key FROM changed)""", (spec.source,))
+
+    for temp in ("staging", "changed", "removed"):
+        cur.execute(f"DROP TABLE temp.{temp}")
+
+    return upserted, deleted
+
+
+def refresh_table(fdaDB, spec, data_dir=DATA_DIR, batch_size=BATCH_SIZE):
+    """
+    Bring one table in line with its source file.
+
+    Returns:
+        dict: status ("unchanged" or "refreshed") with row counts
+    """
+    fname = os.path.join(data_dir, spec.filename)
+    with stage("checksum", file=spec.filename):
+        sha256 = file_sha256(fname)
+
+    with fdaDB.transaction() as cur:
+        state = cur.execute(f"SELECT sha256 FROM {LOAD_STATE} WHERE source = ?", (spec.source,)).fetchone()
+        if state is not None and state[0] == sha256:
+            return {"status": "unchanged"}
+
+        with stage("stage_rows", table=spec.table) as timer:
+            rows = stage_rows(cur, spec, row_batches(spec, fname, batch_size))
+            timer.add(rows=rows)
+        with stage("apply_diff", table=spec.table) as timer:
+            upserted, deleted = apply_diff(fdaDB.connection, cur, spec, reset=state is None)
+            timer.add(upserted=upserted, deleted=deleted)
+
+        cur.execute(f"INSERT or REPLACE INTO {LOAD_STATE} VALUES (?,?,?,?,?)",
+                    (spec.source, spec.filename, sha256, rows, datetime.now(timezone.utc).isoformat()))
+
+    return {"status": "refreshed", "rows": rows, "upserted": upserted, "deleted": deleted}
+
+
+def refresh(fdaDB, data_dir=DATA_DIR, sources=None, batch_size=BATCH_SIZE):
+    """
+    Incrementally refresh Drugs@FDA tables from data_dir.
+
+    Args:
+        fdaDB (FDADatabase): target database, tables must exist
+        data_dir (str, optional): directory with the text files. Defaults to DATA_DIR.
+        sources (list, optional): FDA_Files keys to refresh. Defaults to every table.
+        batch_size (int, optional): rows per batch. Defaults to BATCH_SIZE.
+
+    Returns:
+        dict: per FDA_Files key result of refresh_table
+    """
+    summary = {}
+    with fdaDB.load_session():
+        create_state_tables(fdaDB)
+        for source in (sources or TABLES.keys()):
+            try:
+                summary[source] = refresh_table(fdaDB, TABLES[source], data_dir, batch_size)
+            except Exception as ex:
+                logger.error("failed to refresh %s: %s", source, ex)
+                summary[source] = {"status": "failed", "error": repr(ex)}
+        if any(result["status"] == "refreshed" for result in summary.values()):
+            fdaDB.create_indexes()
+    return summary
+
+
+if __name__ == "__main__":
+    instrumentation.configure_logging()
+    config = utils.read_configuration() if os.path.exists("config.yaml") else {}
+    with instrumentation.session(config):
+        fdaDB = FDADatabase(dbtype='sqlite', dbname=DB_PATH)
+        fdaDB.create_db_table()
+        print(refresh(fdaDB))
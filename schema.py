@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+Declarative description of the Drugs@FDA text files and the tables they load into.
+
+Every consumer (DDL, row conversion, INSERT statements) is driven from TABLES so
+the column layout of a table is written down exactly once.
+"""
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import Table, Column, Integer, String
+
+FDA_Files = {
+    "ActionTypes_Lookup": "ActionTypes_Lookup.txt",
+    "ApplicationDocs": "ApplicationDocs.txt",
+    "Applications": "Applications.txt",
+    "ApplicationsDocsType_Lookup": "ApplicationsDocsType_Lookup.txt",
+    "MarketingStatus": "MarketingStatus.txt",
+    "MarketingStatus_Lookup": "MarketingStatus_Lookup.txt",
+    "Products": "Products.txt",
+    "SubmissionClass_Lookup": "SubmissionClass_Lookup.txt",
+    "SubmissionPropertyType": "SubmissionPropertyType.txt",
+    "Submissions": "Submissions.txt",
+    "TE": "TE.txt"
+}
+
+# Table Names
+ACTIONTYPES_LOOKUP = 'action_types_lookup'
+APPLICATION_DOCS = 'application_docs'
+APPLICATIONS = 'applications'
+APPLICATION_DOCSTYPE_LOOKUP = "application_docs_type_lookup"
+MARKETINGSTATUS = "marketing_status"
+MARKETINGSTATUS_LOOKUP = "marketing_status_lookup"
+PRODUCTS = "products"
+SUBMISSION_CLASS_LOOKUP = "submission_class_lookup"
+SUBMISSION_PROPERTY_TYPE = "submission_property_type"
+SUBMISSIONS = "submissions"
+TE = "te"
+## bookkeeping of the incremental refresh, rows keyed by FDA_Files key
+LOAD_STATE = "load_state"
+ROW_FINGERPRINTS = "row_fingerprints"
+
+# Column types
+INTEGER = "integer"
+STRING = "string"
+
+SQL_TYPES = {
+    INTEGER: Integer,
+    STRING: String
+}
+
+
+class TableSpec(object):
+    """
+    One Drugs@FDA text file: the table it loads into, its columns in file order
+    and their types.
+    """
+    def __init__(self, source, table, columns, primary_key=(), depends_on=(), indexes=()):
+        self.source = source
+        self.filename = FDA_Files[source]
+        self.table = table
+        self.columns = columns
+        self.primary_key = tuple(primary_key)
+        ## FDA_Files keys of the lookup tables this table references
+        self.depends_on = tuple(depends_on)
+        ## secondary indexes, each a list of columns, built after a bulk load
+        self.indexes = [tuple(index) for index in indexes]
+
+        ## compiled once: column groups used by convert
+        self.column_names = [name for name, _ in columns]
+        self.integer_columns = [name for name, kind in columns if kind == INTEGER]
+        self.string_columns = [name for name, kind in columns if kind == STRING]
+
+        placeholders = ",".join(["?"] * len(columns))
+        names = ",".join([f'"{name}"' for name in self.column_names])
+        self.insert_sql = f'INSERT or IGNORE INTO {table} ({names}) VALUES ({placeholders})'
+
+    def sqlalchemy_table(self, metadata):
+        """
+        Build the SQLAlchemy Table for this spec on metadata
+        """
+        columns = [Column(name, SQL_TYPES[kind], primary_key=name in self.primary_key)
+                   for name, kind in self.columns]
+        return Table(self.table, metadata, *columns)
+
+    def matches(self, table_info):
+        """
+        Whether an existing table has this spec's columns, in order, and
+        primary key
+
+        Args:
+            table_info (list): rows of PRAGMA table_info for the table
+        """
+        columns = [row[1] for row in table_info]
+        primary_key = [row[1] for row in sorted(table_info, key=lambda row: row[5]) if row[5]]
+        ## SQLAlchemy declares a composite key in column order
+        return (columns == self.column_names and
+                primary_key == [name for name in self.column_names if name in self.primary_key])
+
+    def index_ddl(self):
+        """
+        CREATE INDEX statements for the secondary indexes of this table
+        """
+        statements = []
+        for index in self.indexes:
+            name = "ix_{}_{}".format(self.table, "_".join(index))
+            columns = ",".join([f'"{column}"' for column in index])
+            statements.append(f"CREATE INDEX IF NOT EXISTS {name} ON {self.table} ({columns})")
+        return statements
+
+    def frame(self, batch):
+        """
+        Coerce a batch of raw string rows to typed columns in one pass.
+
+        Integer columns become nullable Int64, string columns are stripped and
+        empty cells become missing values. Raises ValueError if an integer
+        column holds a non numeric value.
+        """
+        width = len(self.columns)
+        frame = pd.DataFrame([row[:width] for row in batch], columns=self.column_names, dtype=object)
+
+        for name in self.integer_columns:
+            cells = frame[name].str.strip()
+            frame[name] = pd.to_numeric(cells.mask(cells == "", np.nan)).astype("Int64")
+
+        for name in self.string_columns:
+            cells = frame[name].str.strip()
+            frame[name] = cells.mask(cells == "")
+
+        return frame
+
+    def convert(self, batch):
+        """
+        Convert a batch of raw string rows into tuples ready for executemany
+        """
+        frame = self.frame(batch)
+        frame = frame.astype(object).where(frame.notna(), None)
+        return list(frame.itertuples(index=False, name=None))
+
+
+TABLES = {
+    #ActionTypes_LookupID	ActionTypes_LookupDescription	SupplCategoryLevel1Code	SupplCategoryLevel2Code
+    "ActionTypes_Lookup": TableSpec("ActionTypes_Lookup", ACTIONTYPES_LOOKUP, [
+        ("id", INTEGER),
+        ("description", STRING),
+        ("supplCategoryLevel1Code", STRING),
+        ("supplCategoryLevel2Code", STRING)],
+        primary_key=["id"]),
+
+    ## ApplicationDocsID	ApplicationDocsTypeID	ApplNo	SubmissionType	SubmissionNo	ApplicationDocsTitle	ApplicationDocsURL	ApplicationDocsDate
+    "ApplicationDocs": TableSpec("ApplicationDocs", APPLICATION_DOCS, [
+        ("id", INTEGER),
+        ("docsTypeId", INTEGER),
+        ("applNo", INTEGER),
+        ("submissionType", STRING),
+        ("submissionNo", INTEGER),
+        ("applicationDocsTitle", STRING),
+        ("applicationDocsURL", STRING),
+        ("applicationDocsDate", STRING)],
+        primary_key=["id"],
+        depends_on=["ApplicationsDocsType_Lookup"],
+        indexes=[["applNo", "submissionType", "submissionNo"]]),
+
+    #ApplNo	ApplType	ApplPublicNotes	SponsorName
+    # 000004	NDA		PHARMICS
+    "Applications": TableSpec("Applications", APPLICATIONS, [
+        ("applNo", INTEGER),
+        ("applType", STRING),
+        ("applPublicNotes", STRING),
+        ("sponsorName", STRING)],
+        primary_key=["applNo"],
+        indexes=[["sponsorName"]]),
+
+    # ApplicationDocsType_Lookup_ID	ApplicationDocsType_Lookup_Description
+    "ApplicationsDocsType_Lookup": TableSpec("ApplicationsDocsType_Lookup", APPLICATION_DOCSTYPE_LOOKUP, [
+        ("id", INTEGER),
+        ("description", STRING)],
+        primary_key=["id"]),
+
+    # MarketingStatusID	ApplNo	ProductNo
+    #3	000004	004
+    ## MarketingStatusID is a status code, a product has exactly one status
+    "MarketingStatus": TableSpec("MarketingStatus", MARKETINGSTATUS, [
+        ("id", INTEGER),
+        ("applNo", INTEGER),
+        ("productNo", INTEGER)],
+        primary_key=["applNo", "productNo"],
+        depends_on=["MarketingStatus_Lookup"]),
+
+    #MarketingStatusID	MarketingStatusDescription
+    "MarketingStatus_Lookup": TableSpec("MarketingStatus_Lookup", MARKETINGSTATUS_LOOKUP, [
+        ("id", INTEGER),
+        ("description", STRING)],
+        primary_key=["id"]),
+
+    # ApplNo	ProductNo	Form	Strength	ReferenceDrug	DrugName	ActiveIngredient	ReferenceStandard
+    # 000004	004	SOLUTION/DROPS;OPHTHALMIC	1%	0	PAREDRINE	HYDROXYAMPHETAMINE HYDROBROMIDE	0
+    "Products": TableSpec("Products", PRODUCTS, [
+        ("applNo", INTEGER),
+        ("productNo", INTEGER),
+        ("form", STRING),
+        ("strength", STRING),
+        ("referenceDrug", STRING),
+        ("drugName", STRING),
+        ("activeIngredient", STRING),
+        ("referenceStandard", STRING)],
+        primary_key=["applNo", "productNo"],
+        indexes=[["drugName"], ["activeIngredient"]]),
+
+    # SubmissionClassCodeID	SubmissionClassCode	SubmissionClassCodeDescription
+    # 1	BIOEQUIV	Bioequivalence
+    "SubmissionClass_Lookup": TableSpec("SubmissionClass_Lookup", SUBMISSION_CLASS_LOOKUP, [
+        ("id", INTEGER),
+        ("submissionClassCode", STRING),
+        ("submissionClassDescription", STRING)],
+        primary_key=["id"]),
+
+    #ApplNo SubmissionType SubmissionNo SubmissionPropertyTypeCode SubmissionPropertyTypeID
+    #000159	ORIG      	1	Null	0
+    "SubmissionPropertyType": TableSpec("SubmissionPropertyType", SUBMISSION_PROPERTY_TYPE, [
+        ("applNo", INTEGER),
+        ("submissionType", STRING),
+        ("submissionNo", INTEGER),
+        ("submissionPropertyTypeCode", STRING),
+        ("submissionPropertyTypeId", INTEGER)],
+        indexes=[["applNo", "submissionType", "submissionNo", "submissionPropertyTypeCode"]]),
+
+    # ApplNo	SubmissionClassCodeID	SubmissionType	SubmissionNo	SubmissionStatus	SubmissionStatusDate	SubmissionsPublicNotes	ReviewPriority
+    "Submissions": TableSpec("Submissions", SUBMISSIONS, [
+        ("applNo", INTEGER),
+        ("submissionClassCodeId", INTEGER),
+        ("submissionType", STRING),
+        ("submissionNo", INTEGER),
+        ("submissionStatus", STRING),
+        ("submissionStatusDate", STRING),
+        ("submissionsPublicNotes", STRING),
+        ("reviewPriority", STRING)],
+        primary_key=["applNo", "submissionType", "submissionNo"],
+        depends_on=["SubmissionClass_Lookup"]),
+
+    ## ApplNo	ProductNo	MarketingStatusID	TECode
+    # 003444	001	1	AA
+    "TE": TableSpec("TE", TE, [
+        ("applNo", INTEGER),
+        ("productNo", INTEGER),
+        ("marketingStatusId", INTEGER),
+        ("teCode", STRING)],
+        depends_on=["MarketingStatus_Lookup"],
+        indexes=[["applNo", "productNo", "marketingStatusId", "teCode"]]),
+}
+
+
+def load_levels(sources=None):
+    """
+    Group FDA_Files keys into load levels: every table comes after the tables it
+    depends on, tables within a level are independent of each other.
+
+    Args:
+        sources (list, optional): keys to schedule. Defaults to every table.
+
+    Returns:
+        list: list of lists of FDA_Files keys
+    """
+    pending = list(sources if sources is not None else TABLES.keys())
+    loaded = set()
+    levels = []
+    while pending:
+        level = [source for source in pending
+                 if all(dep in loaded or dep not in pending for dep in TABLES[source].depends_on)]
+        if not level:
+            raise ValueError(f"circular table dependencies: {pending}")
+        levels.append(level)
+        loaded.update(level)
+        pending = [source for source in pending if source not in loaded]
+    return levels
@@ -1,43 +1,32 @@
 #!/usr/bin/env python3
 
-import xml.etree.ElementTree as ET 
-from lxml import etree, objectify
+from lxml import etree
 import os 
-import json
 
-from drug_label import DrugLabel
+from drug_label import DrugLabel, parse_label
+from label_store import LabelStore
 
 """
 Remove xml prefixes
 """
 def remove_prefixes(xml_file):
-    parser = etree.XMLParser(huge_tree = True)
-    tree = etree.parse(xml_file, parser=parser)
-    root = tree.getroot()
-    for elem in root.getiterator():
-        if not hasattr(elem.tag, 'find'): 
-            continue  # (1)   
-        i = elem.tag.find('}')
-        if i >= 0:
-            elem.tag = elem.tag[i+1:]
-    objectify.deannotate(root, cleanup_namespaces=True)
+    tree = parse_label(xml_file)
     xml_str = etree.tostring(tree, xml_declaration = True)
-    
+
     return xml_str
 
 def get_json_dailyMed(xml_filename):
-    with open(os.path.join("data/dailyMed/xml",xml_filename),'r') as x:
-        xml_string = remove_prefixes(os.path.join("data/dailyMed/xml",xml_filename))
-        dlab = DrugLabel(xml_string)
-        response = dlab.process()
-        sections = (response.get("sections",""))
-        print(sections.keys())
+    dlab = DrugLabel(os.path.join("data/dailyMed/xml",xml_filename))
+    ## only the fields printed below; section keys are read without building the text
+    response = dlab.process(fields=["setId", "versionNumber", "effectiveTime", "title", "genericName",
+                                    "dosageForm", "substanceName"])
+    print(dlab.sections.keys())
 
-        return response
+    return response
 
-def get_json_fda(json_filename):
-    with open(os.path.join("data/fda",json_filename),'r') as j:
-        response = json.loads(j.read())
+def get_json_fda(label_id):
+    with LabelStore() as store:
+        response = store.get(label_id)
         print(response['set_id'])
         return response
         
@@ -47,8 +36,8 @@ if __name__ == "__main__":
     dailyMed_json = get_json_dailyMed(xml_file)
 
     print("fda sections")
-    fda_json_file = "ffbeae8a-8b63-4651-9b8e-817b3706faf5.json"
-    fda_json = get_json_fda(fda_json_file)
+    fda_label_id = "ffbeae8a-8b63-4651-9b8e-817b3706faf5"
+    fda_json = get_json_fda(fda_label_id)
 
 
     dailyMed_setId = dailyMed_json['setId']
@@ -0,0 +1,60 @@
+import os
+import sys
+import json
+from unittest import mock
+
+import pytest
+import requests
+
+## the modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fdaAPI import FDAAPI
+
+API_KEY = "secretkey"
+ENDPOINT = "https://api.example.test/drug/"
+
+
+def make_response(status=200, body=None, headers=None, url=ENDPOINT + "label.json"):
+    """
+    requests.Response with its content already loaded
+
+    Args:
+        body: bytes, or an object sent as JSON
+    """
+    response = requests.Response()
+    response.status_code = status
+    response.reason = requests.status_codes._codes.get(status, ("",))[0].replace("_", " ").title()
+    response.url = url
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode("utf-8")
+    response._content = body or b""
+    response._content_consumed = True
+    response.headers.update(headers or {})
+    return response
+
+
+@pytest.fixture
+def session():
+    return mock.Mock(spec=requests.Session)
+
+
+@pytest.fixture
+def make_api(tmp_path, session):
+    """
+    FDAAPI on the mocked session, saving to tmp_path, with no backoff delay
+    """
+    def make(**config):
+        settings = {"API_KEY": API_KEY, "API_ENDPOINT_PREFIX": ENDPOINT, "API_URLS": [],
+                    "DOWNLOAD_WORKERS": 2, "DOWNLOAD_RETRIES": 2, "DOWNLOAD_BACKOFF": 0}
+        settings.update(config)
+        path = tmp_path / "config.yaml"
+        path.write_text(json.dumps(settings))
+        api = FDAAPI(configuration_file=str(path), save_path=str(tmp_path), session=session, download=False)
+        apis.append(api)
+        return api
+
+    apis = []
+    yield make
+    for api in apis:
+        api.store.close()
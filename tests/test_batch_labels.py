@@ -0,0 +1,39 @@
+import sqlite3
+
+from batch_labels import SqliteSink, JsonlSink, process_labels
+from instrumentation import METRICS
+from benchmarks.generate import generate_labels
+
+
+def stored(path):
+    conn = sqlite3.connect(path)
+    try:
+        return (conn.execute("SELECT COUNT(*) FROM processed_labels").fetchone()[0],
+                conn.execute("SELECT COUNT(*) FROM label_errors").fetchone()[0])
+    finally:
+        conn.close()
+
+
+def test_sqlite_sink_commits_every_batch(tmp_path):
+    path = str(tmp_path / "labels.db")
+    sink = SqliteSink(path, batch_size=2)
+
+    sink.write({"file": "a.xml", "response": {"setId": "a", "versionNumber": "1"}})
+    assert stored(path) == (0, 0)
+    sink.write({"file": "b.xml", "error": "ValueError()"})
+    assert stored(path) == (1, 1)
+    sink.write({"file": "c.xml", "response": {"setId": "c", "versionNumber": "1"}})
+    sink.close()
+    assert stored(path) == (2, 1)
+
+
+def test_process_labels_merges_the_workers_metrics(tmp_path):
+    generate_labels(str(tmp_path / "labels"), 5)
+    METRICS.reset()
+
+    with JsonlSink(str(tmp_path / "out.jsonl")) as sink:
+        assert process_labels(str(tmp_path / "labels"), sink, workers=2, chunksize=2)["processed"] == 5
+
+    stages = {name: counts for name, labels, calls, seconds, max_seconds, counts in METRICS.snapshot()}
+    assert stages["xml_parse"] == {"documents": 5}
+    assert stages["sink_write"] == {"labels": 5}
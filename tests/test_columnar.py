@@ -0,0 +1,70 @@
+import pytest
+
+from schema import TABLES
+from main import read_data
+from quarantine import convert_batch
+from columnar import arrow_batches, row_batches
+
+HEADER = "ApplNo\tApplType\tApplPublicNotes\tSponsorName\r\n"
+
+
+def write(tmp_path, text):
+    path = tmp_path / "Applications.txt"
+    path.write_bytes(text.encode("utf-8"))
+    return str(path)
+
+
+def expected(spec, fname):
+    rows, rejects = [], []
+    for batch in read_data(fname, batch_size=2)[1]:
+        converted, rejected = convert_batch(spec, batch)
+        rows.extend(converted)
+        rejects.extend(rejected)
+    return rows, rejects
+
+
+def columnar(spec, fname):
+    rows, rejects = [], []
+    for converted, rejected in row_batches(spec, fname, batch_size=2):
+        rows.extend(converted)
+        rejects.extend(rejected)
+    return rows, rejects
+
+
+@pytest.mark.parametrize("text", [
+    ## CRLF and LF line ends, a file without a final newline
+    "4\tNDA\t\tACME\r\n5\tANDA\tnote\tOTHER INC.\n6\tBLA\t\tX",
+    ## blank and whitespace-only lines
+    "4\tNDA\t\tACME\r\n\r\n   \r\n\n5\tANDA\t\tOTHER\r\n \t \r\n",
+    "4\tNDA\t\tACME\r\n\t\t\t\r\n5\tANDA\t\tOTHER\r\n",
+    "4\tNDA\t\tACME\r\n \t \t\t \r\n5\tANDA\t\tOTHER\r\n",
+    ## quotes are plain characters, not field delimiters
+    '4\tNDA\t"a, b"\t"ACME"\r\n5\tANDA\t"unbalanced\tOTHER\r\n6\tBLA\t""\t\'X\'\r\n',
+    ## surrounding spaces, short and long rows
+    "  4 \t NDA \t\t ACME  \r\n5\tANDA\r\n6\tBLA\t\tX\tY\r\n",
+])
+def test_row_batches_match_read_data(tmp_path, text):
+    spec = TABLES["Applications"]
+    fname = write(tmp_path, HEADER + text)
+
+    rows, rejects = columnar(spec, fname)
+
+    assert (rows, rejects) == expected(spec, fname)
+    assert rows and not rejects
+    assert [row for batch in arrow_batches(spec, fname) for row in batch.to_pylist()] == [
+        dict(zip(spec.column_names, row)) for row in rows]
+
+
+def test_rows_that_do_not_convert_are_rejected(tmp_path):
+    spec = TABLES["Applications"]
+    fname = write(tmp_path, HEADER + "4\tNDA\t\tACME\r\n12x\tANDA\t\tOTHER\r\n6\tBLA\t\tX\r\n")
+    collected = []
+
+    rows, rejects = columnar(spec, fname)
+    batches = list(arrow_batches(spec, fname, batch_size=2, on_reject=collected.extend))
+
+    assert (rows, rejects) == expected(spec, fname)
+    assert [row for row, reason in rejects] == [["12x", "ANDA", "", "OTHER"]]
+    assert [row for batch in batches for row in batch.to_pylist()] == [
+        dict(zip(spec.column_names, row)) for row in rows]
+    assert collected == rejects
@@ -0,0 +1,133 @@
+import io
+import json
+import hashlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from fdaAPI import LAST_UPDATED
+from conftest import make_response
+
+SHARD_URL = "https://download.example.test/drug/label/drug-label-0001-of-0001.json.zip"
+
+
+def shard(labels, last_updated="2024-02-01"):
+    """
+    Zipped openFDA download holding labels
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zfile:
+        zfile.writestr("drug-label-0001-of-0001.json",
+                       json.dumps({"meta": {"last_updated": last_updated}, "results": labels}))
+    return buffer.getvalue()
+
+
+def test_download_file_streams_to_disk(make_api, session, tmp_path):
+    api = make_api()
+    session.get.return_value = make_response(body=b"x" * 5000, headers={"Content-Length": "5000"}, url=SHARD_URL)
+
+    path = api.download_file(SHARD_URL)
+
+    assert path == str(tmp_path / "drug-label-0001-of-0001.json.zip")
+    assert (tmp_path / "drug-label-0001-of-0001.json.zip").read_bytes() == b"x" * 5000
+    assert not (tmp_path / "drug-label-0001-of-0001.json.zip.part").exists()
+    assert session.get.call_args.kwargs["headers"] == {}
+
+
+def test_download_file_resumes_a_partial_file(make_api, session, tmp_path):
+    api = make_api()
+    (tmp_path / "drug-label-0001-of-0001.json.zip.part").write_bytes(b"head-")
+    (tmp_path / "drug-label-0001-of-0001.json.zip.part.etag").write_text('"v1"')
+    session.get.return_value = make_response(206, body=b"tail", url=SHARD_URL)
+
+    path = api.download_file(SHARD_URL)
+
+    assert session.get.call_args.kwargs["headers"] == {"Range": "bytes=5-", "If-Range": '"v1"'}
+    with open(path, "rb") as f:
+        assert f.read() == b"head-tail"
+    assert not (tmp_path / "drug-label-0001-of-0001.json.zip.part.etag").exists()
+
+
+def test_download_file_restarts_when_the_file_changed(make_api, session, tmp_path):
+    api = make_api()
+    (tmp_path / "drug-label-0001-of-0001.json.zip.part").write_bytes(b"stale")
+    (tmp_path / "drug-label-0001-of-0001.json.zip.part.etag").write_text('"v1"')
+    ## If-Range did not match: the server sends the whole new file
+    session.get.return_value = make_response(200, body=b"fresh", headers={"ETag": '"v2"'}, url=SHARD_URL)
+
+    with open(api.download_file(SHARD_URL), "rb") as f:
+        assert f.read() == b"fresh"
+
+
+def test_download_file_with_a_complete_partial(make_api, session, tmp_path):
+    api = make_api()
+    (tmp_path / "drug-label-0001-of-0001.json.zip.part").write_bytes(b"done")
+    session.get.return_value = make_response(416, url=SHARD_URL)
+
+    with open(api.download_file(SHARD_URL), "rb") as f:
+        assert f.read() == b"done"
+
+
+def test_download_retries_failures_and_checksum_mismatches(make_api, session):
+    body = b"payload"
+    api = make_api(DOWNLOAD_RETRIES=3, API_CHECKSUMS={SHARD_URL: hashlib.sha256(body).hexdigest()})
+    session.get.side_effect = [
+        requests.ConnectionError("reset"),
+        make_response(503, url=SHARD_URL),
+        make_response(body=b"corrupt", url=SHARD_URL),
+        make_response(body=body, url=SHARD_URL),
+    ]
+
+    path = api.download_with_retries(SHARD_URL)
+
+    with open(path, "rb") as f:
+        assert f.read() == body
+    with open(path + ".sha256") as f:
+        assert f.read().split()[0] == hashlib.sha256(body).hexdigest()
+    assert session.get.call_count == 4
+
+
+def test_download_gives_up_on_client_errors(make_api, session):
+    api = make_api()
+    session.get.return_value = make_response(404, url=SHARD_URL)
+
+    with pytest.raises(requests.HTTPError):
+        api.download_with_retries(SHARD_URL)
+    assert session.get.call_count == 1
+
+
+def test_download_all_parses_shards_into_the_store(make_api, session):
+    api = make_api()
+    urls = [SHARD_URL, SHARD_URL.replace("0001-of", "0002-of")]
+    labels = {
+        urls[0]: [{"id": "a", "set_id": "s1", "version": "1"}],
+        urls[1]: [{"id": "b", "set_id": "s2", "version": "3"}, {"id": "c", "set_id": "s3", "version": "1"}],
+    }
+    updated = {urls[0]: "2024-02-01", urls[1]: "2024-03-01"}
+    session.get.side_effect = lambda url, **kwargs: make_response(body=shard(labels[url], updated[url]), url=url)
+
+    results = api.download_all(urls)
+
+    assert all(results[url] for url in urls)
+    assert sorted(record["id"] for record in api.store) == ["a", "b", "c"]
+    assert api.store.get_state(LAST_UPDATED) == "2024-03-01"
+
+
+def test_download_all_reports_a_failed_shard(make_api, session):
+    api = make_api(DOWNLOAD_RETRIES=0)
+    session.get.return_value = make_response(body=b"not a zip", url=SHARD_URL)
+
+    assert api.download_all([SHARD_URL]) == {SHARD_URL: None}
+
+
+def test_last_updated_keeps_the_newest_across_threads(make_api):
+    api = make_api()
+    dates = [f"2024-{month:02d}-01" for month in range(1, 13)] * 4
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(api.record_last_updated, reversed(dates)))
+
+    assert api.store.get_state(LAST_UPDATED) == "2024-12-01"
+    api.record_last_updated("2024-06-01")
+    assert api.store.get_state(LAST_UPDATED) == "2024-12-01"
@@ -0,0 +1,28 @@
+import os
+
+from drug_label import DrugLabel, process_streaming
+from benchmarks.generate import generate_labels, spl_label, LOINC_SECTIONS
+
+
+def test_process_streaming_matches_process(tmp_path):
+    label_dir = str(tmp_path / "labels")
+    generate_labels(label_dir, 3)
+
+    for name in sorted(os.listdir(label_dir)):
+        path = os.path.join(label_dir, name)
+        assert process_streaming(path) == DrugLabel(path).process()
+
+
+def test_process_streaming_appends_repeated_sections():
+    ## more sections than LOINC codes: the names repeat
+    xml = spl_label("set-1", sections=len(LOINC_SECTIONS) + 3, depth=2).encode("utf-8")
+
+    response = process_streaming(xml)
+
+    assert response == DrugLabel(xml).process()
+    ## the product data section and one key per LOINC section
+    assert len(response["sections"]) == len(LOINC_SECTIONS) + 1
+    ## the repeat is appended, headed by its title
+    boxed_warning = response["sections"]["boxedWarningSection"]
+    assert boxed_warning.startswith("BOXED WARNING SECTION\n")
+    assert "\n16 Boxed Warning Section\n" in boxed_warning
@@ -0,0 +1,47 @@
+import sqlite3
+
+from label_cache import LabelCache, content_hash
+
+RESPONSE = {"setId": "set-1", "versionNumber": "2", "title": "A"}
+
+
+def test_entries_of_other_extractor_versions_are_not_served(tmp_path):
+    path = str(tmp_path / "cache.db")
+    key = content_hash(b"<document/>")
+    with LabelCache(path, extractor_version=1) as cache:
+        cache.put(key, RESPONSE)
+
+    with LabelCache(path, extractor_version=2) as cache:
+        assert cache.get(key) is None
+        assert cache.get_version("set-1", 2) is None
+        cache.put(key, dict(RESPONSE, title="B"))
+        assert cache.get(key)["title"] == "B"
+
+    with LabelCache(path, extractor_version=1) as cache:
+        assert cache.get(key)["title"] == "A"
+
+
+def test_invalidate(tmp_path):
+    path = str(tmp_path / "cache.db")
+    with LabelCache(path, extractor_version=1) as cache:
+        cache.put("old", RESPONSE)
+
+    with LabelCache(path, extractor_version=2) as cache:
+        cache.put("new", RESPONSE)
+        assert cache.invalidate() == 1
+        assert len(cache) == 1 and cache.get("new") == RESPONSE
+        assert cache.invalidate(everything=True) == 1
+        assert len(cache) == 0 and cache.total_bytes == 0
+
+
+def test_cache_without_extractor_versions_is_dropped(tmp_path):
+    path = str(tmp_path / "cache.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE label_cache (content_hash TEXT PRIMARY KEY, set_id TEXT, version TEXT, "
+                 "response BLOB, size INTEGER, last_access REAL)")
+    conn.execute("INSERT INTO label_cache VALUES ('old', 'set-1', '2', x'00', 1, 0)")
+    conn.commit()
+    conn.close()
+
+    with LabelCache(path) as cache:
+        assert len(cache) == 0 and cache.get("old") is None
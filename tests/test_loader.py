@@ -0,0 +1,44 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from main import FDADatabase
+from loader import load_all
+from benchmarks.generate import generate_tables
+
+
+class FailingDatabase(FDADatabase):
+    """
+    FDADatabase whose second transaction fails to begin
+    """
+    transactions = 0
+
+    @contextmanager
+    def transaction(self):
+        self.transactions += 1
+        if self.transactions == 2:
+            raise sqlite3.OperationalError("disk I/O error")
+        with super().transaction() as cur:
+            yield cur
+
+
+def test_load_all_raises_when_the_writer_fails(tmp_path):
+    data_dir = str(tmp_path / "fda")
+    generate_tables(data_dir, scale=0.01)
+    fdaDB = FailingDatabase(dbtype="sqlite", dbname=str(tmp_path / "fda.db"))
+    fdaDB.create_db_table()
+    outcome = []
+
+    def run():
+        try:
+            outcome.append(load_all(fdaDB, data_dir, workers=2, batch_size=50, queue_size=2))
+        except Exception as ex:
+            outcome.append(ex)
+
+    ## parser processes blocked on the full queues would hang load_all
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(60)
+
+    assert not thread.is_alive()
+    assert isinstance(outcome[0], sqlite3.OperationalError)
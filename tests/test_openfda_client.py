@@ -0,0 +1,101 @@
+import re
+import json
+import asyncio
+import logging
+
+import pytest
+import requests
+
+import openfda_client
+from openfda_client import OpenFDAClient
+from conftest import make_response, API_KEY, ENDPOINT
+
+
+@pytest.fixture
+def client(tmp_path, session):
+    path = tmp_path / "config.yaml"
+    path.write_text(json.dumps({"API_KEY": API_KEY, "API_ENDPOINT_PREFIX": ENDPOINT}))
+    client = OpenFDAClient(configuration_file=str(path), session=session, ttl=60, batch_terms=4)
+    yield client
+    client.close()
+
+
+def searched_values(params):
+    return re.findall(r'set_id:"([^"]+)"', params["search"])
+
+
+def serve(records_per_value, page_size):
+    """
+    session.get side effect answering set_id searches from records_per_value,
+    with the api's paging by limit and skip
+    """
+    def get(url, params, timeout):
+        matches = [record for value in searched_values(params) for record in records_per_value.get(value, [])]
+        if not matches:
+            return make_response(404)
+        skip = params.get("skip", 0)
+        return make_response(body={"results": matches[skip:skip + min(params["limit"], page_size)]})
+    return get
+
+
+def test_client_runs_in_successive_event_loops(client, session):
+    session.get.side_effect = serve({"a": [{"set_id": "a"}], "b": [{"set_id": "b"}]}, page_size=1000)
+    ## one query per value on one connection, so queries wait on the semaphore and bucket locks
+    client.batch_terms = 1
+    client.concurrency = 1
+
+    first = asyncio.run(client.lookup("label", "set_id", ["a", "x", "y"]))
+    second = asyncio.run(client.lookup("label", "set_id", ["b", "c"]))
+
+    assert first == {"a": [{"set_id": "a"}], "x": [], "y": []}
+    assert second == {"b": [{"set_id": "b"}], "c": []}
+
+
+def test_client_as_async_context_manager(tmp_path, session):
+    path = tmp_path / "config.yaml"
+    path.write_text(json.dumps({"API_ENDPOINT_PREFIX": ENDPOINT}))
+    session.get.side_effect = serve({"a": [{"set_id": "a"}]}, page_size=1000)
+
+    async def run():
+        async with OpenFDAClient(configuration_file=str(path), session=session) as client:
+            return await client.lookup("label", "set_id", ["a", "a"])
+
+    assert asyncio.run(run()) == {"a": [{"set_id": "a"}]}
+    assert session.get.call_count == 1
+
+
+def test_lookup_splits_batches_that_fill_a_page(client, session, monkeypatch):
+    monkeypatch.setattr(openfda_client, "MAX_LIMIT", 3)
+    records = {value: [{"set_id": value, "n": n} for n in range(2)] for value in "abcd"}
+    session.get.side_effect = serve(records, page_size=3)
+
+    found = asyncio.run(client.lookup("label", "set_id", list("abcd")))
+
+    assert found == records
+    ## abcd fills a page, so do ab and cd; the single values fit
+    searched = [searched_values(call.kwargs["params"]) for call in session.get.call_args_list]
+    assert searched[0] == list("abcd") and ["a"] in searched and ["d"] in searched
+
+
+def test_lookup_pages_a_single_value_with_skip(client, session, monkeypatch):
+    monkeypatch.setattr(openfda_client, "MAX_LIMIT", 2)
+    records = {"a": [{"set_id": "a", "n": n} for n in range(5)]}
+    session.get.side_effect = serve(records, page_size=2)
+
+    found = asyncio.run(client.lookup("label", "set_id", ["a"]))
+
+    assert found == records
+    assert [call.kwargs["params"].get("skip", 0) for call in session.get.call_args_list] == [0, 2, 4]
+
+
+def test_failed_queries_never_log_the_api_key(client, session, caplog, monkeypatch):
+    monkeypatch.setattr(openfda_client, "RETRIES", 1)
+    monkeypatch.setattr(openfda_client, "BACKOFF", 0)
+    session.get.side_effect = requests.ConnectionError(f"Max retries exceeded with url: /drug/label.json?api_key={API_KEY}")
+
+    with caplog.at_level(logging.DEBUG), pytest.raises(requests.ConnectionError) as raised:
+        asyncio.run(client.search("label", 'set_id:"a"'))
+
+    assert session.get.call_count == 2
+    assert API_KEY not in str(raised.value)
+    assert API_KEY not in caplog.text
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from schema import TABLES
+from columnar import arrow_batches
+from parquet_export import FDAParquetExport
+from benchmarks.generate import generate_tables
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    path = str(tmp_path / "fda")
+    generate_tables(path, scale=0.01, sources=["Applications", "ActionTypes_Lookup"])
+    return path
+
+
+def test_export_is_hive_partitioned_and_typed(tmp_path, data_dir):
+    export = FDAParquetExport(str(tmp_path / "parquet"), rows_per_file=100)
+
+    summary = export.export_all(data_dir, sources=["Applications", "ActionTypes_Lookup"])
+
+    applications = os.path.join(export.export_dir, TABLES["Applications"].table)
+    assert sorted(os.listdir(applications)) == ["applType=ANDA", "applType=BLA", "applType=NDA"]
+    assert os.listdir(os.path.join(export.export_dir, TABLES["ActionTypes_Lookup"].table)) == ["part-0.parquet"]
+    table = export.dataset("Applications").to_table()
+    assert table.num_rows == summary["Applications"]
+    assert table.schema.field("applNo").type == pa.int64()
+    nda = export.dataset("Applications").to_table(filter=pc.field("applType") == "NDA")
+    assert 0 < nda.num_rows < table.num_rows
+    assert set(nda.column("applType").to_pylist()) == {"NDA"}
+
+
+def test_rows_that_do_not_convert_are_recorded(tmp_path, data_dir):
+    with open(os.path.join(data_dir, TABLES["Applications"].filename), "a") as f:
+        f.write("12x\tNDA\t\tACME\r\n")
+    export = FDAParquetExport(str(tmp_path / "parquet"))
+
+    summary = export.export_all(data_dir, sources=["Applications"])
+
+    assert summary["rejected"] == {"Applications": 1}
+    assert export.dataset("Applications").count_rows() == summary["Applications"] > 0
+    rejects = pq.read_table(os.path.join(export.export_dir, "rejected_rows", "applications.parquet")).to_pylist()
+    assert [(reject["stage"], reject["row_data"]) for reject in rejects] == [
+        ("convert", '["12x", "NDA", "", "ACME"]')]
+
+
+def test_arrow_batches_raise_on_rows_that_do_not_convert(data_dir):
+    spec = TABLES["Applications"]
+    with open(os.path.join(data_dir, spec.filename), "a") as f:
+        f.write("12x\tNDA\t\tACME\r\n")
+
+    with pytest.raises(ValueError, match="do not convert"):
+        list(arrow_batches(spec, os.path.join(data_dir, spec.filename)))
+
+
+def test_failed_export_keeps_the_previous_table(tmp_path, data_dir):
+    spec = TABLES["Applications"]
+    export = FDAParquetExport(str(tmp_path / "parquet"))
+    rows = export.export_all(data_dir, sources=["Applications"])["Applications"]
+
+    def failing():
+        yield from arrow_batches(spec, os.path.join(data_dir, spec.filename), batch_size=100)
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        export.export_table(spec, failing())
+
+    assert not os.path.exists(os.path.join(export.export_dir, spec.table + ".tmp"))
+    assert export.dataset("Applications").count_rows() == rows
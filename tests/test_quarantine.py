@@ -0,0 +1,69 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from schema import TABLES
+from quarantine import bisect, convert_batch, insert_batch
+
+
+def test_bisect_isolates_failing_items():
+    def attempt(part):
+        if any(item < 0 for item in part):
+            raise ValueError("negative")
+        return list(part)
+
+    results, rejects = bisect([1, -2, 3, 4, -5, 6], attempt, (ValueError,))
+
+    assert [item for part in results for item in part] == [1, 3, 4, 6]
+    assert rejects == [(-2, "ValueError('negative')"), (-5, "ValueError('negative')")]
+
+
+def test_bisect_raises_other_errors():
+    def attempt(part):
+        raise KeyError("broken")
+
+    with pytest.raises(KeyError):
+        bisect([1, 2], attempt, (ValueError,))
+
+
+def test_convert_batch_rejects_rows_that_do_not_convert():
+    spec = TABLES["MarketingStatus"]
+    batch = [["1", "98", "2"], ["2", "12x", "1"], ["3", " 99 ", ""]]
+
+    rows, rejects = convert_batch(spec, batch)
+
+    assert rows == [(1, 98, 2), (3, 99, None)]
+    assert [row for row, reason in rejects] == [["2", "12x", "1"]]
+    assert convert_batch(spec, []) == ([], [])
+
+
+@pytest.fixture
+def cur():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.execute("CREATE TABLE checked (id INTEGER, value INTEGER CHECK (value >= 0))")
+    cur = conn.cursor()
+    cur.execute("BEGIN")
+    yield cur
+    conn.close()
+
+
+def test_insert_batch_rejects_rows_the_database_refuses(cur):
+    spec = SimpleNamespace(insert_sql="INSERT INTO checked VALUES (?,?)")
+
+    inserted, rejects = insert_batch(cur, spec, [(1, 1), (2, -1), (3, 3)])
+
+    assert inserted == 2
+    assert [row for row, reason in rejects] == [(2, -1)]
+    assert "CHECK constraint failed" in rejects[0][1]
+    assert cur.execute("SELECT id FROM checked ORDER BY id").fetchall() == [(1,), (3,)]
+
+
+def test_insert_batch_raises_database_errors(cur):
+    ## a table built with an older schema: every row fails alike
+    spec = SimpleNamespace(insert_sql="INSERT INTO checked (id, value, added) VALUES (?,?,?)")
+
+    with pytest.raises(sqlite3.OperationalError, match="no column named added"):
+        insert_batch(cur, spec, [(1, 1, "a"), (2, 2, "b")])
+    ## the savepoint was rolled back and released, the transaction goes on
+    assert insert_batch(cur, SimpleNamespace(insert_sql="INSERT INTO checked VALUES (?,?)"), [(4, 4)]) == (1, [])
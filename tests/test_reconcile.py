@@ -0,0 +1,29 @@
+from reconcile import compare, openfda_row, MATCH
+
+
+def joined(dailymed, openfda):
+    return ("set-1",) + dailymed + openfda[1:]
+
+
+def test_compares_fields_openfda_labels_carry():
+    record = {"id": "id-1", "set_id": "set-1", "version": "2", "effective_time": "20240105",
+              "openfda": {"brand_name": ["Azolechlor"], "generic_name": ["AZOLECHLOR"],
+                          "substance_name": ["AZOLECHLOR"], "manufacturer_name": ["Acme Inc."]}}
+    dailymed = (2, "20240105", "label.xml", "AZOLECHLOR", "AZOLECHLOR", "AZOLECHLOR", "OTHER INC.")
+
+    entry = compare(joined(dailymed, openfda_row(record)))
+
+    assert entry["status"] == MATCH
+    assert entry["diffs"] == {"manufacturer": {"dailymed": "OTHER INC.", "openfda": "ACME INC."}}
+    assert entry["notCompared"] == ["title", "dosageForm"]
+
+
+def test_fields_openfda_lacks_are_not_comparable():
+    record = {"id": "id-1", "set_id": "set-1", "version": "2", "effective_time": "20240105",
+              "openfda": {"generic_name": ["AZOLECHLOR"]}}
+    dailymed = (2, "20240105", "label.xml", "AZOLECHLOR", "AZOLECHLOR", "AZOLECHLOR", "ACME INC.")
+
+    entry = compare(joined(dailymed, openfda_row(record)))
+
+    assert "diffs" not in entry
+    assert entry["notCompared"] == ["title", "dosageForm", "drugName", "substanceName", "manufacturer"]
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from main import FDADatabase
+from schema import TABLES
+from loader import load_all
+from refresh import refresh
+from benchmarks.generate import generate_tables
+
+## applNo 98, productNo 2 listed twice with different statuses
+DUPLICATE_KEY_ROWS = "3\t98\t2\r\n4\t98\t2\r\n"
+## TE has no primary key: identical rows are all loaded
+DUPLICATE_TE_ROW = "000098\t002\t1\tAB\r\n"
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    path = str(tmp_path / "fda")
+    generate_tables(path, scale=0.01)
+    append(path, "MarketingStatus", DUPLICATE_KEY_ROWS)
+    append(path, "TE", DUPLICATE_TE_ROW * 3)
+    return path
+
+
+def append(data_dir, source, text):
+    with open(os.path.join(data_dir, TABLES[source].filename), "a") as f:
+        f.write(text)
+
+
+def database(path):
+    fdaDB = FDADatabase(dbtype="sqlite", dbname=path)
+    fdaDB.create_db_table()
+    return fdaDB
+
+
+def table_rows(fdaDB):
+    with fdaDB.transaction() as cur:
+        return {spec.table: sorted(cur.execute(f"SELECT * FROM {spec.table}").fetchall(), key=repr)
+                for spec in TABLES.values()}
+
+
+def te_copies(fdaDB):
+    with fdaDB.transaction() as cur:
+        return cur.execute(f"SELECT COUNT(*) FROM {TABLES['TE'].table} WHERE applNo = 98 AND productNo = 2 "
+                           "AND teCode = 'AB'").fetchone()[0]
+
+
+def test_refresh_loads_what_the_full_load_does(tmp_path, data_dir):
+    loaded = database(str(tmp_path / "full.db"))
+    load_all(loaded, data_dir, workers=1)
+    refreshed = database(str(tmp_path / "refresh.db"))
+    summary = refresh(refreshed, data_dir)
+
+    assert all(result["status"] == "refreshed" for result in summary.values())
+    assert table_rows(refreshed) == table_rows(loaded)
+    ## the first row of a duplicated key is kept
+    with refreshed.transaction() as cur:
+        rows = cur.execute(f"SELECT id FROM {TABLES['MarketingStatus'].table} WHERE applNo = 98 AND productNo = 2")
+        assert rows.fetchall() == [(3,)]
+    ## every copy of an identical row in a table without a primary key
+    assert te_copies(refreshed) == 3
+    with refreshed.transaction() as cur:
+        assert summary["TE"]["rows"] == cur.execute(f"SELECT COUNT(*) FROM {TABLES['TE'].table}").fetchone()[0]
+
+
+def test_refresh_follows_changed_copies_of_a_row(tmp_path, data_dir):
+    refreshed = database(str(tmp_path / "refresh.db"))
+    refresh(refreshed, data_dir)
+
+    append(data_dir, "TE", DUPLICATE_TE_ROW)
+    summary = refresh(refreshed, data_dir, sources=["TE"])
+    assert summary["TE"]["upserted"] == 4 and summary["TE"]["deleted"] == 0
+    assert te_copies(refreshed) == 4
+
+    loaded = database(str(tmp_path / "full.db"))
+    load_all(loaded, data_dir, workers=1)
+    assert table_rows(refreshed) == table_rows(loaded)
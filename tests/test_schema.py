@@ -0,0 +1,46 @@
+import sqlite3
+
+from main import FDADatabase
+from schema import TABLES, LOAD_STATE, ROW_FINGERPRINTS
+from refresh import STATE_DDL
+
+
+def baseline_database(path):
+    """ a database created before Products gained referenceStandard and MarketingStatus its key """
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE {TABLES['Products'].table} (applNo INTEGER, productNo INTEGER, form TEXT, "
+                 "strength TEXT, referenceDrug TEXT, drugName TEXT, activeIngredient TEXT, "
+                 "PRIMARY KEY (applNo, productNo))")
+    conn.execute(f"CREATE TABLE {TABLES['MarketingStatus'].table} (id INTEGER, applNo INTEGER, "
+                 "productNo INTEGER, PRIMARY KEY (id, applNo, productNo))")
+    conn.execute(f"CREATE TABLE {TABLES['Applications'].table} (applNo INTEGER PRIMARY KEY, applType TEXT, "
+                 "applPublicNotes TEXT, sponsorName TEXT)")
+    conn.execute(f"INSERT INTO {TABLES['Applications'].table} VALUES (4, 'NDA', '', 'ACME')")
+    for ddl in STATE_DDL:
+        conn.execute(ddl)
+    for source in ("Products", "Applications"):
+        conn.execute(f"INSERT INTO {LOAD_STATE} VALUES (?, ?, 'abc', 1, '2024-01-01')", (source, source))
+        conn.execute(f"INSERT INTO {ROW_FINGERPRINTS} VALUES (?, '4', 'abc')", (source,))
+    conn.commit()
+    conn.close()
+
+
+def test_tables_that_differ_from_the_schema_are_recreated(tmp_path):
+    path = str(tmp_path / "fda.db")
+    baseline_database(path)
+    fdaDB = FDADatabase(dbtype="sqlite", dbname=path)
+
+    fdaDB.create_db_table()
+
+    with fdaDB.transaction() as cur:
+        for spec in TABLES.values():
+            assert spec.matches(cur.execute(f"PRAGMA table_info({spec.table})").fetchall()), spec.table
+        ## the outdated table's refresh state is gone, the others' kept
+        assert cur.execute(f"SELECT source FROM {LOAD_STATE}").fetchall() == [("Applications",)]
+        assert cur.execute(f"SELECT source FROM {ROW_FINGERPRINTS}").fetchall() == [("Applications",)]
+        assert cur.execute(f"SELECT COUNT(*) FROM {TABLES['Applications'].table}").fetchone() == (1,)
+        cur.execute(TABLES["Products"].insert_sql, (4, 4, "TABLET", "1MG", "0", "A", "B", "0"))
+        cur.execute(TABLES["MarketingStatus"].insert_sql, (1, 4, 4))
+        cur.execute(TABLES["MarketingStatus"].insert_sql, (2, 4, 4))
+        assert cur.execute(f"SELECT id FROM {TABLES['MarketingStatus'].table}").fetchall() == [(1,)]
+    assert fdaDB.drop_outdated_tables() == []
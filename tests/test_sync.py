@@ -0,0 +1,130 @@
+import logging
+
+import pytest
+import requests
+
+import fdaAPI
+from fdaAPI import LAST_UPDATED
+from conftest import make_response, API_KEY, ENDPOINT
+
+LABEL_URL = ENDPOINT + "label.json"
+
+
+def label(number, version="1"):
+    return {"id": f"id-{number}", "set_id": f"set-{number}", "version": version, "effective_time": "20240105"}
+
+
+def page(labels, total=None, last_updated="2024-01-10"):
+    return {"meta": {"last_updated": last_updated, "results": {"total": total or len(labels)}}, "results": labels}
+
+
+def test_sync_follows_search_after_links(make_api, session):
+    api = make_api()
+    api.store.set_state(LAST_UPDATED, "2024-01-01")
+    next_url = LABEL_URL + "?search=x&limit=2&search_after=0%3Did-2"
+    session.get.side_effect = [
+        make_response(body=page([label(1), label(2)], total=3), headers={"Link": f'<{next_url}>; rel="next"'}),
+        make_response(body=page([label(3)], total=3), url=next_url),
+    ]
+
+    assert api.sync(until="2024-01-31") == 3
+
+    first, second = session.get.call_args_list
+    assert first.args == (LABEL_URL,)
+    assert first.kwargs["params"]["search"] == "effective_time:[20240101 TO 20240131]"
+    assert first.kwargs["params"]["api_key"] == API_KEY
+    assert second.args == (next_url,)
+    assert second.kwargs["params"] == {"api_key": API_KEY}
+    assert api.store.get("id-3") == label(3)
+    assert api.store.get_state(LAST_UPDATED) == "2024-01-10"
+
+
+def test_sync_pages_with_skip_without_links(make_api, session):
+    api = make_api(SYNC_PAGE_SIZE=2)
+    session.get.side_effect = [
+        make_response(body=page([label(1), label(2)], total=3)),
+        make_response(body=page([label(3)], total=3)),
+    ]
+
+    assert api.sync(since="2024-01-01", until="2024-01-31") == 3
+    assert [call.kwargs["params"].get("skip") for call in session.get.call_args_list] == [2, 2]
+    assert len(api.store) == 3
+
+
+def test_sync_without_matches(make_api, session):
+    api = make_api()
+    session.get.return_value = make_response(404, body={"error": {"code": "NOT_FOUND"}})
+
+    assert api.sync(since="2024-01-01") == 0
+    assert len(api.store) == 0
+    assert api.store.get_state(LAST_UPDATED) is None
+
+
+def test_sync_without_matches_keeps_last_updated(make_api, session):
+    api = make_api()
+    api.store.set_state(LAST_UPDATED, "2024-01-01")
+    session.get.return_value = make_response(404, body={"error": {"code": "NOT_FOUND"}})
+
+    assert api.sync() == 0
+    assert api.store.get_state(LAST_UPDATED) == "2024-01-01"
+
+
+def test_sync_stopped_at_the_skip_limit_keeps_last_updated(make_api, session, monkeypatch):
+    monkeypatch.setattr(fdaAPI, "MAX_SKIP", 3)
+    api = make_api(SYNC_PAGE_SIZE=2)
+    api.store.set_state(LAST_UPDATED, "2024-01-01")
+    session.get.side_effect = [make_response(body=page([label(n), label(n + 1)], total=10)) for n in (1, 3, 5)]
+
+    assert api.sync() == 4
+    assert session.get.call_count == 2
+    assert api.store.get_state(LAST_UPDATED) == "2024-01-01"
+
+
+def test_sync_needs_a_starting_point(make_api, session):
+    assert make_api().sync() is None
+    session.get.assert_not_called()
+
+
+def test_fetch_page_retries_throttled_requests(make_api, session):
+    api = make_api()
+    session.get.side_effect = [make_response(429), requests.ConnectionError("reset"), make_response(body=page([]))]
+
+    assert api.fetch_page(LABEL_URL, {}).json()["results"] == []
+    assert session.get.call_count == 3
+
+
+def test_fetch_page_gives_up_after_retries(make_api, session):
+    api = make_api(DOWNLOAD_RETRIES=1)
+    session.get.return_value = make_response(503)
+
+    with pytest.raises(requests.HTTPError):
+        api.fetch_page(LABEL_URL, {})
+    assert session.get.call_count == 2
+
+
+def test_fetch_page_does_not_retry_client_errors(make_api, session):
+    api = make_api()
+    session.get.return_value = make_response(400)
+
+    with pytest.raises(requests.HTTPError):
+        api.fetch_page(LABEL_URL, {})
+    assert session.get.call_count == 1
+
+
+@pytest.mark.parametrize("failure", [
+    make_response(503, url=f"{LABEL_URL}?search=x&api_key={API_KEY}"),
+    make_response(401, url=f"{LABEL_URL}?search=x&api_key={API_KEY}"),
+    requests.ConnectionError(f"Max retries exceeded with url: /drug/label.json?api_key={API_KEY}&skip=2"),
+])
+def test_fetch_page_never_logs_the_api_key(make_api, session, caplog, failure):
+    api = make_api(DOWNLOAD_RETRIES=1)
+    if isinstance(failure, Exception):
+        session.get.side_effect = failure
+    else:
+        session.get.return_value = failure
+
+    with caplog.at_level(logging.DEBUG), pytest.raises(requests.RequestException) as raised:
+        api.fetch_page(LABEL_URL, {"search": "x", "api_key": API_KEY})
+
+    assert API_KEY not in str(raised.value)
+    assert API_KEY not in caplog.text
@@ -3,6 +3,16 @@
 import os
 import yaml
 import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+## configuration keys never written to logs
+SECRET_KEYS = ("API_KEY",)
+## query parameters masked before a url is logged
+SECRET_PARAMS = ("api_key",)
+SECRET_PARAMS_PATTERN = re.compile(r"\b((?:%s)=)[^&\s'\"]+" % "|".join(SECRET_PARAMS), re.IGNORECASE)
 
 
 def read_configuration(config_file_path = "config.yaml"):
@@ -16,10 +26,25 @@ def read_configuration(config_file_path = "config.yaml"):
     with open(config_file_path, 'r') as file:
         configuration = yaml.load(file, Loader=yaml.FullLoader)
 
-    print(configuration)
-    
+    logger.debug("configuration %s: %s", config_file_path, redact(configuration))
+
     return configuration
-    
+
+
+def redact(configuration):
+    """
+    Copy of a configuration dict that is safe to log
+    """
+    return {key: "***" if key in SECRET_KEYS and value else value for key, value in (configuration or {}).items()}
+
+
+def redact_url(text):
+    """
+    A url, or an error message quoting one, with the values of secret query
+    parameters masked, safe to log
+    """
+    return SECRET_PARAMS_PATTERN.sub(r"\1***", str(text))
+
 
 def pretty_print_json_response(response):
     """